@@ -0,0 +1,543 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:softtabstop=4:shiftwidth=4:expandtab
+
+# Benchmark of pcapstats.py on synthetic traces.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+
+# python imports
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import shutil
+import subprocess
+import socket
+import struct
+import platform
+import tempfile
+import resource
+import cProfile
+import pstats
+import multiprocessing
+import logging
+
+import pcapstats
+
+MSS = 1000
+SNAPLEN = 96                # frames are written truncated like tcpdump -s 96, the analysis only needs the headers
+
+
+# ---- synthetic traces ----
+
+def tcpFrame(src, dst, sport, dport, seq, ack, flags, win, opts, length):
+    '''
+    Ethernet/IPv4/TCP frame with <length> bytes of (zero) payload
+    returns (frame, original length)
+    '''
+    opts += b'\x01' * (-len(opts) % 4)
+    tcp = struct.pack('!HHIIBBHHH', sport, dport, seq & 0xffffffff, ack & 0xffffffff,
+                      (20 + len(opts)) / 4 << 4, flags, win, 0, 0) + opts
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp) + length, 0, 0, 64, 6, 0, src, dst)
+    frame = b'\x00\x01\x02\x03\x04\x05\x00\x01\x02\x03\x04\x06\x08\x00' + ip + tcp
+    return frame, len(frame) + length
+
+def tsOpt(tsval, tsecr):
+    return b'\x01\x01\x08\x0a' + struct.pack('!II', tsval & 0xffffffff, tsecr & 0xffffffff)
+
+def sackOpt(blocks):
+    if not blocks:
+        return b''
+    return b'\x01\x01' + struct.pack('!BB', 5, 2 + 8 * len(blocks)) + \
+           b''.join([struct.pack('!II', s & 0xffffffff, e & 0xffffffff) for s, e in blocks])
+
+
+class Flow:
+    '''
+    A simulated bulk transfer from a server to a client with SACK and
+    timestamps: fixed window (no slow start), fast retransmit on three
+    duplicate ACKs, retransmission timeouts with exponential backoff.
+    Data segments are lost with probability loss, delayed by up to 1.5 RTT
+    with probability reorder, and everything is lost during blackouts
+    (list of [begin, end]).
+    '''
+    def __init__(self, trace, n, start, segments, window, loss, reorder, blackouts, rtt):
+        self.trace = trace
+        self.client = socket.inet_aton('10.%d.%d.%d' % (n / 62500 % 250, n / 250 % 250, n % 250 + 1))
+        self.server = socket.inet_aton('192.168.1.1')
+        self.cport = 1024 + n % 60000
+        self.sport = 80
+        self.isn = 1000 + n * 7
+        self.cisn = 5000 + n * 3
+        self.segments = segments
+        self.window = window
+        self.loss = loss
+        self.reorder = reorder
+        self.blackouts = blackouts
+        self.rtt = rtt
+        self.una = 0            # first unacknowledged segment
+        self.nxt = 0            # next new segment
+        self.dupacks = 0
+        self.recovery = None    # segment number ending fast recovery
+        self.retransmitted = set()
+        self.sacked = set()
+        self.timer = None       # deadline of the retransmission timer
+        self.rto = 1.0
+        self.received = set()
+        self.rcv_nxt = 0
+        self.blocks = []        # SACK blocks of the receiver (segment numbers), most recent first
+        self.tsrecent = 0
+        self.done = False
+        trace.at(start, self.connect)
+
+    def clock(self, t):
+        return int(t * 1000)
+
+    def toServer(self, t, seq, ack, flags, opts):
+        self.trace.emit(t, tcpFrame(self.client, self.server, self.cport, self.sport, seq, ack, flags, 1024, opts, 0))
+
+    def connect(self, t):
+        syn = b'\x02\x04' + struct.pack('!H', MSS) + b'\x04\x02' + tsOpt(self.clock(t), 0) + b'\x03\x03\x07'
+        self.toServer(t, self.cisn, 0, 0x02, syn)
+        t2 = t + self.rtt
+        self.trace.emit(t2, tcpFrame(self.server, self.client, self.sport, self.cport, self.isn, self.cisn + 1, 0x12, 65535,
+                                     syn[:8] + tsOpt(self.clock(t2), self.clock(t)) + syn[-3:], 0))
+        t3 = t2 + self.rtt / 2
+        self.toServer(t3, self.cisn + 1, self.isn + 1, 0x10, tsOpt(self.clock(t3), self.clock(t2)))
+        self.trace.at(t3 + 0.0001, self.send)
+
+    def blackout(self, t):
+        for begin, end in self.blackouts:
+            if begin <= t < end:
+                return True
+        return False
+
+    def segment(self, t, i):
+        tsval = self.clock(t)
+        self.trace.emit(t, tcpFrame(self.server, self.client, self.sport, self.cport, self.isn + 1 + i * MSS, self.cisn + 1,
+                                    0x18, 1024, tsOpt(tsval, self.tsrecent), MSS))
+        if self.blackout(t) or self.trace.random() < self.loss:
+            return
+        delay = self.rtt / 2
+        if self.trace.random() < self.reorder:
+            delay += self.rtt * self.trace.random() * 1.5
+        self.trace.at(t + delay, lambda t: self.receive(t, i, tsval))
+
+    def send(self, t):
+        if self.done:
+            return
+        while self.nxt < self.segments and self.nxt - self.una < self.window:
+            self.segment(t, self.nxt)
+            self.nxt += 1
+            t += 0.0001
+        if self.timer == None and self.una < self.nxt:
+            self.arm(t)
+        if self.una >= self.segments:
+            self.done = True
+            fin = self.isn + 1 + self.segments * MSS
+            self.trace.emit(t, tcpFrame(self.server, self.client, self.sport, self.cport, fin, self.cisn + 1, 0x11, 1024,
+                                        tsOpt(self.clock(t), self.tsrecent), 0))
+            self.toServer(t + self.rtt, self.cisn + 1, fin + 1, 0x11, tsOpt(self.clock(t), self.clock(t)))
+
+    def arm(self, t):
+        deadline = self.timer = t + self.rto
+        self.trace.at(deadline, lambda t: self.timeout(t, deadline))
+
+    def timeout(self, t, deadline):
+        if self.done or self.timer != deadline:
+            return
+        if self.una >= self.nxt:
+            self.timer = None
+            return
+        self.recovery = None
+        self.dupacks = 0
+        self.segment(t, self.una)
+        self.retransmitted.add(self.una)
+        self.rto = min(self.rto * 2, 8.0)
+        self.arm(t)
+
+    def receive(self, t, i, tsval):
+        dsack = i in self.received or i < self.rcv_nxt
+        self.received.add(i)
+        while self.rcv_nxt in self.received:
+            self.rcv_nxt += 1
+        if i > self.rcv_nxt:
+            begin = i
+            while begin - 1 in self.received and begin - 1 >= self.rcv_nxt:
+                begin -= 1
+            end = i + 1
+            while end in self.received:
+                end += 1
+            self.blocks = [(begin, end)] + [b for b in self.blocks if not (b[0] >= begin and b[1] <= end) and b[1] > self.rcv_nxt]
+        else:
+            self.blocks = [b for b in self.blocks if b[0] > self.rcv_nxt]
+        blocks = self.blocks[:3]
+        if dsack:
+            blocks = [(i, i + 1)] + self.blocks[:2]
+        base = self.isn + 1
+        ack = self.rcv_nxt
+        self.tsrecent = self.clock(t)
+        opts = tsOpt(self.clock(t), tsval) + sackOpt([(base + b * MSS, base + e * MSS) for b, e in blocks])
+        arrival = t + self.rtt / 2
+        if self.blackout(arrival):
+            return
+        def acked(t):
+            self.toServer(t, self.cisn + 1, base + ack * MSS, 0x10, opts)
+            self.ack(t, ack, blocks)
+        self.trace.at(arrival, acked)
+
+    def ack(self, t, ack, blocks):
+        if self.done:
+            return
+        for begin, end in blocks:
+            self.sacked.update(range(begin, end))
+        if ack > self.una:
+            self.una = ack
+            self.dupacks = 0
+            self.rto = 1.0
+            self.timer = None
+            if self.recovery != None:
+                if self.una >= self.recovery:
+                    self.recovery = None
+                else:
+                    self.retransmit(t)
+        else:
+            self.dupacks += 1
+            if self.dupacks >= 3 and self.recovery == None and self.una < self.nxt:
+                self.recovery = self.nxt
+                self.retransmit(t)
+            elif self.recovery != None:
+                self.retransmit(t)
+        self.send(t + 0.0001)
+
+    def retransmit(self, t):
+        # retransmit the first hole below the highest SACKed segment
+        high = max(self.sacked) if self.sacked else self.una
+        for i in range(self.una, min(high, self.nxt)):
+            if i not in self.sacked and i not in self.retransmitted:
+                self.retransmitted.add(i)
+                self.segment(t, i)
+                return
+
+
+class Trace:
+    '''
+    Discrete event simulation of a set of flows, collects the frames seen
+    at the capture point (next to the server)
+    Only random() of the seeded generator is used, which gives the same
+    numbers in all Python versions, so a trace only depends on its parameters.
+    '''
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.random = self.rng.random
+        self.events = []
+        self.count = 0
+        self.frames = []
+
+    def at(self, t, fn):
+        self.count += 1
+        heapq.heappush(self.events, (t, self.count, fn))
+
+    def emit(self, t, frame):
+        self.frames.append((t, len(self.frames), frame))
+
+    def run(self):
+        while self.events:
+            t, n, fn = heapq.heappop(self.events)
+            fn(t)
+        self.frames.sort()
+
+    def write(self, filename):
+        f = open(filename, 'wb')
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, SNAPLEN, 1))
+        for t, n, (frame, length) in self.frames:
+            sec = int(t)
+            usec = int((t - sec) * 1E6)
+            frame = frame[:SNAPLEN]
+            f.write(struct.pack('<IIII', sec, usec, len(frame), length))
+            f.write(frame)
+        f.close()
+        return len(self.frames)
+
+
+def generate(filename, flows, segments, window=20, loss=0.01, reorder=0.01, blackouts=0, spread=5, seed=1):
+    '''
+    Write a synthetic trace to filename
+    flows: number of connections, starting within the first <spread> seconds
+    segments: data segments per connection (varied by up to +50%)
+    window: send window in segments
+    loss, reorder: probability of loss/reordering of a data segment (varied per connection)
+    blackouts: number of periods of 0.5-4 s per connection without any packets
+               getting through, causing RTOs with backoff
+    returns the number of packets
+    '''
+    trace = Trace(seed)
+    rnd = trace.random
+    for n in range(flows):
+        start = 1400000000 + rnd() * spread
+        rtt = 0.01 + rnd() * 0.19
+        periods = []
+        for i in range(blackouts):
+            begin = start + rnd() * (segments / window * rtt + 2)
+            periods.append([begin, begin + 0.5 + rnd() * 3.5])
+        Flow(trace, n, start, segments + int(rnd() * segments / 2), window,
+             loss * (0.5 + rnd()), reorder * (0.5 + rnd()), periods, rtt)
+    trace.run()
+    return trace.write(filename)
+
+
+SCENARIOS = [
+    # name, description, parameters of generate at scale 1
+    ('flows', 'many short connections', dict(flows=4000, segments=8, spread=60)),
+    ('sack', 'heavy loss, long SACK scoreboards', dict(flows=40, segments=1000, window=40, loss=0.08, reorder=0)),
+    ('reorder', 'heavy reordering', dict(flows=40, segments=1000, window=40, loss=0.005, reorder=0.15)),
+    ('rto', 'blackouts causing RTO storms', dict(flows=100, segments=400, loss=0.02, blackouts=2)),
+    ('bulk', 'few long-lived bulk transfers', dict(flows=4, segments=10000, window=64, loss=0.002, reorder=0.002)),
+]
+
+
+# ---- measurements ----
+
+# the SACK processing, the time spent in these is the "sack" phase
+SACK_CLASSES = (pcapstats.Scoreboard, pcapstats.SackHoles, pcapstats.Rexmits)
+SACK_METHODS = ('reorderSACK', 'sackRetrans', 'sackHoleTs', 'addReorExtent') # of Info
+
+def code(fn):
+    # (first line, name) of a function, as in profiler statistics
+    return (fn.__code__.co_firstlineno, fn.__code__.co_name)
+
+def sackShare(filename, fast):
+    '''
+    Profile the analysis of a trace
+    returns the share of the time in Info.addPacket spent in SACK processing
+    (the scoreboard, SACK holes, retransmission list and reorder detection)
+    '''
+    sackfuncs = set([code(pcapstats.Info.__dict__[name]) for name in SACK_METHODS])
+    for cls in SACK_CLASSES:
+        sackfuncs.update([code(fn) for fn in cls.__dict__.values() if hasattr(fn, '__code__')])
+    addPacket = code(pcapstats.Info.addPacket.__func__)
+    source = os.path.splitext(pcapstats.__file__)[0]
+
+    analyzer = pcapstats.Analyzer(netradar=False, fast=fast)
+    profile = cProfile.Profile()
+    profile.enable()
+    for ts, buf, linktype in pcapstats.openTrace(filename):
+        analyzer.feed(ts, buf, linktype)
+    profile.disable()
+
+    def ours(func):
+        return os.path.splitext(func[0])[0] == source and func[1:] in sackfuncs
+    total = 0
+    sack = 0
+    for func, (cc, nc, tt, ct, callers) in pstats.Stats(profile).stats.items():
+        if os.path.splitext(func[0])[0] == source and func[1:] == addPacket:
+            total += ct
+        elif ours(func):
+            # time of the calls coming from outside of the SACK processing
+            sack += sum([c[3] for caller, c in callers.items() if not ours(caller)])
+    if total == 0:
+        return 0
+    return min(1, sack / total)
+
+def measure(filename, fast=False, repeat=1):
+    '''
+    Run the stages of the analysis of a trace, each stage includes the ones before:
+    read the packets; + filter and decode; + connection lookup; full analysis;
+    then output. Per phase times are the differences, the best of <repeat> runs.
+    returns dict of results
+    '''
+    best = {}
+    def timed(stage, fn):
+        start = time.time()
+        result = fn()
+        t = time.time() - start
+        best[stage] = min(best.get(stage, t), t)
+        return result
+
+    def read():
+        n = 0
+        for ts, buf, linktype in pcapstats.openTrace(filename):
+            n += 1
+        return n
+
+    def run(info, addPacket=None):
+        analyzer = pcapstats.Analyzer(netradar=False, fast=fast)
+        if info:
+            analyzer.info = info
+        if addPacket:
+            analyzer.info.addPacket = addPacket
+        for ts, buf, linktype in pcapstats.openTrace(filename):
+            analyzer.feed(ts, buf, linktype)
+        return analyzer
+
+    def output(analyzer):
+        return len([json.dumps(result) for result in analyzer.finish()])
+
+    for i in range(repeat):
+        packets = timed('read', read)
+        timed('decode', lambda: run(None, lambda ts, pkt: None))
+        analyzer = timed('analysis', lambda: run(None))
+        connections = len(analyzer.info.connections)
+        # lookups in the table of the full analysis, as addPacket does them
+        info = analyzer.info
+        lookup = lambda ts, pkt: info.check(pcapstats.Connection(pkt[0], pkt[1], pkt[2], pkt[3]))
+        timed('lookup', lambda: run(info, lookup))
+        del info.addPacket
+        timed('output', lambda: output(analyzer))
+
+    share = sackShare(filename, fast)
+    tcp = max(0, best['analysis'] - best['lookup'])
+    sack = min(tcp, share * max(0, best['analysis'] - best['decode']))
+    phases = {
+        'read': best['read'],
+        'decode': max(0, best['decode'] - best['read']),
+        'lookup': max(0, best['lookup'] - best['decode']),
+        'sack': sack,
+        'tcp': tcp - sack,
+        'output': best['output'],
+    }
+    seconds = best['analysis'] + best['output']
+    return {
+        'packets': packets,
+        'connections': connections,
+        'seconds': round(seconds, 4),
+        'pkts_per_sec': int(packets / seconds) if seconds > 0 else 0,
+        'phases': dict([(phase, round(t, 4)) for phase, t in phases.items()]),
+    }
+
+def peakRss(filename, fast=False):
+    '''
+    Analyse a trace and output the results as a normal run does, to be run
+    isolated: the other stages of measure and the profiling do not count
+    returns the peak RSS in MB
+    '''
+    analyzer = pcapstats.Analyzer(netradar=False, fast=fast)
+    for ts, buf, linktype in pcapstats.openTrace(filename):
+        analyzer.feed(ts, buf, linktype)
+    for result in analyzer.finish():
+        json.dumps(result)
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+def isolated(fn, *args, **kwargs):
+    # run fn in a child process, so its memory use (peak RSS) is measured on its own
+    results = multiprocessing.Queue()
+    def child():
+        try:
+            results.put((True, fn(*args, **kwargs)))
+        except Exception as e:
+            results.put((False, "%s: %s" % (type(e).__name__, e)))
+    p = multiprocessing.Process(target=child)
+    p.start()
+    ok, result = results.get()
+    p.join()
+    if not ok:
+        raise RuntimeError(result)
+    return result
+
+
+def revision():
+    # git revision of pcapstats.py, empty if unknown
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=open(os.devnull, 'w'),
+                                       cwd=os.path.dirname(os.path.abspath(pcapstats.__file__))).strip()
+    except (EnvironmentError, subprocess.CalledProcessError):
+        return ''
+
+
+PHASES = ['read', 'decode', 'lookup', 'sack', 'tcp', 'output']
+
+def report(results, compare=None):
+    # print a table of the results, with the speed relative to <compare> (results of an earlier run)
+    print ("%-8s %8s %6s %9s %8s  %s %8s" % ("", "pkts", "cons", "pkts/s", "RSS MB",
+                                           " ".join(["%7s" % p for p in PHASES]), "vs. old" if compare else ""))
+    for name, r in sorted(results['scenarios'].items(), key=lambda x: [s[0] for s in SCENARIOS].index(x[0])):
+        old = ""
+        if compare and name in compare['scenarios'] and compare['scenarios'][name]['pkts_per_sec']:
+            old = "%7.2fx" % (float(r['pkts_per_sec']) / compare['scenarios'][name]['pkts_per_sec'])
+        print ("%-8s %8s %6s %9s %8s  %s %8s" % (name, r['packets'], r['connections'], r['pkts_per_sec'], r['peak_rss_mb'],
+                                               " ".join(["%7.3f" % r['phases'][p] for p in PHASES]), old))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=
+                "Benchmark pcapstats.py on synthetic traces. Reports packets per second, time \
+                 per phase (in seconds) and peak RSS for each scenario and saves them as JSON.")
+    parser.add_argument("scenario", type=str, nargs="*",
+            help="scenarios to run (%s) [default: all]" % ", ".join([s[0] for s in SCENARIOS]))
+    parser.add_argument("--scale", type=float, default=1,
+            help="size of the traces relative to the default (about 100k packets each) [default: %(default)s]")
+    parser.add_argument("--seed", type=int, default=1,
+            help="seed of the trace generator [default: %(default)s]")
+    parser.add_argument("-f", "--fast", action="store_true",
+            help="decode with the built-in decoder (pcapstats.py -f)")
+    parser.add_argument("-r", "--repeat", type=int, default=1,
+            help="run each stage <REPEAT> times and take the best [default: %(default)s]")
+    parser.add_argument("-o", "--output", type=str, default="benchmark.json",
+            help="file to save the results to [default: %(default)s]")
+    parser.add_argument("-c", "--compare", type=str,
+            help="results of an earlier run to compare with")
+    parser.add_argument("--dir", type=str,
+            help="directory to keep the generated traces in (reused by later runs), by default they are deleted")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    names = [s[0] for s in SCENARIOS]
+    for name in args.scenario:
+        if name not in names:
+            parser.error("unknown scenario: %s" % name)
+    compare = None
+    if args.compare:
+        compare = json.load(open(args.compare))
+
+    tracedir = args.dir or tempfile.mkdtemp(prefix='pcapstats-bench-')
+    if not os.path.isdir(tracedir):
+        os.makedirs(tracedir)
+    results = {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'revision': revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'dpkt': getattr(pcapstats.dpkt, '__version__', ''),
+        'scale': args.scale,
+        'seed': args.seed,
+        'fast': args.fast,
+        'repeat': args.repeat,
+        'scenarios': {},
+    }
+    try:
+        for name, description, params in SCENARIOS:
+            if args.scenario and name not in args.scenario:
+                continue
+            params = dict(params, seed=args.seed)
+            params['flows'] = max(1, int(round(params['flows'] * args.scale)))
+            if params['flows'] < 10:
+                # few flows: scale their length instead
+                params['segments'] = max(10, int(params['segments'] * args.scale))
+            filename = os.path.join(tracedir, '%s-%s-%s.pcap' % (name, args.scale, args.seed))
+            if not os.path.exists(filename):
+                sys.stderr.write("generating %s (%s)\n" % (name, description))
+                isolated(generate, filename + '.tmp', **params)
+                os.rename(filename + '.tmp', filename)
+            sys.stderr.write("running %s\n" % name)
+            results['scenarios'][name] = isolated(measure, filename, args.fast, args.repeat)
+            results['scenarios'][name]['peak_rss_mb'] = isolated(peakRss, filename, args.fast)
+            results['scenarios'][name]['description'] = description
+    finally:
+        if not args.dir:
+            shutil.rmtree(tracedir)
+
+    report(results, compare)
+    f = open(args.output, 'w')
+    json.dump(results, f, indent=4, sort_keys=True)
+    f.close()
@@ -22,64 +22,1101 @@ import sys
 import dpkt
 import struct
 import socket
+import stat
+import glob
+import heapq
+import threading
+import zlib
+import mmap
+import bisect
+import array
+import itertools
+import time
+import multiprocessing
+import Queue
+import traceback
+import hashlib
+import csv
+import cPickle as pickle
+import cStringIO
 from datetime import datetime
 try:
     from netradarlogger.log import Log
 except:
     import logging
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import json
 
 
+LINK_ETHERNET = 1
+LINK_RAW = (101, 12, 14, 228, 229)      # raw IP (also the BSD values and IPv4/IPv6 only)
+LINK_SLL = 113                          # Linux cooked capture
+LINK_SLL2 = 276                         # Linux cooked capture v2
+LINKTYPES = (LINK_ETHERNET, LINK_SLL, LINK_SLL2) + LINK_RAW
+
+ETH_IP = b'\x08\x00'
+ETH_IP6 = b'\x86\xdd'
+ETH_VLAN = (b'\x81\x00', b'\x88\xa8', b'\x91\x00', b'\x92\x00')
+IP6_EXT = (0, 43, 44, 51, 60)           # extension headers in front of TCP: hop-by-hop, routing, fragment, AH, destination
+
+def network(buf, linktype=LINK_ETHERNET):
+    '''
+    Find the network layer in a frame of the given link type
+    Returns (offset, EtherType), EtherType is None for unsupported link types
+    '''
+    if linktype == LINK_ETHERNET:
+        o = 14
+        t = buf[12:14]
+    elif linktype == LINK_SLL:
+        o = 16
+        t = buf[14:16]
+    elif linktype == LINK_SLL2:
+        o = 20
+        t = buf[0:2]
+    elif linktype in LINK_RAW:
+        v = ord(buf[0:1] or b'\x00') >> 4
+        if v == 4:
+            return 0, ETH_IP
+        if v == 6:
+            return 0, ETH_IP6
+        return 0, None
+    else:
+        return 0, None
+    if t in ETH_VLAN:
+        # up to two VLAN tags, as in dpkt
+        t = buf[o+2:o+4]
+        o += 4
+        if t == b'\x81\x00':
+            t = buf[o+2:o+4]
+            o += 4
+    return o, t
+
+def tcp6(buf, o):
+    '''
+    Walk the extension headers of the IPv6 packet at offset o
+    Returns the offset of the TCP header, None if it is no TCP packet, not
+    the first fragment or the headers are truncated
+    '''
+    nh = ord(buf[o+6:o+7] or b'\x00')
+    l = o + 40
+    while nh in IP6_EXT:
+        if len(buf) < l + 8:
+            return None
+        if nh == 44:
+            if struct.unpack_from('!H', buf, l + 2)[0] & 0xfff8:
+                return None
+            hlen = 8
+        elif nh == 51:
+            hlen = (ord(buf[l+1:l+2]) + 2) * 4
+        else:
+            hlen = (ord(buf[l+1:l+2]) + 1) * 8
+        nh = ord(buf[l:l+1])
+        l += hlen
+    if nh != 6:
+        return None
+    return l
+
+def timestamp(text):
+    '''
+    Absolute time from seconds since the epoch or local time (as in the
+    output) YYYY-MM-DD HH:MM[:SS[.ffffff]]
+    raises ValueError if text is neither
+    '''
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for form in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+        try:
+            t = datetime.strptime(text, form)
+        except ValueError:
+            continue
+        return time.mktime(t.timetuple()) + t.microsecond / 1E6
+    raise ValueError("invalid time: %s" % text)
+
+def ipText(addr):
+    # packed IPv4/IPv6 address to text
+    if len(addr) == 16:
+        return socket.inet_ntop(socket.AF_INET6, addr)
+    return socket.inet_ntoa(addr)
+
+def ipPacked(text):
+    # IPv4/IPv6 address in text form to packed, raises socket.error if invalid
+    if ':' in text:
+        return socket.inet_pton(socket.AF_INET6, text)
+    return socket.inet_aton(text)
+
+def endpoint(text):
+    '''
+    Parse an endpoint given as ip:port, [ipv6]:port or just the address
+    returns (packed address, port), port None for any port
+    raises ValueError or socket.error if text is invalid
+    '''
+    port = None
+    if text.startswith('['):
+        addr, bracket, rest = text[1:].partition(']')
+        if rest:
+            if not rest.startswith(':'):
+                raise ValueError(text)
+            port = int(rest[1:])
+    elif text.count(':') == 1:
+        addr, port = text.split(':')
+        port = int(port)
+    else:
+        addr = text
+    return ipPacked(addr), port
+
+def trace(label, msg, *args):
+    '''
+    Debug message of a traced connection (label: its trace attribute), logged
+    with the pcapstats.trace logger. Only traced connections have a label, so
+    callers check it first and build no arguments for all others:
+    if entry.trace:
+        trace(entry.trace, "...", ...)
+    '''
+    logging.getLogger('pcapstats.trace').debug("%s: " + msg, label, *args)
+
+def flowKey(buf, linktype=LINK_ETHERNET):
+    '''
+    Cheap decode of a frame without building dpkt objects
+    Returns the addresses and ports of a TCP packet, ordered so that both
+    directions of a connection give the same key, None for anything else
+    '''
+    o, t = network(buf, linktype)
+    if t == ETH_IP:
+        if len(buf) < o + 20 or buf[o+9:o+10] != b'\x06':
+            return None
+        l = o + (ord(buf[o:o+1]) & 0x0f) * 4
+        a, b = buf[o+12:o+16], buf[o+16:o+20]
+    elif t == ETH_IP6:
+        l = tcp6(buf, o)
+        if l == None:
+            return None
+        a, b = buf[o+8:o+24], buf[o+24:o+40]
+    else:
+        return None
+    if len(buf) < l + 4:
+        return None
+    a += buf[l:l+2]
+    b += buf[l+2:l+4]
+    if a <= b:
+        return a + b
+    return b + a
+
+
+INF = float('inf')
+
+IP_HDR = struct.Struct('!BxHxxHxB2x4s4s')     # v_hl, len, flags/offset, p, src, dst
+IP6_HDR = struct.Struct('!4xH2x16s16s')        # plen, src, dst
+TCP_HDR = struct.Struct('!HHIIHH')              # sport, dport, seq, ack, off/flags, win
+TCP_TS = struct.Struct('!II')                   # tsval, tsecr
+MAX_WSCALE = 14                                 # larger window scale shifts are taken as 14 (RFC 7323)
+
+def fastDecode(buf, o, t):
+    '''
+    Decode a TCP/IPv4 or TCP/IPv6 packet at offset o of a frame (t: its
+    EtherType, see network) with precompiled structs, gives the same result
+    as Info.decode on the dpkt objects
+    Returns None for anything else (other protocols, fragments, unusual
+    options), these have to go through dpkt
+    '''
+    if t == ETH_IP:
+        if len(buf) < o + 40:
+            return None
+        v_hl, iplen, offset, p, src, dst = IP_HDR.unpack_from(buf, o)
+        l = o + (v_hl & 0x0f) * 4
+        if p != 6 or offset & 0x1fff or v_hl & 0x0f < 5 or len(buf) < l + 20:
+            return None
+        payload = iplen - (l - o) # TCP header and data
+    elif t == ETH_IP6:
+        if len(buf) < o + 60:
+            return None
+        plen, src, dst = IP6_HDR.unpack_from(buf, o)
+        l = tcp6(buf, o)
+        if not plen or l == None or len(buf) < l + 20:
+            return None # jumbo payload/TSO, no TCP
+        iplen = plen
+        payload = plen - (l - o - 40)
+    else:
+        return None
+    sport, dport, seq, ack, off_flags, win = TCP_HDR.unpack_from(buf, l)
+    off = (off_flags >> 12) * 4
+    flags = off_flags & 0x1ff
+    if off < 20 or len(buf) < l + off or (iplen and payload < off):
+        return None
+
+    # options, walked like dpkt.tcp.parse_opts
+    sack_blocks = None
+    wscale = -1
+    tsval = 0
+    tsecr = 0
+    opts = bytearray(buf[l+20:l+off])
+    end = len(opts)
+    i = 0
+    while i < end:
+        opt = opts[i]
+        if opt <= 1:
+            i += 1
+            continue
+        if i + 1 >= end:
+            return None
+        n = min(max(2, opts[i+1]), end - i) - 2 # length of option data
+        if opt == 5:
+            if sack_blocks == None:
+                if n == 0 or n % 8:
+                    return None
+                sack_blocks = struct.unpack_from('!%iI' % (n/4), buf, l + 22 + i)
+        elif opt == 8:
+            if n != 8:
+                return None
+            tsval, tsecr = TCP_TS.unpack_from(buf, l + 22 + i)
+        elif opt == 3 and flags & 0x02:
+            if n != 1:
+                return None
+            wscale = min(opts[i+2], MAX_WSCALE)
+        i += max(2, opts[i+1])
+
+    return (src, dst, sport, dport, seq, ack, flags, win, payload - off, sack_blocks, wscale, tsval, tsecr)
+
+
+class PreFilter:
+    '''
+    Checks the raw frame before anything is decoded and drops what cannot
+    belong to an analysed TCP connection (ARP, UDP, fragments, ...)
+    ports: list of ports, keep only packets from or to one of them
+    hosts: list of IPv4/IPv6 addresses, keep only packets from or to one of them
+    sample: keep only this share of the connections, chosen by a hash (crc32)
+            of the addresses and ports, the same for both directions and every run
+    With ports, hosts or sample given, only frames they can be checked on are kept
+    '''
+    def __init__(self, ports=None, hosts=None, sample=None):
+        self.ports = None
+        if ports:
+            self.ports = set([struct.pack('!H', p) for p in ports])
+        self.hosts = None
+        if hosts:
+            self.hosts = set([ipPacked(h) for h in hosts])
+        self.threshold = None   # keep connections with a hash below
+        if sample != None and sample < 1:
+            self.threshold = int(sample * (1 << 32))
+        self.any = self.ports == None and self.hosts == None and self.threshold == None
+
+    def accept(self, buf, linktype=LINK_ETHERNET):
+        o, t = network(buf, linktype)
+        if t == ETH_IP:
+            if buf[o+9:o+10] != b'\x06' or buf[o+7:o+8] != b'\x00' or ord(buf[o+6:o+7] or b'\x00') & 0x1f:
+                return False # not TCP or not the first fragment
+            if self.any:
+                return True
+            if self.hosts != None and buf[o+12:o+16] not in self.hosts and buf[o+16:o+20] not in self.hosts:
+                return False
+            l = o + (ord(buf[o:o+1]) & 0x0f) * 4
+            a, b = o + 12, o + 16 # addresses
+            n = 4
+        elif t == ETH_IP6:
+            l = tcp6(buf, o)
+            if l == None:
+                return False # not TCP or not the first fragment
+            if self.any:
+                return True
+            if self.hosts != None and buf[o+8:o+24] not in self.hosts and buf[o+24:o+40] not in self.hosts:
+                return False
+            a, b = o + 8, o + 24
+            n = 16
+        else:
+            # IPv4 might still be in 802.3/LLC or MPLS, leave these to dpkt
+            # (not frames truncated before the EtherType)
+            return self.any and linktype == LINK_ETHERNET and t != None and len(t) == 2 \
+                   and (t < b'\x05\xdd' or t == b'\x88\x47' or t == b'\x88\x48')
+        if self.ports != None and buf[l:l+2] not in self.ports and buf[l+2:l+4] not in self.ports:
+            return False
+        if self.threshold != None:
+            a = buf[a:a+n] + buf[l:l+2]
+            b = buf[b:b+n] + buf[l+2:l+4]
+            if a > b:
+                a, b = b, a
+            return zlib.crc32(a + b) & 0xffffffff < self.threshold
+        return True
+
+
+class Scoreboard(list):
+    '''
+    SACK scoreboard, a list of [start, end] blocks
+    While the blocks are sorted, disjoint and not touching (ordered), blocks
+    are looked up with bisect and only the blocks concerned are changed.
+    SACK blocks that do not fit this (e.g. overlapping a block only partly)
+    are handled with the original scans over the whole list, so both ways
+    give the same scoreboard and the same holes for reorder detection.
+    '''
+    __slots__ = ('ordered', 'dirty', 'trace')
+
+    def __init__(self, blocks=()):
+        list.__init__(self, blocks)
+        self.ordered = self.check()
+        self.dirty = []             # [start, end] of block groups to unite in combine()
+        self.trace = None           # trace label of the connection, see trace()
+
+    def check(self):
+        for i in range(len(self)):
+            if self[i][0] >= self[i][1] or (i > 0 and self[i-1][1] >= self[i][0]):
+                return False
+        return True
+
+    def prune(self, ack):
+        # delete sack blocks, which are lower than cumulative ack
+        if self.ordered:
+            n = 0
+            while n < len(self) and self[n][1] <= ack:
+                n += 1
+            del self[:n]
+        else:
+            self[:] = [b for b in self if b[1] > ack]
+
+    def fill(self, sack_blocks, acked):
+        # take the SACK blocks above acked into the empty scoreboard
+        for block in range(0, len(sack_blocks), 2):
+            if sack_blocks[block] <= acked:
+                continue
+            self.insert(0, [sack_blocks[block],sack_blocks[block+1]])
+        self.ordered = False
+
+    def merge(self, sack_blocks, ack):
+        '''
+        Merge the SACK blocks of a packet into the (non-empty) scoreboard
+        returns [(hole, newly_acked), ...] for reorderSACK and sackRetrans
+        '''
+        events = []
+        for block in range(0, len(sack_blocks), 2):
+            if not self.ordered:
+                self.scan(sack_blocks[block:], ack, events)
+                break
+            start = sack_blocks[block]
+            end = sack_blocks[block+1]
+            if end <= ack: #DSACK
+                continue
+            if start >= end or not self.clear(start, end):
+                self.ordered = False
+                self.scan(sack_blocks[block:], ack, events)
+                break
+
+            k = bisect.bisect_right(self, [start, INF]) - 1 # last block starting at or below start
+            n = len(self)
+            if k >= 0 and end <= self[k][1]:
+                #sack block exists
+                continue
+
+            if k >= 0 and start == self[k][0]:
+                #    extends upwards
+                save_hole = 0
+                if k < n-1: #its not the last one
+                    save_hole = self[k][1]
+                    if self.trace:
+                        trace(self.trace, "reor 1 %s %s", self[k], save_hole)
+                events.append((save_hole, [self[k][1]]))
+                self[k][1] = end
+                i = k
+            elif k+1 < n and end == self[k+1][1]:
+                #    extends downwards
+                if self.trace:
+                    trace(self.trace, "reor 2 %s %s", self[k+1], start)
+                events.append((start, [start]))
+                self[k+1][0] = start
+                i = k+1
+            elif k+1 < n and end > self[k+1][1]:
+                #    extends both ways (ACK loss?)
+                events.append((0, [start, self[k+1][1]]))
+                self[k+1][0] = start
+                self[k+1][1] = end
+                i = k+1
+            elif k+1 < n:
+                if self[k+1][0] < end:
+                    # overlaps the next block partly, the scan would put it out of order
+                    self.ordered = False
+                    self.scan(sack_blocks[block:], ack, events)
+                    break
+                # put it between two existing
+                self.insert(k+1, [start, end])
+                events.append((start, [start]))
+                i = k+1
+            elif self[-1][1] < start: # starts after last SACK block
+                self.append([start, end])
+                i = n
+            else:
+                continue
+
+            # overlapping or touching the neighbours now: unite them in combine()
+            if (i > 0 and self[i-1][1] >= self[i][0]) or (i+1 < len(self) and self[i][1] >= self[i+1][0]):
+                if i > 0 and self[i-1][1] >= self[i][0]:
+                    i -= 1
+                group = [self[i][0], self[i][1]]
+                while i+1 < len(self) and group[1] >= self[i+1][0]:
+                    i += 1
+                    group[1] = max(group[1], self[i][1])
+                self.dirty.append(group)
+        return events
+
+    def clear(self, start, end):
+        # block is apart from the groups still to be united
+        for group in self.dirty:
+            if end >= group[0] and start <= group[1]:
+                return False
+        return True
+
+    def combine(self):
+        if self.ordered:
+            for group in self.dirty:
+                i = bisect.bisect_left(self, [group[0], -INF])
+                j = i
+                while j+1 < len(self) and self[j+1][0] <= group[1]:
+                    j += 1
+                self[i:j+1] = [group]
+            self.dirty = []
+            return
+
+        self.dirty = []
+        done = 0
+        while done == 0:
+            done = 1
+            for i in range(len(self)):
+                if len(self) > i+1:
+                    if self[i][0] <= self[i+1][0] and self[i][1] >= self[i+1][1]:
+                        # first one includes second
+                        self.remove(self[i+1])
+                        done = 0
+                        break #start anew, index have changed
+                    if self[i][0] >= self[i+1][0] and self[i][1] <= self[i+1][1]:
+                        # second one includes first
+                        self.remove(self[i])
+                        done = 0
+                        break #start anew, index have changed
+                    if self[i][1] >= self[i+1][0]:
+                        # end of first is at the edge of second -> combine
+                        newend = self[i+1][1]
+                        self[i][1] = newend
+                        self.remove(self[i+1])
+                        done = 0
+                        break #start anew, index have changed
+        self.ordered = self.check()
+
+    def scan(self, sack_blocks, ack, events):
+        # merge by scanning all blocks, for scoreboards that are not ordered
+        for block in range(0, len(sack_blocks), 2):
+            done = 0
+            for i in range(len(self)):
+                if sack_blocks[block+1] <= ack: #DSACK
+                    done = 1
+                    break
+
+                #sack block exists
+                if sack_blocks[block] >= self[i][0] and sack_blocks[block+1] <= self[i][1]:
+                    done = 1
+                    break
+
+                #new sack block is longer than existing
+                save_hole = 0
+                newly_acked = []
+                #    extends upwards
+                if sack_blocks[block] == self[i][0] and sack_blocks[block+1] > self[i][1]:
+                    if i < len(self)-1: #its not the last one
+                        save_hole = self[i][1]
+                        if self.trace:
+                            trace(self.trace, "reor 1 %s %s", self[i], save_hole)
+                    newly_acked = [self[i][1]]
+                    self[i][1] = sack_blocks[block+1]
+                    done = 1
+
+                #    extends downwards
+                if sack_blocks[block] < self[i][0] and sack_blocks[block+1] == self[i][1] and done == 0:
+                    save_hole = sack_blocks[block]
+                    newly_acked = [save_hole]
+                    if self.trace:
+                        trace(self.trace, "reor 2 %s %s", self[i], save_hole)
+                    self[i][0] = sack_blocks[block]
+                    done = 1
+
+                #    extends both ways (ACK loss?)
+                if sack_blocks[block] < self[i][0] and sack_blocks[block+1] > self[i][1] and done == 0:
+                    newly_acked = [sack_blocks[block], self[i][1]]
+                    self[i][0] = sack_blocks[block]
+                    self[i][1] = sack_blocks[block+1]
+                    done = 1
+
+                events.append((save_hole, newly_acked))
+
+            # not found any corresponding SACK block, insert somewhere
+            if not done and len(self) > 0:
+                for j in range(len(self)): # try to put it between two existing
+                    if self[j][0] >= sack_blocks[block+1]:
+                        self.insert(j, [sack_blocks[block],sack_blocks[block+1]])
+                        hole = sack_blocks[block]
+                        events.append((hole, [hole]))
+                        done = 1
+                        break
+                if not done:
+                    last = self[-1][1]
+                    new = sack_blocks[block]
+                    if last < new: # starts after last SACK block
+                        self.append([sack_blocks[block],sack_blocks[block+1]])
+
+
+class Rexmits(dict):
+    '''
+    Retransmissions of a half connection, seq -> [seg len, ts, acked?, rto?, rdelay ts, flightsize, reordered?]
+    The sequence numbers not yet covered by the cumulative ACK are also kept
+    sorted, so the retransmissions an ACK newly acknowledges are found with
+    bisect. Entries stay in the dict itself, DSACKs and repeated
+    retransmissions still look them up after they are acknowledged.
+    '''
+    __slots__ = ('pending',)
+
+    def __init__(self):
+        dict.__init__(self)
+        self.pending = []           # sorted sequence numbers not below the cumulative ACK
+
+    def add(self, seq, info):
+        if not self.has_key(seq):
+            if self.pending == [] or seq > self.pending[-1]:
+                self.pending.append(seq)
+            else:
+                bisect.insort(self.pending, seq)
+        self[seq] = info
+
+    def between(self, low, high):
+        '''
+        Sequence numbers of the retransmissions with low <= seq < high
+        '''
+        return self.pending[bisect.bisect_left(self.pending, low):bisect.bisect_left(self.pending, high)]
+
+    def prune(self, ack):
+        # sequence numbers below the cumulative ACK are never asked for again
+        n = bisect.bisect_left(self.pending, ack)
+        if n > 0:
+            del self.pending[:n]
+
+
+class SackHoles(object):
+    '''
+    SACK holes [begin, end, ts] saved to determine the beginning of reordering
+    While the holes are disjoint (ordered) they are sorted by begin, so the
+    hole a sequence number falls in is found with bisect and pruning below the
+    cumulative ACK only touches the front. Overlapping holes switch to the
+    original scans in the order the holes were saved, so the results are
+    the same. Holes with end <= begin never contain a sequence number and
+    are kept aside.
+    '''
+    __slots__ = ('holes', 'empty', 'ordered')
+
+    def __init__(self):
+        self.holes = []             # [begin, end, ts], sorted while ordered
+        self.empty = []             # [begin, end, ts] with end <= begin
+        self.ordered = True
+
+    def find(self, seqnr):
+        # return the timestamp of the hole seqnr falls in, -1 when not found
+        if self.ordered:
+            i = bisect.bisect_right(self.holes, [seqnr, INF]) - 1
+            if i >= 0 and seqnr < self.holes[i][1]:
+                return self.holes[i][2]
+            return -1
+        for h in self.holes:
+            if seqnr >= h[0] and seqnr < h[1]:
+                return h[2]
+        return -1
+
+    def within(self, begin, end):
+        # does [begin, end] fall within an already saved hole
+        if end <= begin:
+            for h in self.holes + self.empty:
+                if begin >= h[0] and end <= h[1]:
+                    return True
+            return False
+        if self.ordered:
+            i = bisect.bisect_right(self.holes, [begin, INF]) - 1
+            return i >= 0 and end <= self.holes[i][1]
+        for h in self.holes:
+            if begin >= h[0] and end <= h[1]:
+                return True
+        return False
+
+    def add(self, begin, end, ts):
+        '''
+        Save the hole [begin, end] seen at ts, unless it falls within a saved one
+        '''
+        if self.within(begin, end):
+            return
+        hole = [begin, end, ts]
+        if end <= begin:
+            self.empty.append(hole)
+            return
+        if self.ordered:
+            i = bisect.bisect_right(self.holes, [begin, INF])
+            if (i == 0 or self.holes[i-1][1] <= begin) and (i == len(self.holes) or end <= self.holes[i][0]):
+                self.holes.insert(i, hole)
+                return
+            self.ordered = False
+        self.holes.append(hole)
+
+    def prune(self, ack):
+        # remove holes below ack
+        if self.ordered:
+            n = 0
+            while n < len(self.holes) and self.holes[n][1] <= ack:
+                n += 1
+            if n > 0:
+                del self.holes[:n]
+        else:
+            self.holes = [h for h in self.holes if h[1] > ack]
+            holes = sorted(self.holes)
+            if all(holes[i][1] <= holes[i+1][0] for i in range(len(holes)-1)):
+                self.holes = holes
+                self.ordered = True
+        if self.empty:
+            self.empty = [h for h in self.empty if h[1] > ack]
+
+
+def percentiles(values, levels):
+    '''
+    Percentiles of values with linear interpolation (numpy.percentile, or the
+    same computed in Python if numpy is not available)
+    values: numpy array or list
+    levels: percentiles to compute (0-100)
+    returns list of floats, None if values is empty
+    '''
+    if len(values) == 0:
+        return None
+    if numpy != None:
+        return [float(v) for v in numpy.percentile(values, levels)]
+    values = sorted(values)
+    result = []
+    for level in levels:
+        rank = level / 100.0 * (len(values) - 1)
+        lo = int(rank)
+        hi = min(lo + 1, len(values) - 1)
+        weight = rank - lo
+        result.append(values[lo] * (1 - weight) + values[hi] * weight)
+    return [float(v) for v in result]
+
+
+class Series(object):
+    '''
+    Series of events, stored column-wise in typed arrays
+    typecodes: array typecode of each column (e.g. 'dl' for [float, int])
+    Iterating gives the events as tuples, series[i] the i-th event. Events
+    are appended, earlier ones are only changed with set(), which keeps the
+    first changed one in <changed> (see Checkpoint.persist).
+    '''
+    __slots__ = ('columns', 'changed')
+
+    def __init__(self, typecodes):
+        self.columns = tuple(array.array(t) for t in typecodes)
+        self.changed = None
+
+    def append(self, *event):
+        for column, value in zip(self.columns, event):
+            column.append(value)
+
+    def set(self, i, column, value):
+        # change column of the i-th event
+        self.columns[column][i] = value
+        if self.changed == None or i < self.changed:
+            self.changed = i
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __getitem__(self, i):
+        return tuple(column[i] for column in self.columns)
+
+    def __iter__(self):
+        return itertools.izip(*self.columns)
+
+    def column(self, i):
+        # column i as numpy array (no copy) if numpy is available, else the array itself
+        if numpy == None:
+            return self.columns[i]
+        return numpy.frombuffer(self.columns[i], self.columns[i].typecode)
+
+    def typecodes(self):
+        return ''.join([c.typecode for c in self.columns])
+
+    def where(self, keep):
+        # new series with the events for which keep (sequence of bools) is true
+        result = Series('')
+        result.columns = tuple(array.array(c.typecode, itertools.compress(c, keep)) for c in self.columns)
+        return result
+
+
+class Connection(object):
+    '''
+    State of a half connection, the fields are explained in Info.addPacket
+    '''
+    __slots__ = ('src', 'dst', 'sport', 'dport', 'half', 'trace',
+                 'con_start', 'last_seen', 'rcv_wscale', 'sack', 'ts_opt', 'dsack',
+                 'all', 'bytes', 'high', 'high_len', 'mss', 'firstTSval',
+                 'rexmit', 'acked', 'sacked', 'reorder', 'reorder_rexmit', 'dreorder',
+                 'dreor_extents', 'reor_extents', 'reor_holes', 'recovery_point', 'flightsize',
+                 'last_ts', 'interruptions', 'interr_rexmits', 'interr_rto_tsval', 'gaps',
+                 'disorder', 'disorder_phases', 'disorder_fret', 'disorder_rto', 'disorder_spurrexmit',
+                 'sblocks', 'rst', 'fin', 'syn', 'rcv_win')
+
+    def __init__(self, src, dst, sport, dport):
+        self.src = src              # packed IPv4/IPv6 address, see ipText
+        self.dst = dst
+        self.sport = sport
+        self.dport = dport
+        self.half = None            # the other half connection, set with its first packet
+        self.trace = None           # label for debug messages if the connection is traced, see trace()
+
+
+class Stats(object):
+    '''
+    Counters of an analysis (--stats), kept by Info and Analyzer if given one
+    Cheap enough to leave on: counting is a few increments and the total
+    time of Info.addFrame per packet; the time per stage, the sizes of the
+    per connection structures and the number of connections in memory are
+    only taken for every <sample>th packet. The shares of the stages in
+    these split up the total time. With worker processes (--jobs) the times
+    of the stages are the sums over the workers, which run in parallel to
+    the reading, so they are not part of the elapsed time of the run.
+    '''
+    sample = 64             # time the stages of every <sample>th packet
+    interval = 60           # trace time (sec) between samples of the number of connections in memory
+    stages = ('decode', 'lookup', 'sack', 'rexmit', 'tcp')
+
+    def __init__(self):
+        self.skipped = 0        # frames dropped by the prefilter (not TCP, other hosts/ports)
+        self.analysed = 0       # frames given to Info.addFrame
+        self.dpkt = 0           # of these passed to dpkt (not handled by fastDecode)
+        self.failed = 0         # of these not decoded
+        self.failures = {}      # exception -> count, for failed
+        self.sampled = 0        # packets with timed stages
+        self.busy = 0           # seconds in Info.addFrame
+        self.times = dict([(stage, 0.0) for stage in Stats.stages]) # seconds of the sampled packets per stage
+        self.output = 0         # seconds to build and emit the results
+        self.elapsed = 0        # seconds of the whole run
+        self.max_sblocks = 0    # largest SACK scoreboard (blocks)
+        self.max_rexmit = 0     # most retransmissions recorded for one half connection
+        self.max_holes = 0      # most SACK holes kept for reordering delays
+        self.live = {}          # interval start (ts) -> half connections in memory
+        self.last = 0           # clock at the last lap
+        self.workers = 0        # worker processes merged, see merge
+
+    def start(self, ts, connections):
+        # begin timing a sampled packet
+        self.sampled += 1
+        slot = ts // Stats.interval * Stats.interval
+        if connections > self.live.get(slot, -1):
+            self.live[slot] = connections
+        self.last = time.time()
+        return self
+
+    def lap(self, stage):
+        # time since the last lap was spent in stage
+        t = time.time()
+        self.times[stage] += t - self.last
+        self.last = t
+
+    def sizes(self, entry, half):
+        self.max_sblocks = max(self.max_sblocks, len(entry.sblocks))
+        self.max_holes = max(self.max_holes, len(entry.reor_holes.holes))
+        if half:
+            self.max_rexmit = max(self.max_rexmit, len(half.rexmit))
+
+    def fail(self, e):
+        self.failed += 1
+        name = type(e).__name__ if e != None else 'no IP'
+        self.failures[name] = self.failures.get(name, 0) + 1
+
+    def merge(self, other):
+        # add the counters of another analysis (worker process) of the same trace
+        self.workers += max(1, other.workers)
+        for name in ('skipped', 'analysed', 'dpkt', 'failed', 'sampled', 'busy', 'output'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name, n in other.failures.items():
+            self.failures[name] = self.failures.get(name, 0) + n
+        for stage in Stats.stages:
+            self.times[stage] += other.times[stage]
+        self.max_sblocks = max(self.max_sblocks, other.max_sblocks)
+        self.max_rexmit = max(self.max_rexmit, other.max_rexmit)
+        self.max_holes = max(self.max_holes, other.max_holes)
+        for slot, n in other.live.items():
+            self.live[slot] = self.live.get(slot, 0) + n
+
+    def estimate(self, stage):
+        # seconds spent in stage for all packets
+        sampled = sum(self.times.values())
+        if not sampled:
+            return 0
+        return self.busy * self.times[stage] / sampled
+
+    def dict(self):
+        decoded = self.analysed - self.failed
+        return {
+            'packets': {'frames': self.skipped + self.analysed, 'skipped': self.skipped, 'analysed': self.analysed,
+                        'decoded': decoded, 'fast': decoded - (self.dpkt - self.failed), 'failed': self.failed,
+                        'failures': self.failures},
+            'seconds': dict([(stage, round(self.estimate(stage), 4)) for stage in Stats.stages] +
+                            [('output', round(self.output, 4)), ('total', round(self.elapsed, 4))]),
+            'sampled': self.sampled,
+            'workers': self.workers,
+            'largest': {'sblocks': self.max_sblocks, 'rexmit': self.max_rexmit, 'holes': self.max_holes},
+            'connections': [[slot, self.live[slot]] for slot in sorted(self.live)],
+        }
+
+    def report(self):
+        # the counters as text
+        packets = self.dict()['packets']
+        lines = []
+        lines.append("Packets: %s read, %s skipped, %s decoded (%s with the built-in decoder), %s failed%s" \
+                     %(packets['frames'], self.skipped, packets['decoded'], packets['fast'], self.failed,
+                       " (%s)" % ", ".join(["%s: %s" %(e, n) for e, n in sorted(self.failures.items())]) if self.failures else ""))
+        stages = ", ".join(["%s %0.2f s" %(stage, self.estimate(stage)) for stage in Stats.stages])
+        if self.workers:
+            lines.append("Time: %0.2f s, output %0.2f s, reading and other %0.2f s; in %s workers (summed): %s (stages timed for %s packets)" \
+                         %(self.elapsed, self.output, max(0, self.elapsed - self.output), self.workers, stages, self.sampled))
+        else:
+            lines.append("Time: %0.2f s, %s, output %0.2f s, reading and other %0.2f s (stages timed for %s packets)" \
+                         %(self.elapsed, stages, self.output, max(0, self.elapsed - self.busy - self.output), self.sampled))
+        lines.append("Largest: SACK scoreboard %s blocks, %s retransmissions, %s SACK holes" \
+                     %(self.max_sblocks, self.max_rexmit, self.max_holes))
+        if self.live:
+            slots = sorted(self.live)
+            step = max(1, len(slots) / 10)
+            lines.append("Connections in memory: max %s; %s" \
+                         %(max(self.live.values()),
+                           ", ".join(["%s: %s" %(datetime.fromtimestamp(slot).strftime('%Y-%m-%d %H:%M'), self.live[slot])
+                                      for slot in slots[::step]])))
+        return "\n".join(lines)
+
+
+class FlowSample(object):
+    '''
+    Estimates for the whole trace from a sample of its connections (--sample-flows)
+    Every connection is kept with probability <rate> (see PreFilter), so the
+    totals are the sums over the sampled connections divided by the rate
+    (Horvitz-Thompson), with variance (1-rate)/rate^2 * sum(y^2). The mean
+    goodput is the mean of the sample, with variance (1-rate)*s^2/n.
+    Bounds are the estimate -/+ z standard errors (normal approximation,
+    not below 0), rough for a few sampled connections or rare events.
+    rate: share of the connections analysed (0 < rate <= 1)
+    '''
+    z = 1.96                # standard errors to the confidence bounds (95%)
+    totals = ('connections', 'bytes', 'interruptionTime', 'interruptions',
+              'recoveryTime', 'recoveryPhases', 'reorderings')
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.sums = dict([(name, [0.0, 0.0]) for name in FlowSample.totals]) # name -> [sum, sum of squares]
+        self.goodput = [0, 0.0, 0.0] # number, sum, sum of squares of the goodputs (kbit/s)
+
+    def add(self, bytes, goodput, interrtime, interruptions, rectime, recoveries, reorderings):
+        '''
+        Count one sampled connection, the values as in its results
+        '''
+        for name, value in zip(FlowSample.totals, (1, bytes, interrtime, interruptions, rectime, recoveries, reorderings)):
+            s = self.sums[name]
+            s[0] += value
+            s[1] += value * value
+        self.goodput[0] += 1
+        self.goodput[1] += goodput
+        self.goodput[2] += goodput * goodput
+
+    def bounds(self, estimate, variance):
+        se = max(0, variance) ** 0.5
+        return {'estimate': estimate, 'lower': max(0, estimate - FlowSample.z * se), 'upper': estimate + FlowSample.z * se}
+
+    def estimates(self):
+        '''
+        returns dict: rate, sampled (connections), a dict with estimate, lower
+        and upper bound for each of FlowSample.totals and the mean goodput
+        '''
+        p = self.rate
+        result = {'rate': p, 'sampled': self.goodput[0], 'confidence': 0.95}
+        for name in FlowSample.totals:
+            total, squares = self.sums[name]
+            result[name] = self.bounds(total / p, (1 - p) / (p * p) * squares)
+        n, total, squares = self.goodput
+        if n > 0:
+            mean = total / n
+            variance = (squares - n * mean * mean) / (n - 1) if n > 1 else 0
+            result['goodput'] = self.bounds(mean, (1 - p) * variance / n)
+        else:
+            result['goodput'] = None
+        return result
+
+    def report(self):
+        # the estimates as text
+        e = self.estimates()
+        value = lambda name, fmt: ("%s [%s, %s]" %(fmt, fmt, fmt)) \
+                                  %(e[name]['estimate'], e[name]['lower'], e[name]['upper'])
+        lines = ["Sampled %s connections (rate %s), estimates for all [95%% bounds]:" %(e['sampled'], e['rate'])]
+        lines.append("Connections: %s , data: %s bytes , mean goodput: %s kbit/s" \
+                     %(value('connections', "%0.0f"), value('bytes', "%0.0f"),
+                       value('goodput', "%0.2f") if e['goodput'] else "-"))
+        lines.append("Interruptions: %s in %s s" %(value('interruptions', "%0.0f"), value('interruptionTime', "%0.2f")))
+        lines.append("Fast Recovery: %s phases in %s s , reorderings: %s" \
+                     %(value('recoveryPhases', "%0.0f"), value('recoveryTime', "%0.2f"), value('reorderings', "%0.0f")))
+        return "\n".join(lines)
+
+
 class Info:
     timespan = 10           # time (sec) from start to take into account
     coninterrtime = 0.1    # time to differentiate between connection interruption and normal ACK inter arrival times
-
-    def __init__(self, timelimit):
-        Info.timespan = timelimit
-        Info.connections = list()
+    gapedges = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10] # bucket edges (sec) of the ACK inter arrival histogram
+    percentiles = [50, 90, 99] # percentiles of the reordering extents and delays in the results
+    reasons = ('sackHole', 'rexmit') # how a reordering was detected, stored as index in reor_extents
+
+    def __init__(self, timelimit, gaps=False, trace=None, stats=None):
+        self.timespan = timelimit
+        self.gaps = gaps        # keep a histogram of ACK inter arrival times per connection
+        self.stats = stats      # Stats to count in, or None
+        self.timer = None       # stats while the current packet is timed
+        self.trace = trace      # endpoints (see endpoint) of the connections to trace, True for all
+        if trace == None and logging.getLogger('pcapstats.trace').isEnabledFor(logging.DEBUG):
+            self.trace = True   # debug logging on: trace everything, checked only here
+        self.connections = list()
+        self.contable = dict()  # connection key -> [half in direction 0, half in direction 1]
+        self.idle = None        # heap of (last_seen, key, halves) for evict, built on its first call
+        self.closed = set()     # keys of the connections closed both ways, for evict
+        self.window = None      # start of the analysed time window, connections seen only before are not reported
+        self.leadin = False     # before window, see startWindow
+
+    # key of a connection, the same for both halves
+    # returns the key and the direction of c within it (0 or 1)
+    def key(self, c):
+        a = (c.src, c.sport)
+        b = (c.dst, c.dport)
+        if a <= b:
+            return (a, b), 0
+        return (b, a), 1
+
+    # label for the debug messages of connection c, None if it is not traced
+    def traceLabel(self, c):
+        if not self.trace:
+            return None
+        if self.trace != True:
+            for addr, port in self.trace:
+                if (addr == c.src and port in (None, c.sport)) or (addr == c.dst and port in (None, c.dport)):
+                    break
+            else:
+                return None
+        return "%s:%s - %s:%s" % (ipText(c.src), c.sport, ipText(c.dst), c.dport)
 
     # check if connection exists
     def check(self, c):
-        for entry in Info.connections:
-            if Info.compare(self,entry,c) == 1:
-                return entry
-        return None
-
-    # find the other half connection
-    def findOtherHalf(self, c):
-        for entry in Info.connections:
-            if Info.compare(self,entry,c) == 2:
-                return entry
+        key, direction = self.key(c)
+        halves = self.contable.get(key)
+        if halves:
+            return halves[direction]
         return None
 
-    # compare two connections
-    def compare(self, c1, c2):
-       if ((c1['src'] == c2['dst']) and (c1['dst'] == c2['src']) \
-          and (c1['sport'] == c2['dport']) and (c1['dport'] == c2['sport'])):
-            return 2
+    # last packet of a connection (table slot [half, half]) in any direction
+    def lastSeen(self, halves):
+        return max([h.last_seen for h in halves if h])
+
+    # both halves of a connection seen and saw FIN or RST
+    def isClosed(self, halves):
+        return halves[0] and halves[1] \
+               and (halves[0].fin or halves[0].rst) \
+               and (halves[1].fin or halves[1].rst)
+
+    # remove finished connections from the table and return them (in order of appearance)
+    # finished: both halves saw FIN or RST and have been quiet for <linger> seconds,
+    #           or no packet at all for more than <timeout> seconds
+    # the table is not scanned: idle holds each key with the last_seen it had when
+    # pushed, it is checked again (and pushed back) only once that is <timeout> ago
+    def evict(self, ts, timeout, linger=1):
+        if self.idle == None: # first call, from now on addPacket keeps idle and closed up to date
+            self.idle = [(self.lastSeen(halves), key, halves) for key, halves in self.contable.iteritems()]
+            heapq.heapify(self.idle)
+            self.closed = set([key for key, halves in self.contable.iteritems() if self.isClosed(halves)])
+
+        gone = []
+        idle = self.idle
+        while idle and ts - idle[0][0] > timeout:
+            last, key, halves = heapq.heappop(idle)
+            if self.contable.get(key) is not halves:
+                continue # evicted before
+            last = self.lastSeen(halves)
+            if ts - last > timeout:
+                del self.contable[key]
+                self.closed.discard(key)
+                gone.append(halves)
+            else:
+                heapq.heappush(idle, (last, key, halves))
+        for key in list(self.closed):
+            halves = self.contable[key]
+            if ts - self.lastSeen(halves) > linger:
+                del self.contable[key]
+                self.closed.remove(key)
+                gone.append(halves)
+
+        if not gone:
+            return []
+        ids = set([id(h) for halves in gone for h in halves if h])
+        finished = []
+        remaining = []
+        for c in self.connections:
+            if id(c) in ids:
+                finished.append(c)
+            else:
+                remaining.append(c)
+        self.connections = remaining
+        return finished
 
-       if ((c1['src'] == c2['src']) and (c1['dst'] == c2['dst']) \
-          and (c1['sport'] == c2['sport']) and (c1['dport'] == c2['dport'])):
-            return 1
-       else:
-            return 0
+    def startWindow(self):
+        '''
+        End of the lead-in, the analysed time window (--from) starts: the
+        connections seen in the lead-in keep their state (sequence numbers,
+        scoreboards, retransmissions), their results so far are dropped
+        '''
+        ts = self.window
+        self.leadin = False
+        for c in self.connections:
+            c.con_start = ts
+            c.last_ts = max(c.last_ts, ts)
+            c.all = 0
+            c.bytes = 0
+            c.reorder = 0
+            c.reorder_rexmit = 0
+            c.dreorder = 0
+            c.interruptions = Series(c.interruptions.typecodes())
+            c.disorder_phases = Series(c.disorder_phases.typecodes())
+            c.reor_extents = Series(c.reor_extents.typecodes())
+            c.dreor_extents = Series(c.dreor_extents.typecodes())
+            if c.disorder > 0:
+                c.disorder = ts     # phase in progress, counted from the window start
+            if c.gaps != None:
+                c.gaps = [0] * len(c.gaps)
 
     def sackHoleTs(self, e, seqnr):
         # return the timestamp of the SACK hole the 'seq' falls in
         # return -1 when not found
-        for h in e['reor_holes']:
-            if seqnr >= h[0] and seqnr < h[1]:
-                return h[2]
-        return -1
+        return e.reor_holes.find(seqnr)
 
 
     def addReorExtent(self, e, ts, seqnr, reoroffset, reason):
         if reoroffset == 0:
             return
 
-        if e['flightsize'] > 0:
-            relreor = float(reoroffset)/e['flightsize']
+        if e.flightsize > 0:
+            relreor = float(reoroffset)/e.flightsize
         else:
             logging.warn("rel. reordering: no flightsize %s", seqnr)
             relreor = -1
@@ -91,90 +1128,132 @@ class Info:
             reordelay = -1
             logging.warn("reor delay failed %s", seqnr)
 
-        e['reor_extents'].append([ts, reoroffset, relreor, reason, reordelay, holeTs])
-        logging.debug("addReorExtent: %s %s %s %s %s", reoroffset, e['flightsize'], "%0.2f"%(relreor), datetime.fromtimestamp(ts), reordelay)
+        e.reor_extents.append(ts, reoroffset, relreor, Info.reasons.index(reason), reordelay, holeTs)
+        if e.trace:
+            trace(e.trace, "addReorExtent: %s %s %s %s %s", reoroffset, e.flightsize, "%0.2f"%(relreor), datetime.fromtimestamp(ts), reordelay)
 
     def sackRetrans(self, newly_acked, half):
         # mark retransmissions as ACKed
         for a in newly_acked:
-            #print a, half['rexmit']
-            if half and half['rexmit'].has_key(a):
+            #print a, half.rexmit
+            if half and half.rexmit.has_key(a):
                 # retransmission ACKed by SACK
-                half['rexmit'][a][2] = 1 # tell that it is ACKed
+                half.rexmit[a][2] = 1 # tell that it is ACKed
                 #print "SACK ACKs Rexmit", a
 
     def reorderSACK(self, save_hole, newly_sacked, tsecr, entry, half, ts):
         # reorder detection for SACKed holes
-        max_acked = max(entry['sacked'], newly_sacked)
+        max_acked = max(entry.sacked, newly_sacked)
 
-        if save_hole > 0 and save_hole < entry['sacked'] and entry['disorder_rto'] == 0 and half:
-            if not half['rexmit'].has_key(save_hole):
+        if save_hole > 0 and save_hole < entry.sacked and entry.disorder_rto == 0 and half:
+            if not half.rexmit.has_key(save_hole):
                 #reordering
                 if half:
-                    reoroffset = (max_acked - save_hole) #in bytes for now. /half['mss'] #in packets
-                    logging.debug("reor 5 %s", save_hole)
+                    reoroffset = (max_acked - save_hole) #in bytes for now. /half.mss #in packets
+                    if entry.trace:
+                        trace(entry.trace, "reor 5 %s", save_hole)
                     self.addReorExtent(entry, ts, save_hole, reoroffset, "sackHole")
-                    entry['reorder'] += 1
+                    entry.reorder += 1
             else:
                 # SACKs retransmission
-                (rlen, rtsval, was_acked, was_rto, holeTs, fs, r) = half['rexmit'][save_hole]
+                (rlen, rtsval, was_acked, was_rto, holeTs, fs, r) = half.rexmit[save_hole]
                 if tsecr < rtsval and was_acked == 0:
-                    entry['reorder_rexmit'] += 1
-                    entry['disorder_spurrexmit'] += 1
+                    entry.reorder_rexmit += 1
+                    entry.disorder_spurrexmit += 1
                     reoroffset = max_acked - save_hole
-                    #print ack, rseq, reoroffset, entry['flightsize']
-                    logging.debug("reor 4 %s %s", save_hole, datetime.fromtimestamp(entry['disorder']))
+                    #print ack, rseq, reoroffset, entry.flightsize
+                    if entry.trace:
+                        trace(entry.trace, "reor 4 %s %s", save_hole, datetime.fromtimestamp(entry.disorder))
                     self.addReorExtent(entry, ts, save_hole, reoroffset, "rexmit")
-                    half['rexmit'][save_hole][6] = 1 # is reordered
-                half['rexmit'][save_hole][2] = 1 # is acked
+                    half.rexmit[save_hole][6] = 1 # is reordered
+                half.rexmit[save_hole][2] = 1 # is acked
 
 
+    def addFrame(self, ts, buf, fast=False, linktype=LINK_ETHERNET):
+        '''
+        Process one frame
+        fast: decode with fastDecode, falls back to dpkt for anything it does not handle
+        linktype: pcap link type of the frame, see network
+        '''
+        stats = self.stats
+        timer = None
+        if stats != None:
+            begin = time.time()
+            stats.analysed += 1
+            if not stats.analysed % Stats.sample:
+                timer = self.timer = stats.start(ts, len(self.connections))
+
+        o, t = network(buf, linktype)
+        pkt = None
+        if fast:
+            pkt = fastDecode(buf, o, t)
+        if pkt == None:
+            if stats != None:
+                stats.dpkt += 1
+            if t == ETH_IP or t == ETH_IP6:
+                try:
+                    if t == ETH_IP:
+                        ip_hdr = dpkt.ip.IP(buf[o:])
+                    else:
+                        ip_hdr = dpkt.ip6.IP6(buf[o:])
+                except dpkt.UnpackError:
+                    ip_hdr = buf[o:] # as dpkt.ethernet leaves it, decode reports it
+                pkt = self.decode(ip_hdr)
+            elif linktype == LINK_ETHERNET:
+                try:
+                    ip_hdr = dpkt.ethernet.Ethernet(buf).data # 802.3/LLC, MPLS, ...
+                except dpkt.UnpackError:
+                    ip_hdr = buf # truncated, decode reports it
+                pkt = self.decode(ip_hdr)
+            elif stats != None:
+                stats.fail(None) # no IP
+        if pkt != None:
+            if timer:
+                timer.lap('decode')
+            self.addPacket(ts, pkt)
+        if stats != None:
+            if timer:
+                timer.lap('tcp')
+                self.timer = None
+            stats.busy += time.time() - begin
+
     def addConnection(self, ts, ip_hdr):
+        pkt = self.decode(ip_hdr)
+        if pkt:
+            self.addPacket(ts, pkt)
+
+    def decode(self, ip_hdr):
+        '''
+        Get the fields used by addPacket from a dpkt IP packet
+        returns (src, dst, sport, dport, seq, ack, flags, win, tcp_data_len,
+                 sack_blocks, wscale, tsval, tsecr) or None if it is no TCP packet
+        src and dst are packed, sack_blocks is None if there is no SACK option
+        '''
         try:
             tcp_hdr = ip_hdr.data
 
             # ---- set vars ----
-            ip_data_len = ip_hdr.len - (ip_hdr.hl * 4)
+            if isinstance(ip_hdr, dpkt.ip6.IP6):
+                if ip_hdr.plen:
+                    ip_data_len = ip_hdr.plen - sum([h.length for h in ip_hdr.all_extension_headers])
+                else:
+                    ip_data_len = len(tcp_hdr) # jumbo payload or TSO
+            else:
+                ip_data_len = ip_hdr.len - (ip_hdr.hl * 4)
             tcp_data_len = ip_data_len - (tcp_hdr.off * 4)
 
             ack = tcp_hdr.ack
             seq = int(tcp_hdr.seq)
-        except:
+        except Exception as e:
+            if self.stats != None:
+                self.stats.fail(e)
             msg = "tcp_hdr failed!"
             try:
                 Log.w(msg)
             except:
                 logging.warn(msg)
 
-            return
-
-        flags = [0,0,0,0,0,0]
-        hdr_flags = tcp_hdr.flags
-        for t in reversed(range(6)):
-            flags[t] = hdr_flags % 2
-            hdr_flags = hdr_flags/2
-
-        # general connection infos
-        c = dict()
-        c['src'] = socket.inet_ntoa(ip_hdr.src)
-        c['dst'] = socket.inet_ntoa(ip_hdr.dst)
-        c['sport'] = tcp_hdr.sport
-        c['dport'] = tcp_hdr.dport
-
-        # check if connection is already recorded
-        entry = Info.check(self,c)
-        half = None
-        if entry:
-            if not entry.has_key('half') or entry['half'] == None:
-                half = Info.findOtherHalf(self, c)
-                entry['half'] = half
-                #print "set half", half, c
-            else:
-                half = entry['half']
-
-        carries_data = 0
-        if tcp_data_len > 0:
-            carries_data = 1
+            return None
 
         # get sack blocks from the tcp options field
         opt = dpkt.tcp.parse_opts(tcp_hdr.opts)
@@ -194,10 +1273,10 @@ class Info:
                         oval = oval[0]
                 sack_list.append((oname, oval))
 
-            if flags[4]: #syn
+            if tcp_hdr.flags & dpkt.tcp.TH_SYN:
                 #check for window scale option
                 if i[0] == 3:
-                    wscale = ord(i[1])
+                    wscale = min(ord(i[1]), MAX_WSCALE)
                     #print wscale
 
             if i[0] == 8:
@@ -212,90 +1291,135 @@ class Info:
                     tsval = oval[0]
                     tsecr = oval[1]
 
-        tcp_hdr.options = sack_list
+        sack_blocks = None
+        if sack_list:
+            sack_blocks = sack_list[0][1]
+
+        return (ip_hdr.src, ip_hdr.dst, tcp_hdr.sport, tcp_hdr.dport,
+                seq, ack, tcp_hdr.flags, tcp_hdr.win, tcp_data_len, sack_blocks, wscale, tsval, tsecr)
+
+    def addPacket(self, ts, pkt):
+        (src, dst, sport, dport, seq, ack, hdr_flags, win, tcp_data_len, sack_blocks, wscale, tsval, tsecr) = pkt
+
+        flags = [0,0,0,0,0,0]
+        for t in reversed(range(6)):
+            flags[t] = hdr_flags % 2
+            hdr_flags = hdr_flags/2
+
+        timer = self.timer
+
+        # general connection infos
+        c = Connection(src, dst, sport, dport)
+
+        # check if connection is already recorded, both halves share one table slot
+        key, direction = self.key(c)
+        halves = self.contable.get(key)
+        if halves is None:
+            halves = self.contable[key] = [None, None]
+            if self.idle != None:
+                heapq.heappush(self.idle, (ts, key, halves))
+        entry = halves[direction]
+        half = None
+        if entry:
+            if entry.half == None:
+                half = halves[1 - direction]
+                entry.half = half
+                #print "set half", half, c
+            else:
+                half = entry.half
+        if timer:
+            timer.lap('lookup')
+
+        carries_data = 0
+        if tcp_data_len > 0:
+            carries_data = 1
 
         # check for sack blocks in this packet
         sack = 0
         dsack = 0
-        sack_blocks = []
-        try:
-                #save sack blocks for later use
-                sack_blocks = tcp_hdr.options[0][1]
-
-                sack = 1
-
+        if sack_blocks == None:
+            sack_blocks = []
+        else:
+            sack = 1
+            try:
                 #dsack detection
                 if ack >= sack_blocks[1]: #1st sack block, right edge
                     dsack = 1
                 if ack <= sack_blocks[0] and len(sack_blocks) >= 3 \
                  and (sack_blocks[0] >= sack_blocks[2] and sack_blocks[1] <= sack_blocks[3]): #ex 2nd sack block, 1st sack block is covered by 2nd
                     dsack = 1
-        except:
-            pass
+            except:
+                pass
 
         # ---- process connection ---
         if entry == None: # new connection
-            c['con_start'] = ts             # timestamp of start of connection
-            c['rcv_wscale'] = wscale        # wscale value in SYN
-            c['sack'] = sack                # count segments carrying SACK
-            c['ts_opt'] = 0                 # seen any timestamp?
+            c.con_start = ts                # timestamp of start of connection
+            c.last_seen = ts                # timestamp of last packet (any, used for eviction)
+            c.rcv_wscale = wscale           # wscale value in SYN
+            c.sack = sack                   # count segments carrying SACK
+            c.ts_opt = 0                    # seen any timestamp?
             if tsval != 0:
-                c['ts_opt'] = 1
-            c['dsack'] = dsack              # count segments carrying DSACK
-            c['all'] = 0                    # count segments with payload
-            c['bytes'] = 0                  # count payload bytes
-            c['high'] = 0                   # highest sequence number
-            c['high_len'] = 0               # size of last newly sent data
-            c['mss'] = 0                    # highest seen payload length
-            c['firstTSval'] = tsval
+                c.ts_opt = 1
+            c.dsack = dsack                 # count segments carrying DSACK
+            c.all = 0                       # count segments with payload
+            c.bytes = 0                     # count payload bytes
+            c.high = 0                      # highest sequence number
+            c.high_len = 0                  # size of last newly sent data
+            c.mss = 0                       # highest seen payload length
+            c.firstTSval = tsval
             if carries_data:
-                c['all'] += 1
-                c['bytes'] = tcp_data_len
-                c['high'] = seq
-                c['high_len'] = tcp_data_len
-                c['mss'] = tcp_data_len
-            c['rexmit'] = dict()            # (sequence numbers, tsval) of retransmissions
-            c['acked'] = ack                # cumulative ACK
-            c['sacked'] = 0                 # highest SACKed sequence number
-            c['reorder'] = 0                # #reorderings due to closed SACK holes
-            c['reorder_rexmit'] = 0         # #reordered segments (rexmits, tested with TSval)
-            c['dreorder'] = 0               # #DSACKs accounting for reordering
-            c['dreor_extents'] = []         # separate list of reordering extents found with DSACK+TS
-            c['reor_extents'] = []          # list of infos on reordering extents: [ts, abs.extent, rel.extent]
-                                            #(rel.extent might be -1 for failed)
-            c['reor_holes'] = []            # list of SACK holes, to determine beginning of reorder for reordering delay
-            c['recovery_point'] = 0
-            c['flightsize'] = 0
-            c['last_ts'] = ts               # timestamp of last processed segment (not TS-opt)
-            c['interruptions'] = []         # for any time between two ACKs: [begin, end, #rtos, spurious?]
-            c['interr_rexmits'] = 0         # #rexmits during interruption
-            c['interr_rto_tsval'] = 0       # TSval of the first RTO during interruption
-            c['disorder'] = 0               # in disorder?
-            c['disorder_phases'] = []       # any phase with SACKs: [begin, end, #frets, #rtos]
-            c['disorder_fret'] = 0          # #FRets in disorder
-            c['disorder_rto'] = 0           # #RTOs in disorder (only re-retransmissions, RTOs due to low outstanding packets and no FRet are not taken into account
-            c['disorder_spurrexmit'] = 0    # number of spurious rexmits in the current disorder
-            c['sblocks'] = []               # SACK scoreboard
-            for block in range(0, len(sack_blocks), 2):
-                c['sblocks'].append([sack_blocks[block],sack_blocks[block+1]])
-                c['disorder'] = ts
-            c['rst'] = 0                    # seen a RST
-            c['fin'] = 0                    # seen a FIN
-            c['syn'] = 0                    # seen a SYN
+                c.all += 1
+                c.bytes = tcp_data_len
+                c.high = seq
+                c.high_len = tcp_data_len
+                c.mss = tcp_data_len
+            c.rexmit = Rexmits()            # (sequence numbers, tsval) of retransmissions
+            c.acked = ack                   # cumulative ACK
+            c.sacked = 0                    # highest SACKed sequence number
+            c.reorder = 0                   # #reorderings due to closed SACK holes
+            c.reorder_rexmit = 0            # #reordered segments (rexmits, tested with TSval)
+            c.dreorder = 0                  # #DSACKs accounting for reordering
+            c.dreor_extents = Series('dlddd') # separate list of reordering extents found with DSACK+TS: [ts, abs.extent, rel.extent, delay, hole ts]
+            c.reor_extents = Series('dldbdd') # list of infos on reordering extents: [ts, abs.extent, rel.extent, reason, delay, hole ts]
+                                            #(rel.extent, delay and hole ts might be -1 for failed)
+            c.reor_holes = SackHoles()      # list of SACK holes, to determine beginning of reorder for reordering delay
+            c.recovery_point = 0
+            c.flightsize = 0
+            c.last_ts = ts                  # timestamp of last processed segment (not TS-opt)
+            c.interruptions = Series('ddll') # any time between two ACKs longer than coninterrtime: [begin, end, #rtos, spurious?]
+            c.interr_rexmits = 0            # #rexmits during interruption
+            c.interr_rto_tsval = 0          # TSval of the first RTO during interruption
+            c.gaps = None                   # histogram of ACK inter arrival times, counts for the buckets of gapedges
+            if self.gaps:
+                c.gaps = [0] * (len(Info.gapedges) + 1)
+            c.disorder = 0                  # in disorder?
+            c.disorder_phases = Series('ddllll') # any phase with SACKs: [begin, end, #frets, #rtos, spurious?, #spurious rexmits]
+            c.disorder_fret = 0             # #FRets in disorder
+            c.disorder_rto = 0              # #RTOs in disorder (only re-retransmissions, RTOs due to low outstanding packets and no FRet are not taken into account
+            c.disorder_spurrexmit = 0       # number of spurious rexmits in the current disorder
+            c.sblocks = Scoreboard([[sack_blocks[block],sack_blocks[block+1]] for block in range(0, len(sack_blocks), 2)]) # SACK scoreboard
+            c.trace = c.sblocks.trace = self.traceLabel(c)
+            if len(sack_blocks) > 0:
+                c.disorder = ts
+            c.rst = 0                       # seen a RST
+            c.fin = 0                       # seen a FIN
+            c.syn = 0                       # seen a SYN
             if flags[4]:
-                c['syn'] = 1
-            c['rcv_win'] = []               # receiver windows for any ACK
+                c.syn = 1
+            c.rcv_win = Series('dl')        # receiver windows for any ACK: [ts, window]
 
-            Info.connections.append(c)
+            self.connections.append(c)
+            halves[direction] = c
 
         else: # found old connection
+            entry.last_seen = ts
 
             # ACK reordering check
-            if not carries_data and ack < entry['acked']:
+            if not carries_data and ack < entry.acked:
                 return
 
             # time limit exceeded
-            if (Info.timespan > 0 ) and (ts > entry['con_start']+Info.timespan):
+            if (self.timespan > 0 ) and (ts > entry.con_start+self.timespan):
                 if carries_data:
                     if half:
                         e = half
@@ -303,96 +1427,100 @@ class Info:
                         return
                 else:
                     e = entry
-                if len(e['sblocks']) == 0 and e['disorder'] > 0:    # it was disorder, now there are no more SACK blocks -> disorder ended
-                    if ack > entry['acked']: # for RTOs the above is not sufficient
+                if len(e.sblocks) == 0 and e.disorder > 0:    # it was disorder, now there are no more SACK blocks -> disorder ended
+                    if ack > entry.acked: # for RTOs the above is not sufficient
                         # begin and end of disorder phase, and number of frets/rtos
-                        spur = (1 if e['disorder_spurrexmit'] == e['disorder_fret'] else 0)
-                        e['disorder_phases'].append([e['disorder'], ts, e['disorder_fret'], e['disorder_rto'], spur,  e['disorder_spurrexmit']])
+                        spur = (1 if e.disorder_spurrexmit == e.disorder_fret else 0)
+                        e.disorder_phases.append(e.disorder, ts, e.disorder_fret, e.disorder_rto, spur,  e.disorder_spurrexmit)
                         #print datetime.fromtimestamp(ts)
-                        e['disorder'] = 0
-                        e['disorder_fret'] = 0
-                        e['disorder_rto'] = 0
-                        e['sacked'] = 0
-                        e['disorder_spurrexmit'] = 0
-                        e['flightsize'] = 0
-                        e['recovery_point'] = 0
-                        logging.debug("disorder end 2", datetime.fromtimestamp(ts))
+                        e.disorder = 0
+                        e.disorder_fret = 0
+                        e.disorder_rto = 0
+                        e.sacked = 0
+                        e.disorder_spurrexmit = 0
+                        e.flightsize = 0
+                        e.recovery_point = 0
+                        if e.trace:
+                            trace(e.trace, "disorder end 2 %s", datetime.fromtimestamp(ts))
                 return
 
-            entry['sack'] += sack
-            entry['dsack'] += dsack
+            entry.sack += sack
+            entry.dsack += dsack
 
             if carries_data:
-                entry['all'] += 1
-                entry['bytes'] += tcp_data_len
-                if tcp_data_len > entry['mss']:
-                    entry['mss'] = tcp_data_len
+                entry.all += 1
+                entry.bytes += tcp_data_len
+                if tcp_data_len > entry.mss:
+                    entry.mss = tcp_data_len
             else:
                 # receive window
-                if entry['rcv_wscale'] >= 0:
-                    rcv_wnd = tcp_hdr.win * 2**entry['rcv_wscale']
-                    if len(entry['rcv_win']) == 0 or entry['rcv_win'][-1][1] != rcv_wnd:
-                        entry['rcv_win'].append([ts, rcv_wnd])
+                if entry.rcv_wscale >= 0:
+                    rcv_wnd = win * 2**entry.rcv_wscale
+                    if len(entry.rcv_win) == 0 or entry.rcv_win[-1][1] != rcv_wnd:
+                        entry.rcv_win.append(ts, rcv_wnd)
 
 
             if flags[3]:
-                entry['rst'] = 1
+                entry.rst = 1
             if flags[5]:
-                entry['fin'] = 1
+                entry.fin = 1
+            if (flags[3] or flags[5]) and self.idle != None and self.isClosed(halves):
+                self.closed.add(key)
 
             if tsval != 0:
-                entry['ts_opt'] = 1 # seen a ts option on this connection
+                entry.ts_opt = 1 # seen a ts option on this connection
 
 
             if entry and half:
                 # check if reorder can be detected with acked sack holes
-                if entry['sblocks'] != []:
+                if entry.sblocks != []:
 
-                    if ack > entry['acked']:
+                    if ack > entry.acked:
                         #create list of holes
                         holes = []
-                        if ack >= entry['sblocks'][0][0]:
-                            if entry['acked'] < entry['sblocks'][0][0]:
-                                hole = [entry['acked'], entry['sblocks'][0][0]]
+                        if ack >= entry.sblocks[0][0]:
+                            if entry.acked < entry.sblocks[0][0]:
+                                hole = [entry.acked, entry.sblocks[0][0]]
                                 #print "h1", hole
                                 holes.append(hole)
 
-                        for block in range(len(entry['sblocks'])-1):
-                            if entry['sblocks'][block+1][0] <= ack:
-                                hole = [entry['sblocks'][block][1], entry['sblocks'][block+1][0]]
+                        for block in range(len(entry.sblocks)-1):
+                            if entry.sblocks[block+1][0] <= ack:
+                                hole = [entry.sblocks[block][1], entry.sblocks[block+1][0]]
                                 #print "h2", hole
                                 holes.append(hole)
 
-                        if ack == half['high']:
-                            if half['high'] > entry['sblocks'][len(entry['sblocks'])-1][1]:
-                                hole = [entry['sblocks'][len(entry['sblocks'])-1][1], half['high']]
+                        if ack == half.high:
+                            if half.high > entry.sblocks[len(entry.sblocks)-1][1]:
+                                hole = [entry.sblocks[len(entry.sblocks)-1][1], half.high]
                                 #print "h3", hole
                                 holes.append(hole)
 
                         #find sack_hole for ack
                         for hole in holes:
-                            while hole[0] != hole[1] and entry['disorder_rto'] == 0:
-                                if not half['rexmit'].has_key(hole[0]):
+                            while hole[0] != hole[1] and entry.disorder_rto == 0:
+                                if not half.rexmit.has_key(hole[0]):
                                     #first packet in hole hasn't been retransmitted -> whole hole is reordered
-                                    reoroffset = (entry['sacked'] - hole[0]) #in bytes for now. /half['mss'] #in packets
-                                    logging.debug("reor 6 %s %s", hole, datetime.fromtimestamp(ts))
+                                    reoroffset = (entry.sacked - hole[0]) #in bytes for now. /half.mss #in packets
+                                    if entry.trace:
+                                        trace(entry.trace, "reor 6 %s %s", hole, datetime.fromtimestamp(ts))
                                     self.addReorExtent(entry, ts, hole[0], reoroffset, "sackHole")
-                                    entry['reorder'] += 1
+                                    entry.reorder += 1
                                     break
                                 else:
                                     #first packet was retransmitted, add packet length and check again for new hole
-                                    hole[0] += half['rexmit'][hole[0]][0]
+                                    hole[0] += half.rexmit[hole[0]][0]
 
                 #DSACK reordering detection (for reordering > 1RTT)
-                if dsack == 1 and half and entry['ts_opt'] == 1:
+                if dsack == 1 and half and entry.ts_opt == 1:
                     # make sure that reordering was not detected previously -> info is deleted if used (reor 3)
-                    if half and half['rexmit'].has_key(sack_blocks[0]): #DSACK acks a retransmitted segment
-                        (rlen, rtsval, was_acked, was_rto, holeTs, fs, r) = half['rexmit'][sack_blocks[0]]
+                    if half and half.rexmit.has_key(sack_blocks[0]): #DSACK acks a retransmitted segment
+                        (rlen, rtsval, was_acked, was_rto, holeTs, fs, r) = half.rexmit[sack_blocks[0]]
                         # make sure this was normal recovery, no RTO
                         if not was_rto and not r: # also make sure that reordering wasn't detected before
-                            entry['dreorder'] += 1
+                            entry.dreorder += 1
 
-                            reorAbs = max(entry['acked'], entry['sacked']) - sack_blocks[1]
+                            reorAbs = max(entry.acked, entry.sacked) - sack_blocks[1]
                             reorRel = -1
                             if fs > 0:
                                 reorRel = float(reorAbs)/fs
@@ -404,231 +1532,148 @@ class Info:
                             else:
                                 logging.warn("DSACK reor delay failed %s", sack_blocks[0])
 
-                            entry['dreor_extents'].append([ts, reorAbs, reorRel, rdelay, holeTs])
+                            entry.dreor_extents.append(ts, reorAbs, reorRel, rdelay, holeTs)
 
-                            logging.debug("reor DSACK %s %s %s %s %s", sack_blocks[0], reorAbs, reorRel, rdelay, datetime.fromtimestamp(ts))
+                            if entry.trace:
+                                trace(entry.trace, "reor DSACK %s %s %s %s %s", sack_blocks[0], reorAbs, reorRel, rdelay, datetime.fromtimestamp(ts))
                             # update infos in corresponding disorder phase
-                            #entry['disorder_phases'].append([entry['disorder'], ts, entry['disorder_fret'], entry['disorder_rto'], spur,  entry['disorder_spurrexmit']])
-                            for i, d in enumerate(entry['disorder_phases']):
-                                if holeTs >= d[0] and holeTs <= d[1]:
-                                    entry['disorder_phases'][i][5] += 1
-                                    if entry['disorder_phases'][i][5] == entry['disorder_phases'][i][2]:
-                                        entry['disorder_phases'][i][4] = 1
+                            phases = entry.disorder_phases
+                            begins, ends, frets, rtos, spurious, spurrexmits = phases.columns
+                            for i in xrange(len(begins)):
+                                if holeTs >= begins[i] and holeTs <= ends[i]:
+                                    phases.set(i, 5, spurrexmits[i] + 1)
+                                    if spurrexmits[i] == frets[i]:
+                                        phases.set(i, 4, 1)
 
 
             #process sack blocks
             #also includes reordering detection for sack holes closed by sack blocks
-            done = 0
-            while done == 0:
-                done = 1
-                for block in entry['sblocks']: #delete sack blocks, which are lower than cumulative ack
-                    if block[1] <= ack:
-                        entry['sblocks'].remove(block)
-                        done = 0
-                        break
+            if timer:
+                timer.lap('tcp')
+            entry.sblocks.prune(ack)
 
             newly_sacked = 0
             if len(sack_blocks) > 0:
                 newly_sacked = max(sack_blocks)
 
-            if len(entry['sblocks']) > 0:
+            if len(entry.sblocks) > 0:
                 #merge with new sack blocks
-                for block in range(0, len(sack_blocks), 2):
-                    done = 0
-                    for i in range(len(entry['sblocks'])):
-                        #print entry['sblocks'], i
-                        if sack_blocks[block+1] <= ack: #DSACK
-                            done = 1
-                            break
-
-                        #sack block exists
-                        if sack_blocks[block] >= entry['sblocks'][i][0] and sack_blocks[block+1] <= entry['sblocks'][i][1]:
-                            done = 1
-                            break
-
-                        #new sack block is longer than existing
-                        save_hole = 0
-                        newly_acked = []
-                        #    extends upwards
-                        if sack_blocks[block] == entry['sblocks'][i][0] and sack_blocks[block+1] > entry['sblocks'][i][1]:
-                            if i < len(entry['sblocks'])-1: #its not the last one
-                                save_hole = entry['sblocks'][i][1]
-                                logging.debug("reor 1 %s %s %s", entry['sblocks'][i], save_hole, datetime.fromtimestamp(ts))
-                            newly_acked = [entry['sblocks'][i][1]]
-                            entry['sblocks'][i][1] = sack_blocks[block+1]
-                            done = 1
-
-                        #    extends downwards
-                        if sack_blocks[block] < entry['sblocks'][i][0] and sack_blocks[block+1] == entry['sblocks'][i][1] and done == 0:
-                            save_hole = sack_blocks[block]
-                            newly_acked = [save_hole]
-                            logging.debug("reor 2 %s %s", entry['sblocks'][i], save_hole)
-                            entry['sblocks'][i][0] = sack_blocks[block]
-                            done = 1
-
-                        #    extends both ways (ACK loss?)
-                        if sack_blocks[block] < entry['sblocks'][i][0] and sack_blocks[block+1] > entry['sblocks'][i][1] and done == 0:
-                            newly_acked = [sack_blocks[block], entry['sblocks'][i][1]]
-                            entry['sblocks'][i][0] = sack_blocks[block]
-                            entry['sblocks'][i][1] = sack_blocks[block+1]
-                            done = 1
-
-                        self.reorderSACK(save_hole, newly_sacked, tsecr, entry, half, ts)
-                        self.sackRetrans(newly_acked, half)
-
-
-                    # not found any corresponding SACK block, insert somewhere
-                    if not done and len(entry['sblocks']) > 0:
-                        for j in range(len(entry['sblocks'])): # try to put it between two existing
-                            if entry['sblocks'][j][0] >= sack_blocks[block+1]:
-                                entry['sblocks'].insert(j, [sack_blocks[block],sack_blocks[block+1]])
-                                hole = sack_blocks[block]
-                                self.reorderSACK(hole, newly_sacked, tsecr, entry, half, ts)
-                                self.sackRetrans([hole], half)
-                                done = 1
-                                break
-                        if not done:
-                            #print entry['sblocks']
-                            last = entry['sblocks'][-1][1]
-                            new = sack_blocks[block]
-                            if last < new: # starts after last SACK block
-                                entry['sblocks'].append([sack_blocks[block],sack_blocks[block+1]])
-
-            else: # len(entry['sblocks']) == 0
-                for block in range(0, len(sack_blocks), 2):
-                    if sack_blocks[block] <= max(ack, entry['acked']):
-                        #print datetime.fromtimestamp(ts), entry['acked'], sack_blocks[block]
-                        continue
-                    entry['sblocks'].insert(0, [sack_blocks[block],sack_blocks[block+1]])
-                if len(entry['sblocks']) > 0:
-                    entry['sacked'] = newly_sacked
-                    if entry['interr_rexmits'] == 0: # not in RTO
+                for hole, newly_acked in entry.sblocks.merge(sack_blocks, ack):
+                    self.reorderSACK(hole, newly_sacked, tsecr, entry, half, ts)
+                    self.sackRetrans(newly_acked, half)
+
+            else: # len(entry.sblocks) == 0
+                entry.sblocks.fill(sack_blocks, max(ack, entry.acked))
+                if len(entry.sblocks) > 0:
+                    entry.sacked = newly_sacked
+                    if entry.interr_rexmits == 0: # not in RTO
                         # there haven't been any SACK blocks, now there are new incoming -> start of disorder
-                        entry['disorder'] = ts
-                        if half and half['high'] > 0:
-                            entry['recovery_point'] = half['high'] + half['high_len']
-                            entry['flightsize'] = entry['recovery_point'] - ack
-                        logging.debug("disorder begin (new SACK blocks) %s %s %s %s", sack_blocks, datetime.fromtimestamp(ts), entry['recovery_point'], entry['flightsize'])
+                        entry.disorder = ts
+                        if half and half.high > 0:
+                            entry.recovery_point = half.high + half.high_len
+                            entry.flightsize = entry.recovery_point - ack
+                        if entry.trace:
+                            trace(entry.trace, "disorder begin (new SACK blocks) %s %s %s %s", sack_blocks, datetime.fromtimestamp(ts), entry.recovery_point, entry.flightsize)
 
-            if newly_sacked > entry['sacked']:
-                entry['sacked'] = newly_sacked
+            if newly_sacked > entry.sacked:
+                entry.sacked = newly_sacked
 
             # combine SACK blocks if necessary (can't be done above, since the i would then be screwed up)
-            done = 0
-            while done == 0:
-                done = 1
-                for i in range(len(entry['sblocks'])):
-                    if len(entry['sblocks']) > i+1:
-                        if entry['sblocks'][i][0] <= entry['sblocks'][i+1][0] and entry['sblocks'][i][1] >= entry['sblocks'][i+1][1]:
-                            # first one includes second
-                            entry['sblocks'].remove(entry['sblocks'][i+1])
-                            done = 0
-                            break #start anew, index have changed
-                        if entry['sblocks'][i][0] >= entry['sblocks'][i+1][0] and entry['sblocks'][i][1] <= entry['sblocks'][i+1][1]:
-                            # second one includes first
-                            entry['sblocks'].remove(entry['sblocks'][i])
-                            done = 0
-                            break #start anew, index have changed
-                        if entry['sblocks'][i][1] >= entry['sblocks'][i+1][0]:
-                            # end of first is at the edge of second -> combine
-                            #print "r3", entry['sblocks'][i], entry['sblocks'][i+1]
-                            newend = entry['sblocks'][i+1][1]
-                            entry['sblocks'][i][1] = newend
-                            entry['sblocks'].remove(entry['sblocks'][i+1])
-                            done = 0
-                            break #start anew, index have changed
-
-            #print ack, entry['sblocks']
+            entry.sblocks.combine()
+            if timer:
+                timer.lap('sack')
+
+            #print ack, entry.sblocks
 
             # reordering detection for retransmitted packets
-            if ack > entry['acked'] and tsecr > 0 and entry['disorder'] > 0 and entry['disorder_rto'] == 0 and half:
-                for rseq in half['rexmit']:
-                    (rlen, rtsval, was_acked, was_rto, holeTs, fs, r) = half['rexmit'][rseq]
-                    if rseq >= entry['acked'] and rseq < ack: # retransmission newly acked
-                        #print half['rexmit'][rseq]
-                        if tsecr < rtsval and was_acked == 0:
-                            reoroffset = max(ack, entry['sacked']) - rseq
-                            #print ack, rseq, reoroffset, entry['flightsize']
-                            logging.debug("reor 3 %s %s", rseq, datetime.fromtimestamp(entry['disorder']))
-                            self.addReorExtent(entry, ts, rseq, reoroffset, "rexmit")
-                            entry['reorder_rexmit'] += 1
-                            entry['disorder_spurrexmit'] += 1
-                            half['rexmit'][rseq][6] = 1 # mark as reordering detected
-                        half['rexmit'][rseq][2] = 1 # mark as acked
+            if ack > entry.acked and tsecr > 0 and entry.disorder > 0 and entry.disorder_rto == 0 and half:
+                for rseq in half.rexmit.between(entry.acked, ack): # retransmissions newly acked
+                    (rlen, rtsval, was_acked, was_rto, holeTs, fs, r) = half.rexmit[rseq]
+                    #print half.rexmit[rseq]
+                    if tsecr < rtsval and was_acked == 0:
+                        reoroffset = max(ack, entry.sacked) - rseq
+                        #print ack, rseq, reoroffset, entry.flightsize
+                        if entry.trace:
+                            trace(entry.trace, "reor 3 %s %s", rseq, datetime.fromtimestamp(entry.disorder))
+                        self.addReorExtent(entry, ts, rseq, reoroffset, "rexmit")
+                        entry.reorder_rexmit += 1
+                        entry.disorder_spurrexmit += 1
+                        half.rexmit[rseq][6] = 1 # mark as reordering detected
+                    half.rexmit[rseq][2] = 1 # mark as acked
+            if timer:
+                timer.lap('rexmit')
 
 
             # maintain list of SACK holes for calculation of reordering delay
             if not carries_data:
                 # - remove holes below ACK
-                done = 0
-                while done == 0:
-                    done = 1
-                    for h in entry['reor_holes']: #[begin, end, ts]
-                        if h[1] <= ack:
-                            entry['reor_holes'].remove(h)
-                            done = 0
-                            break
+                entry.reor_holes.prune(ack)
 
                 # - SACK blocks have already been processed, so just check holes and compare to saved ones
-                for i in range(len(entry['sblocks'])):
+                for i in range(len(entry.sblocks)):
                     hole = []
                     if i == 0:
-                        hole = [ack, entry['sblocks'][i][0]]
+                        hole = [ack, entry.sblocks[i][0]]
                     else:
-                        hole = [entry['sblocks'][i-1][1], entry['sblocks'][i][0]]
+                        hole = [entry.sblocks[i-1][1], entry.sblocks[i][0]]
 
-                    exists = 0
-                    for h in entry['reor_holes']:
-                        if hole[0] >= h[0] and hole[1] <= h[1]: # SACK hole falls within an already saved one
-                            exists = 1
-                            break
-                    if not exists: # new SACK hole found, save with ts
-                        entry['reor_holes'].append([hole[0], hole[1], ts])
+                    # new SACK hole found, save with ts (unless it falls within an already saved one)
+                    entry.reor_holes.add(hole[0], hole[1], ts)
+            if timer:
+                timer.lap('sack')
+                timer.sizes(entry, half)
 
 
-            if not carries_data and not entry['rst'] and not entry['fin']:
+            if not carries_data and not entry.rst and not entry.fin:
                 # if there hasn't been an ACK in some time -> connection interruption
-                #print ts - entry['last_ts'] #print every ACK inter arrival time
+                #print ts - entry.last_ts #print every ACK inter arrival time
                 spurious = 0
-                if entry['interr_rto_tsval'] != 0 and tsecr < entry['interr_rto_tsval']:
+                if entry.interr_rto_tsval != 0 and tsecr < entry.interr_rto_tsval:
                     spurious = 1
-                entry['interruptions'].append([entry['last_ts'], ts, entry['interr_rexmits'], spurious])
-                entry['interr_rexmits'] = 0
-                entry['interr_rto_tsval'] = 0
-                    #print datetime.fromtimestamp(entry['last_ts']),datetime.fromtimestamp(ts),datetime.fromtimestamp(entry['istart'])
-            entry['last_ts'] = ts
-
-
-            if len(entry['sblocks']) == 0 and entry['disorder'] > 0:    # it was disorder, now there are no more SACK blocks -> disorder ended
-                if ack > entry['acked']: # for RTOs the above is not sufficient
+                gap = ts - entry.last_ts
+                if gap > Info.coninterrtime:
+                    entry.interruptions.append(entry.last_ts, ts, entry.interr_rexmits, spurious)
+                if entry.gaps != None:
+                    entry.gaps[bisect.bisect_right(Info.gapedges, gap)] += 1
+                entry.interr_rexmits = 0
+                entry.interr_rto_tsval = 0
+                    #print datetime.fromtimestamp(entry.last_ts),datetime.fromtimestamp(ts),datetime.fromtimestamp(entry.istart)
+            entry.last_ts = ts
+
+
+            if len(entry.sblocks) == 0 and entry.disorder > 0:    # it was disorder, now there are no more SACK blocks -> disorder ended
+                if ack > entry.acked: # for RTOs the above is not sufficient
                     # begin and end of disorder phase, and number of frets/rtos
-                    spur = (1 if entry['disorder_spurrexmit'] == entry['disorder_fret'] else 0)
+                    spur = (1 if entry.disorder_spurrexmit == entry.disorder_fret else 0)
 
-                    entry['disorder_phases'].append([entry['disorder'], ts, entry['disorder_fret'], entry['disorder_rto'], spur,  entry['disorder_spurrexmit']])
+                    entry.disorder_phases.append(entry.disorder, ts, entry.disorder_fret, entry.disorder_rto, spur,  entry.disorder_spurrexmit)
 
-                    entry['disorder'] = 0
-                    entry['disorder_fret'] = 0
-                    entry['disorder_rto'] = 0
-                    entry['sacked'] = 0
-                    entry['disorder_spurrexmit'] = 0
-                    entry['flightsize'] = 0
-                    entry['recovery_point'] = 0
+                    entry.disorder = 0
+                    entry.disorder_fret = 0
+                    entry.disorder_rto = 0
+                    entry.sacked = 0
+                    entry.disorder_spurrexmit = 0
+                    entry.flightsize = 0
+                    entry.recovery_point = 0
 
-                    logging.debug("disorder end %s", datetime.fromtimestamp(ts))
+                    if entry.trace:
+                        trace(entry.trace, "disorder end %s", datetime.fromtimestamp(ts))
 
 
             # updated last acked packet (snd.una)
-            if ack > entry['acked']:
-                entry['acked'] = ack
+            if ack > entry.acked:
+                entry.acked = ack
+                if half:
+                    half.rexmit.prune(ack)
 
 
             if carries_data:
-                if seq > entry['high']:
+                if seq > entry.high:
                     #store highest sent seq no
-                    entry['high'] = seq
-                    entry['high_len'] = tcp_data_len
+                    entry.high = seq
+                    entry.high_len = tcp_data_len
                 else:
-                    if not entry['rexmit'].has_key(seq):
+                    if not entry.rexmit.has_key(seq):
                         if half:
                             #print "new rexmit"
                             #paket is retransmit, store seq no and length
@@ -636,222 +1681,1751 @@ class Info:
 
                             # rto, holeTs and fs are needed for reordering > 1RTT with DSACK
                             holeTs = self.sackHoleTs(half, seq)
-                            fs = half['flightsize']
+                            fs = half.flightsize
 
                             rto = 0
-                            if half['interr_rexmits'] > 0 or half['disorder_rto'] > 0: # in RTO
+                            if half.interr_rexmits > 0 or half.disorder_rto > 0: # in RTO
                                 rto = 1
                             # if only one or two packets are SACKed and then RTO expires this happens
-                            if half['sacked'] > 0 and seq >= half['sacked']:
+                            if half.sacked > 0 and seq >= half.sacked:
                                 rto = 1
-                                                  # seg len, ts, acked?, rto?, rdelay ts, flightsize, reordered?
-                            entry['rexmit'][seq] = [length, tsval, 0,    rto,  holeTs,    fs,         0]
+                                                    # seg len, ts, acked?, rto?, rdelay ts, flightsize, reordered?
+                            entry.rexmit.add(seq, [length, tsval, 0,    rto,  holeTs,    fs,         0])
 
                             #print "check ret"
-                            if half['disorder'] > 0:    # already in disorder
+                            if half.disorder > 0:    # already in disorder
                                 #print "in disorder"
-                                if entry['sblocks'] > 0 and half['disorder_rto'] == 0:
-                                    half['disorder_fret'] += 1
+                                if entry.sblocks > 0 and half.disorder_rto == 0:
+                                    half.disorder_fret += 1
                                 else:
-                                    half['disorder_rto'] += 1
+                                    half.disorder_rto += 1
                                     #print "rto+1 in disorder", seq, ack, tcp_data_len
                             else: # this is an RTO (has not been in disorder so far)
-                                #half['disorder'] = ts
-                                half['interr_rexmits'] += 1
-                                if half['interr_rto_tsval'] == 0:
-                                    half['interr_rto_tsval'] = tsval
-                                entry['rexmit'][seq][3] = 1 #mark as RTO
+                                #half.disorder = ts
+                                half.interr_rexmits += 1
+                                if half.interr_rto_tsval == 0:
+                                    half.interr_rto_tsval = tsval
+                                entry.rexmit[seq][3] = 1 #mark as RTO
                                 #print "rto+1 not in disorder", seq, ack, tcp_data_len 
-                                logging.debug("RTO (timeout) %s", datetime.fromtimestamp(ts))
+                                if entry.trace:
+                                    trace(entry.trace, "RTO (timeout) %s", datetime.fromtimestamp(ts))
                     else:
                         # the pkt was rexmited previously -> RTO
-                        logging.debug("RTO (2nd rexmit) %s", datetime.fromtimestamp(ts))
-                        entry['rexmit'][seq][3] = 1 #mark as RTO
+                        if entry.trace:
+                            trace(entry.trace, "RTO (2nd rexmit) %s", datetime.fromtimestamp(ts))
+                        entry.rexmit[seq][3] = 1 #mark as RTO
                         if half:
-                            if half['disorder'] > 0:
-                                half['disorder_rto'] += 1
+                            if half.disorder > 0:
+                                half.disorder_rto += 1
                                 #print "rto+1 previously rexmitted", seq, ack, tcp_data_len
                             else:
-                                half['interr_rexmits'] += 1
+                                half.interr_rexmits += 1
             else:
                 # update recovery point and flightsize
-                if len(entry['sblocks']) > 0 and ack > entry['recovery_point'] and half and half['high'] > 0:
-                    entry['recovery_point'] = half['high'] + entry['high_len']
-                    entry['flightsize'] = entry['recovery_point'] - ack
-                    #print "u", entry['recovery_point'], entry['flightsize'], entry['sblocks']
+                if len(entry.sblocks) > 0 and ack > entry.recovery_point and half and half.high > 0:
+                    entry.recovery_point = half.high + entry.high_len
+                    entry.flightsize = entry.recovery_point - ack
+                    #print "u", entry.recovery_point, entry.flightsize, entry.sblocks
+
+
+
+class Analyzer:
+    '''
+    Analysis of one trace: feed(ts, buf) with every packet, then finish()
+    All state is kept in the object, so several analyses can run side by side
+    nice: print nice output, otherwise results are dicts
+    stream: finalize connections as soon as they are closed or idle for
+            <idletimeout> seconds and free them
+    emit: called with the dict of each finalized connection, by default the
+          dicts are collected and returned by finish()
+    fast: decode headers with fastDecode instead of dpkt
+    ports, hosts: analyse only packets from/to these, see PreFilter
+    gaps: add a histogram of the ACK inter arrival times to the results
+    trace: endpoints (see endpoint) of connections to log debug messages for,
+           with debug logging enabled all connections are traced
+    stats: count packets, time per stage etc. in self.stats (see Stats)
+    interruption: report only interruptions longer than this (sec), at least
+                  Info.coninterrtime (the shorter ones are not kept)
+    record: called with each list of finalized connections, see Cache
+    sample: analyse only this share of the connections (0 < sample < 1) and
+            estimate the totals of all in self.sample, see FlowSample
+    printed: called with the number of connections output after each, see Checkpoint
+    '''
+    sweep = 1               # interval (sec) of checks for finished connections in stream mode
+
+    def __init__(self, timelimit=0, nice=False, netradar=True, stream=False, idletimeout=120, emit=None,
+                 fast=False, ports=None, hosts=None, gaps=False, trace=None, stats=False,
+                 interruption=None, record=None, sample=None, printed=None):
+        self.stats = None
+        if stats:
+            self.stats = Stats()
+        self.info = Info(timelimit=timelimit, gaps=gaps, trace=trace, stats=self.stats)
+        self.nice = nice
+        self.netradar = netradar
+        self.stream = stream
+        self.fast = fast
+        self.filter = PreFilter(ports, hosts, sample)
+        self.sample = None
+        if sample != None and sample < 1:
+            self.sample = FlowSample(sample)
+        self.idletimeout = idletimeout
+        self.interruption = Info.coninterrtime
+        if interruption != None and interruption > Info.coninterrtime:
+            self.interruption = interruption
+        self.record = record
+        self.results = []
+        if emit == None:
+            emit = self.results.append
+        self.emit = emit
+        self.nextsweep = 0
+        self.printed = printed
+        self.finalized = 0      # connections output
+        self.skip = 0           # connections output before a resumed checkpoint, not output again
+
+    def feed(self, ts, buf, linktype=LINK_ETHERNET):
+        '''
+        Process one packet
+        buf: frame of the given pcap link type (Ethernet, Linux cooked or raw IP)
+        '''
+        if not self.filter.accept(buf, linktype):
+            if self.stats != None:
+                self.stats.skipped += 1
+            return
+        self.info.addFrame(ts, buf, self.fast, linktype)
 
+        if self.stream and ts >= self.nextsweep:
+            self.nextsweep = ts + Analyzer.sweep
+            self.finalize(self.info.evict(ts, self.idletimeout))
 
+    def finish(self):
+        '''
+        Finalize all remaining connections
+        returns the collected result dicts (empty if emit is given or in nice mode)
+        '''
+        self.finalize(self.info.connections)
+        return self.results
+
+    def finalize(self, cons):
+        start = time.time()
+        window = self.info.window
+        if window != None: # connections seen in the lead-in only
+            cons = [c for c in cons if c.last_seen >= window or (c.half and c.half.last_seen >= window)]
+        if self.record != None:
+            self.record(cons)
+        for con in cons:
+            if self.skip > 0:
+                self.skip -= 1
+                self.output(con, False)
+            else:
+                dumpdata = self.output(con)
+                if dumpdata and not self.nice:
+                    self.emit(dumpdata)
+            self.finalized += 1
+            if self.printed != None:
+                sys.stdout.flush()
+                self.printed(self.finalized)
+        sys.stdout.flush()
+        if self.stats != None:
+            self.stats.output += time.time() - start
+
+    def distribution(self, series, extent, rel, delay):
+        '''
+        Percentiles (Info.percentiles) of the reordering extents and delays in series
+        extent, rel, delay: columns of the absolute and relative extent and the delay,
+                            failed values (-1) are left out
+        returns dict with a list (None if there are no values) for each
+        '''
+        result = {}
+        for name, i in (('extentAbs', extent), ('extentRel', rel), ('reorDelay', delay)):
+            values = series.column(i)
+            if name != 'extentAbs':
+                if numpy != None:
+                    values = values[values >= 0]
+                else:
+                    values = [v for v in values if v >= 0]
+            result[name] = percentiles(values, Info.percentiles)
+        return result
 
-class PcapInfo(): 
+    def output(self, con, show=True):
+        '''
+        Build the results of one half connection
+        con: half connection (the one sending ACKs), taken from Info.connections
+        show: False to only count con in self.sample
+        returns dict (None if con is skipped), prints it instead in nice mode
+        '''
+        nice = self.nice
+        netradar = self.netradar
+        KILO = 1024
+        if not con.half:
+            logging.warn("no two way connection (%s:%s - %s:%s)\n", ipText(con.src), con.sport, ipText(con.dst), con.dport)
+            return None
+
+        # netradar is not used rely on data transmitted, netradar setup -> use server port numbers
+        if ((not netradar) and (con.half) and (con.half.all > 0)) \
+            or ((netradar) and (con.dport in [6007,6078])):
+
+            # goodput
+            gtime = 0
+            if self.info.timespan > 0:
+                gtime = self.info.timespan # length of connection
+            else:
+                gtime = con.half.last_ts - con.half.con_start
+
+            if gtime <= 0:
+                logging.warn("no duration (%s:%s - %s:%s)\n", ipText(con.src), con.sport, ipText(con.dst), con.dport)
+                return None
+
+            goodput = float(con.half.bytes*8)/(gtime*KILO) # in kbit/s
+
+            # interruptions (only the ones longer than coninterrtime are kept)
+            interruptions = con.interruptions
+            if self.interruption > Info.coninterrtime:
+                begins, ends = interruptions.column(0), interruptions.column(1)
+                if numpy != None:
+                    keep = ((ends - begins) > self.interruption).tolist()
+                else:
+                    keep = [end - begin > self.interruption for begin, end in zip(begins, ends)]
+                interruptions = interruptions.where(keep)
+            begins, ends, rtos, spurious = [interruptions.column(i) for i in range(4)]
+            totalconinterrno = len(begins)
+            if numpy != None:
+                totalconinterrtime = float((ends - begins).sum()) if totalconinterrno else 0
+                withrto = int(numpy.count_nonzero(rtos))
+                rtospurious = int(numpy.count_nonzero(spurious))
+            else:
+                totalconinterrtime = sum([end - begin for begin, end in zip(begins, ends)])
+                withrto = sum(1 for r in rtos if r)
+                rtospurious = sum(1 for r in spurious if r)
+            goodputwointerr = (goodput*gtime)/(gtime-totalconinterrtime)
+
+            # fast recovery: disorder phases with retransmissions, the others are reordering
+            begins, ends, frets, rtos, spurious = [con.disorder_phases.column(i) for i in range(5)]
+            if numpy != None:
+                recovery = frets > 0
+                totalfastrecno = int(numpy.count_nonzero(recovery))
+                totalfastrectime = float((ends - begins)[recovery].sum()) if totalfastrecno else 0
+                totalfastrecrexmit = int(frets.sum())
+                totalfastrecrto = int(numpy.count_nonzero(rtos[recovery]))
+                totalspurious = int(numpy.count_nonzero(spurious[recovery]))
+            else:
+                recovery = [r > 0 for r in frets]
+                totalfastrecno = sum(recovery)
+                totalfastrectime = sum([end - begin for begin, end, r in zip(begins, ends, recovery) if r])
+                totalfastrecrexmit = sum(frets)
+                totalfastrecrto = sum(1 for r, rto in zip(recovery, rtos) if r and rto)
+                totalspurious = sum(1 for r, sp in zip(recovery, spurious) if r and sp)
+            reorderworexmit = len(begins) - totalfastrecno
+            if con.trace:
+                for begin, end, fret in zip(*con.disorder_phases.columns[:3]):
+                    if not fret:
+                        trace(con.trace, "reor 4 %s %s", datetime.fromtimestamp(begin), datetime.fromtimestamp(end))
+
+            if self.sample != None:
+                self.sample.add(con.half.bytes, goodput, totalconinterrtime, totalconinterrno, totalfastrectime,
+                                totalfastrecno, reorderworexmit + con.reorder + con.reorder_rexmit + con.dreorder)
+            if not show:
+                return None
+
+            reordist = self.distribution(con.reor_extents, 1, 2, 4)
+            dreordist = self.distribution(con.dreor_extents, 1, 2, 3)
+
+            if nice == True:
+                # nice output
+                print ("%s:%s - %s:%s --> %s pkts in %0.2f s, MSS = %s, %0.2f kbit/s" \
+                        %(ipText(con.src),con.sport,ipText(con.dst),con.dport,con.half.all,
+                          gtime, con.half.mss, goodput))
+                print ("Options: SACK = %s, DSACK = %s, TS = %s" \
+                        %('1' if con.sack > 0 else '0', \
+                          '1' if con.dsack > 0 else '0', \
+                          con.ts_opt))
+                print ("Connection Interruption time: %0.2f s ( %s interruptions, %s with RTOs, %s spurious ) --> %0.2f kbit/s" \
+                        %(totalconinterrtime, totalconinterrno, withrto, rtospurious, goodputwointerr))
+                if con.gaps != None:
+                    print ("ACK inter arrival times: %s , >= %s s: %s" \
+                            %(" , ".join(["< %s s: %s" %(edge, n) for edge, n in zip(Info.gapedges, con.gaps)]),
+                              Info.gapedges[-1], con.gaps[-1]))
+                print ("Fast Recovery time: %0.2f s ( %s phases, %s spurious, %s with RTOs, %s total frets )" \
+                        %(totalfastrectime, totalfastrecno, totalspurious, totalfastrecrto, totalfastrecrexmit))
+                print ("Reorder: W/o retransmit = %s , Closed SACK holes = %s , Rexmits (TSval tested) = %s , DSACK+TS = %s" \
+                        %(reorderworexmit, con.reorder, con.reorder_rexmit, con.dreorder))
+                for name, dist in (("Reorder", reordist), ("DSACK+TS", dreordist)):
+                    if dist['extentAbs'] == None:
+                        continue
+                    values = lambda key, fmt: "/".join([fmt %(v) for v in dist[key] or []]) or "-"
+                    print ("%s percentiles %s: extent = %s , rel. extent = %s , delay = %s s" \
+                            %(name, "/".join([str(p) for p in Info.percentiles]), values('extentAbs', "%0.0f"),
+                              values('extentRel', "%0.2f"), values('reorDelay', "%0.3f")))
+                print ("")
+            else:
+                # return json
+                dumpdata = {}
+
+                begins, ends, rtos, spurious = [c.tolist() for c in interruptions.columns]
+                interrinfos = [{'start': b, 'duration': e - b, 'rtos': r, 'spurious': sp}
+                               for b, e, r, sp in zip(begins, ends, rtos, spurious)]
+                begins, ends, frets, rtos, spurious = [c.tolist() for c in con.disorder_phases.columns[:5]]
+                phases = [{'start': b, 'duration': e - b, 'rexmits': fret, 'rtos': rto, 'spurious': sp}
+                          for b, e, fret, rto, sp in zip(begins, ends, frets, rtos, spurious) if fret]
+                dphases = [{'start': b, 'duration': e - b}
+                           for b, e, fret in zip(begins, ends, frets) if not fret]
+                ok = lambda v: v if v >= 0 else -1 # failed values are stored as -1.0
+                ts, extent, rel, reason, delay, holets = [c.tolist() for c in con.reor_extents.columns]
+                reorentry = [{'ts': t, 'extentAbs': a, 'extentRel': ok(r), 'reason': Info.reasons[why], 'reorDelay': ok(d), 'holeTs': ok(h)}
+                             for t, a, r, why, d, h in zip(ts, extent, rel, reason, delay, holets)]
+                ts, extent, rel, delay, holets = [c.tolist() for c in con.dreor_extents.columns]
+                dreorentry = [{'ts': t, 'extentAbs': a, 'extentRel': ok(r), 'reorDelay': ok(d), 'holeTs': ok(h)}
+                              for t, a, r, d, h in zip(ts, extent, rel, delay, holets)]
+
+                dumpdata['srcIp']           = ipText(con.src)
+                dumpdata['dstIp']           = ipText(con.dst)
+                dumpdata['srcPort']         = con.sport
+                dumpdata['dstPort']         = con.dport
+
+                dumpdata['start']           = con.con_start
+                dumpdata['duration']        = gtime
+                dumpdata['goodput']         = goodput
+                dumpdata['goodputInterr']   = goodputwointerr
+                dumpdata['options']         = {'sack': 1 if con.sack > 0 else 0,
+                                               'dsack': 1 if con.dsack > 0 else 0,
+                                               'ts': con.ts_opt}
+                dumpdata['interruptions']   = {'minInterruption': self.interruption,
+                                               'time': totalconinterrtime,
+                                               'number': totalconinterrno,
+                                               'withRto': withrto,
+                                               'spurious': rtospurious,
+                                               'infos': interrinfos}
+                if con.gaps != None:
+                    dumpdata['interruptions']['gaps'] = {'edges': Info.gapedges, 'counts': con.gaps}
+                dumpdata['fastRecovery']    = {'time': totalfastrectime,
+                                               'number': totalfastrecno,
+                                               'spurious': totalspurious,
+                                               'withRto': totalfastrecrto,
+                                               'totalFrets': totalfastrecrexmit,
+                                               'infos': phases}
+                dumpdata['reorder']         = {'woRexmit': reorderworexmit,
+                                               'sackHoles': con.reorder,
+                                               'rexmit': con.reorder_rexmit,
+                                               'extents': reorentry,
+                                               'dsackts': con.dreorder,
+                                               'dextents': dreorentry,
+                                               'disorder': dphases,
+                                               'percentiles': Info.percentiles,
+                                               'distribution': reordist,
+                                               'ddistribution': dreordist}
+                #print dumpdata
+                return dumpdata
+
+
+PCAP_MAGICS = {0xa1b2c3d4: (1E6, 0),     # magic -> timestamp divisor, extra bytes of the record header
+               0xa1b23c4d: (1E9, 0),
+               0xa1b2cd34: (1E6, 8)}
+PCAPNG_SHB = b'\x0a\x0d\x0d\x0a'       # block type of the pcapng section header
+
+def pcapHeader(buf):
+    '''
+    Parse the header of a classic pcap file
+    returns (timestamp divisor, record header length, record struct, snaplen, linktype)
+    '''
+    if len(buf) < 24:
+        raise ValueError('no pcap file header')
+    for endian in '<>':
+        magic = struct.unpack_from(endian + 'I', buf, 0)[0]
+        if magic in PCAP_MAGICS:
+            break
+    else:
+        raise ValueError('invalid pcap magic number')
+    divisor, extra = PCAP_MAGICS[magic]
+    snaplen, linktype = struct.unpack_from(endian + 'II', buf, 16)
+    # tv_sec, tv_usec/nsec, caplen, len
+    return divisor, 16 + extra, struct.Struct(endian + 'IIII'), snaplen, linktype
+
+
+class MmapReader:
+    '''
+    Reads a classic pcap file through mmap instead of file reads
+    Iterating gives (ts, buf, linktype) like all readers here, buf is a
+    read-only buffer into the mapped file, the packet is not copied. Both byte orders,
+    microsecond and nanosecond timestamps and the modified pcap format are
+    supported.
+    '''
+    def __init__(self, f):
+        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.divisor, self.hdrlen, self.record, self.snaplen, self.linktype = pcapHeader(self.map)
+        self.total = len(self.map)  # file size
+        self.o = 24             # offset of the next record
+
+    def datalink(self):
+        return self.linktype
+
+    def position(self):
+        # bytes of the file read so far
+        return self.o
+
+    def seek(self, o):
+        # continue at offset o (from position()), before iterating
+        self.o = o
+
+    def close(self):
+        # the buffers given out are invalid afterwards
+        self.map.close()
+
+    def offsets(self):
+        # (ts, offset) of all records, reading only their headers (see TraceIndex)
+        m = self.map
+        size = len(m)
+        unpack = self.record.unpack_from
+        divisor = self.divisor
+        hdrlen = self.hdrlen
+        o = 24
+        while o + hdrlen <= size:
+            sec, frac, caplen, l = unpack(m, o)
+            yield sec + frac / divisor, o
+            o += hdrlen + caplen
+
+    def __iter__(self):
+        m = self.map
+        size = len(m)
+        unpack = self.record.unpack_from
+        divisor = self.divisor
+        hdrlen = self.hdrlen
+        linktype = self.linktype
+        o = self.o
+        while o + hdrlen <= size:
+            sec, frac, caplen, l = unpack(m, o)
+            start = o + hdrlen
+            o = start + caplen
+            self.o = o          # already behind the packet while it is processed
+            # Python 2 mmaps have no memoryview, buffer() slices them without copying
+            yield (sec + frac / divisor, buffer(m, start, min(caplen, size - start)), linktype)
+
+
+class Chunks:
+    '''
+    The bytes of a trace read in large chunks, decompressed on the fly if
+    they start with a gzip, xz or zstd header
+    f: file to read from (a file, pipe or stdin), read with os.read so that
+       whatever arrived on a pipe is processed at once
+    head: bytes already read from f
+    '''
+    size = 1 << 20          # bytes per read
+
+    def __init__(self, f, head):
+        self.f = f
+        self.head = head
+        self.read = len(head)   # bytes read from f
+        self.total = None       # size of f, None if it is no regular file
+        st = os.fstat(f.fileno())
+        if stat.S_ISREG(st.st_mode):
+            self.total = st.st_size
+        self.decompressor = None
+        if head.startswith(b'\x1f\x8b'):
+            self.decompressor = lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif head.startswith(b'\xfd7zXZ\x00'):
+            if lzma == None:
+                raise ValueError('xz compressed input needs the lzma module')
+            self.decompressor = lzma.LZMADecompressor
+        elif head.startswith(b'\x28\xb5\x2f\xfd'):
+            if zstandard == None:
+                raise ValueError('zstd compressed input needs the zstandard module')
+            self.decompressor = lambda: zstandard.ZstdDecompressor().decompressobj()
+
+    def __iter__(self):
+        data = self.head
+        if self.decompressor == None:
+            while data:
+                yield data
+                data = os.read(self.f.fileno(), Chunks.size)
+                self.read += len(data)
+            return
+        d = self.decompressor()
+        while True:
+            if not data:
+                data = os.read(self.f.fileno(), Chunks.size)
+                if not data:
+                    break
+                self.read += len(data)
+            if getattr(d, 'eof', False):
+                d = self.decompressor()
+            out = d.decompress(data)
+            # data after the end of a gzip member or xz stream starts the next one
+            data = getattr(d, 'unused_data', b'')
+            if data:
+                d = self.decompressor()
+            if out:
+                yield out
+
+
+class StreamReader:
+    '''
+    Base of the readers that parse a trace from Chunks
+    The chunks are collected in one buffer, records are unpacked from it in place
+    source: the Chunks object, for the progress in the file
+    '''
+    def __init__(self, chunks, source=None):
+        self.chunks = iter(chunks)
+        self.source = source
+        self.total = None       # file size
+        if source != None:
+            self.total = source.total
+        self.buf = b''
+        self.o = 0              # start of the unparsed data in buf
+
+    def position(self):
+        # bytes of the file read so far (compressed, read ahead by up to one chunk)
+        if self.source == None:
+            return 0
+        return self.source.read
+
+    def close(self):
+        if self.source != None and self.source.f != sys.stdin:
+            self.source.f.close()
+
+    def need(self, n):
+        # make sure n bytes are buffered at self.o, returns False at the end of the data
+        have = len(self.buf) - self.o
+        if have >= n:
+            return True
+        parts = [self.buf[self.o:]]
+        for data in self.chunks:
+            parts.append(data)
+            have += len(data)
+            if have >= n:
+                break
+        self.buf = b''.join(parts)
+        self.o = 0
+        return have >= n
+
+
+class PcapStream(StreamReader):
+    '''
+    Reads a classic pcap file from Chunks, like MmapReader for files that
+    can not be mapped (compressed, pipes, stdin)
+    '''
+    def __init__(self, chunks, source=None):
+        StreamReader.__init__(self, chunks, source)
+        self.need(24)
+        self.divisor, self.hdrlen, self.record, self.snaplen, self.linktype = pcapHeader(self.buf[:24])
+        self.o = 24
+
+    def datalink(self):
+        return self.linktype
+
+    def __iter__(self):
+        unpack = self.record.unpack_from
+        divisor = self.divisor
+        hdrlen = self.hdrlen
+        linktype = self.linktype
+        while self.need(hdrlen):
+            sec, frac, caplen, l = unpack(self.buf, self.o)
+            self.need(hdrlen + caplen) # the last record might be truncated
+            o = self.o + hdrlen
+            self.o = o + caplen
+            yield (sec + frac / divisor, self.buf[o:o+caplen], linktype)
+
+
+class PcapngReader(StreamReader):
+    '''
+    Reads a pcapng file from Chunks
+    Handles several sections (also of different byte order) and interfaces
+    with their own timestamp resolution, offset and link type. Packets of
+    link types that can not be decoded (see network) and simple packet blocks
+    (without timestamp) are skipped.
+    '''
+    def __init__(self, chunks, source=None):
+        StreamReader.__init__(self, chunks, source)
+        self.need(12)
+        if self.buf[:4] != PCAPNG_SHB:
+            raise ValueError('no pcapng section header')
+        self.linktype = None    # link type of the first interface
+        self.skipped = set()    # (section, interface) with packets of unsupported link types
+
+    def datalink(self):
+        return self.linktype
+
+    def interface(self, endian, o, end):
+        # link type, timestamp units per second and offset (sec) of an interface description block
+        linktype = struct.unpack_from(endian + 'H', self.buf, o + 8)[0]
+        units = 1000000
+        offset = 0
+        o += 16
+        while o + 4 <= end:
+            code, l = struct.unpack_from(endian + 'HH', self.buf, o)
+            if code == 0: # opt_endofopt
+                break
+            if code == 9 and l >= 1: # if_tsresol
+                v = ord(self.buf[o+4:o+5])
+                if v & 0x80:
+                    units = 2 ** (v & 0x7f)
+                else:
+                    units = 10 ** v
+            elif code == 14 and l >= 8: # if_tsoffset
+                offset = struct.unpack_from(endian + 'q', self.buf, o + 4)[0]
+            o += 4 + (l + 3) / 4 * 4
+        if self.linktype == None:
+            self.linktype = linktype
+        return (linktype, units, offset)
+
+    def __iter__(self):
+        endian = '<'
+        section = 0
+        interfaces = []
+        while self.need(12):
+            o = self.o
+            btype = self.buf[o:o+4]
+            if btype == PCAPNG_SHB:
+                # the byte order magic tells the byte order of the whole section
+                endian = '<' if self.buf[o+8:o+12] == b'\x4d\x3c\x2b\x1a' else '>'
+                section += 1
+                interfaces = []
+            btype, blen = struct.unpack_from(endian + 'II', self.buf, o)
+            if blen < 12 or not self.need(blen):
+                if blen >= 12:
+                    logging.warn("pcapng: truncated block at the end")
+                else:
+                    logging.warn("pcapng: invalid block length %s", blen)
+                break
+            o = self.o
+            self.o = o + blen
+            if btype == 1:
+                interfaces.append(self.interface(endian, o, o + blen - 4))
+            elif btype == 6 or btype == 2:
+                if btype == 6: # enhanced packet block
+                    ifid, high, low, caplen = struct.unpack_from(endian + 'IIII', self.buf, o + 8)
+                else: # obsolete packet block
+                    ifid, drops, high, low, caplen = struct.unpack_from(endian + 'HHIII', self.buf, o + 8)
+                if ifid >= len(interfaces):
+                    logging.warn("pcapng: packet of unknown interface %s", ifid)
+                    continue
+                linktype, units, offset = interfaces[ifid]
+                if linktype not in LINKTYPES:
+                    if (section, ifid) not in self.skipped:
+                        self.skipped.add((section, ifid))
+                        logging.warn("pcapng: skipping packets of interface %s with link type %s", ifid, linktype)
+                    continue
+                t = (high << 32) | low
+                # same as sec + usec / 1E6 in classic pcap files
+                ts = t // units + offset + (t % units) / float(units)
+                data = o + 28
+                yield (ts, self.buf[data:data+min(caplen, blen - 32)], linktype)
+            elif btype == 3:
+                if ('spb', section) not in self.skipped:
+                    self.skipped.add(('spb', section))
+                    logging.warn("pcapng: skipping simple packet blocks, they have no timestamp")
+
+
+def openTrace(filename):
+    '''
+    Open a trace for reading, - is stdin
+    Classic pcap and pcapng files are accepted, also compressed with gzip,
+    xz (needs lzma) or zstd (needs zstandard)
+    returns an iterator over (ts, buf, linktype) with datalink(), position()
+    (bytes of the file read so far), close() and total (file size, None if unknown)
+    '''
+    if filename == '-':
+        f = sys.stdin
+        fd = f.fileno()
+    else:
+        f = open(filename, 'rb')
+        fd = f.fileno()
+        if stat.S_ISREG(os.fstat(fd).st_mode):
+            try:
+                return MmapReader(f)
+            except (ValueError, EnvironmentError):
+                pass # compressed or pcapng
+    head = b''
+    while len(head) < 24:
+        data = os.read(fd, 24 - len(head))
+        if not data:
+            break
+        head += data
+    # look at the (decompressed) start of the data, then parse all of it
+    source = Chunks(f, head)
+    stream = StreamReader(source)
+    stream.need(4)
+    chunks = itertools.chain([stream.buf], stream.chunks)
+    if stream.buf[:4] == PCAPNG_SHB:
+        return PcapngReader(chunks, source)
+    return PcapStream(chunks, source)
+
+
+def traceFiles(names):
+    '''
+    Expand the trace names given on the command line
+    A directory stands for the files in it, names that do not exist are
+    taken as glob patterns, both sorted by name
+    '''
+    files = []
+    for name in names:
+        if name == '-' or os.path.isfile(name):
+            files.append(name)
+        elif os.path.isdir(name):
+            files.extend(sorted([os.path.join(name, n) for n in os.listdir(name)
+                                 if not n.startswith('.') and os.path.isfile(os.path.join(name, n))]))
+        else:
+            files.extend(sorted(glob.glob(name)) or [name]) # no match, fail on opening it
+    return files
+
+
+class TraceIndex(object):
+    '''
+    Timestamp index of a classic pcap file, kept next to it as <file>.idx (JSON)
+    Built once in a pass over the record headers, it gives the offset to
+    start reading at for a time window (--from) without reading the trace from
+    the start. An entry is added every <step> seconds of trace time with the
+    highest timestamp of all packets before it, so seeking to an entry skips no
+    packet of the window even if the timestamps are not in order. The index is
+    rebuilt when the size or modification time of the file change.
+    filename: of the trace
+    reader: MmapReader of the trace
+    '''
+    version = 1
+    step = 10               # seconds between entries
+
+    def __init__(self, filename, reader):
+        self.path = filename + '.idx'
+        st = os.stat(filename)
+        self.file = [st.st_size, st.st_mtime]
+        self.ts = []            # highest timestamp before the entry
+        self.offsets = []       # offset of the record at the entry
+        if not self.load():
+            self.build(reader)
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+        except (EnvironmentError, ValueError):
+            return False
+        if index.get('version') != TraceIndex.version or index.get('step') != TraceIndex.step \
+           or index.get('file') != self.file:
+            return False
+        self.ts = index['ts']
+        self.offsets = index['offsets']
+        return True
+
+    def build(self, reader):
+        step = TraceIndex.step
+        high = None
+        for ts, o in reader.offsets():
+            if high == None:
+                boundary = (int(ts / step) + 1) * step
+            elif high >= boundary:
+                self.ts.append(high)
+                self.offsets.append(o)
+                boundary = (int(high / step) + 1) * step
+            if high == None or ts > high:
+                high = ts
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({'version': TraceIndex.version, 'step': TraceIndex.step, 'file': self.file,
+                           'ts': self.ts, 'offsets': self.offsets}, f)
+        except EnvironmentError as e:
+            logging.warn("could not save the index %s (%s)", self.path, e)
+
+    def find(self, ts):
+        # offset to read from for the packets from ts on, None for the start of the file
+        i = bisect.bisect_left(self.ts, ts) - 1
+        if i < 0:
+            return None
+        return self.offsets[i]
+
+
+class TraceSet:
+    '''
+    Several trace files, e.g. rotated captures, read as one trace in timestamp order
+    A file is opened when the merged trace reaches its first packet (before,
+    only its first record is read to sort the files) and closed when it is
+    read completely, so files that follow each other are read one after the
+    other and files that overlap are merged packet by packet (k-way merge).
+    The start of the file to be opened next is read ahead in a background
+    thread to have it in the page cache.
+    Files that can not be read are skipped with a warning.
+    '''
+    readahead = 32 << 20    # bytes read ahead of the next file
+
+    def __init__(self, filenames, prefetch=True):
+        self.prefetch = prefetch
+        self.files = []         # (ts of first packet, index, name, size), sorted
+        self.linktype = None
+        self.total = 0          # size of all files
+        self.done = 0           # size of the files read completely
+        self.reading = {}       # index -> reader of the open files
+        for i, name in enumerate(filenames):
+            try:
+                first = self.first(name)
+                if first == None:
+                    logging.warn("skipping %s: no packets", name)
+                    continue
+                ts, linktype, size = first
+                self.files.append((ts, i, name, size))
+                self.total += size
+                if self.linktype == None:
+                    self.linktype = linktype
+            except (ValueError, EnvironmentError) as e:
+                logging.warn("skipping %s: %s", name, e)
+        if not self.files:
+            raise ValueError('no packets in %s files' % len(filenames))
+        self.files.sort()
+
+    def first(self, name):
+        # (ts of the first packet, link type, size) of a file, None if it has no packets
+        packets = openTrace(name)
+        try:
+            for ts, buf, linktype in packets:
+                return ts, packets.datalink(), packets.total or 0
+            return None
+        finally:
+            packets.close()
+
+    def datalink(self):
+        return self.linktype
+
+    def position(self):
+        # bytes of all files read so far
+        return self.done + sum([r.position() for r in self.reading.values()])
+
+    def close(self):
+        for reader in self.reading.values():
+            reader.close()
+        self.reading = {}
+
+    def readAhead(self, name):
+        # read the start of the file once, the OS keeps it cached for the reader
+        try:
+            f = open(name, 'rb')
+            left = TraceSet.readahead
+            while left > 0:
+                data = os.read(f.fileno(), min(Chunks.size, left))
+                if not data:
+                    break
+                left -= len(data)
+            f.close()
+        except EnvironmentError:
+            pass
 
-    def run(self, nice=False, filename=None, timelimit=10, netradar=True, standalone=False):
+    def __iter__(self):
+        heap = []               # [ts, index, buf, linktype, packets] of the open files
+        n = 0                   # next file to open
+        while True:
+            while n < len(self.files) and (not heap or self.files[n][0] <= heap[0][0]):
+                first, i, name, size = self.files[n]
+                n += 1
+                if self.prefetch and n < len(self.files):
+                    t = threading.Thread(target=self.readAhead, args=(self.files[n][2],))
+                    t.daemon = True
+                    t.start()
+                reader = self.reading[i] = openTrace(name)
+                packets = iter(reader)
+                for ts, buf, linktype in packets:
+                    heapq.heappush(heap, [ts, i, buf, linktype, packets])
+                    break
+            if not heap:
+                break
+            head = heap[0]
+            yield head[0], head[2], head[3]
+            for ts, buf, linktype in head[4]:
+                head[0] = ts
+                head[2] = buf
+                head[3] = linktype
+                heapq.heapreplace(heap, head)
+                break
+            else:
+                heapq.heappop(heap)
+                reader = self.reading.pop(head[1])
+                self.done += reader.total or 0
+                reader.close()
+
+
+class Progress(object):
+    '''
+    Progress of a run (--progress), written every <interval> seconds
+    update() is called every <every> packets, so there is no clock check per
+    packet. Shows packets and bytes read, percent of the file(s), packets per
+    second since the last update, ETA and the connections in memory.
+    packets: the reader, see openTrace and TraceSet
+    connections: function returning the number of connections in memory, None if unknown
+    out: file to write to, one line per update, as JSON if jsonlines is set
+    '''
+    every = 4096            # packets between updates
+
+    def __init__(self, packets, interval=10, connections=None, out=sys.stderr, jsonlines=False):
+        self.packets = packets
+        self.interval = interval
+        self.connections = connections
+        self.out = out
+        self.jsonlines = jsonlines
+        self.start = self.last = time.time()
+        self.count = 0          # packets at the last output
+
+    def update(self, count, ts, final=False):
+        now = time.time()
+        if now - self.last < self.interval and not final:
+            return
+        pos = self.packets.position()
+        total = getattr(self.packets, 'total', None)
+        rate = 0
+        if now > self.last:
+            rate = (count - self.count) / (now - self.last)
+        if final:
+            rate = count / max(now - self.start, 1E-6)
+        self.last = now
+        self.count = count
+        percent = None
+        eta = None
+        if total:
+            percent = min(100.0, 100.0 * pos / total)
+            if pos > 0 and not final:
+                eta = (total - pos) * (now - self.start) / pos # at the average speed so far
+        connections = None
+        if self.connections != None:
+            connections = self.connections()
+
+        if self.jsonlines:
+            record = {'packets': count, 'bytes': pos, 'total': total, 'percent': percent,
+                      'pkts_per_sec': int(rate), 'eta': eta, 'connections': connections,
+                      'ts': ts, 'elapsed': now - self.start, 'done': final}
+            self.out.write(json.dumps(record) + "\n")
+        else:
+            parts = ["%s pkts" % count]
+            if total:
+                parts.append("%0.1f of %0.1f MB (%0.1f%%)" % (pos / 1E6, total / 1E6, percent))
+            else:
+                parts.append("%0.1f MB" % (pos / 1E6))
+            parts.append("%d pkts/s" % rate)
+            if eta != None:
+                parts.append("ETA %d:%02d:%02d" % (eta / 3600, eta % 3600 / 60, eta % 60))
+            if connections != None:
+                parts.append("%s connections" % connections)
+            if ts != None:
+                parts.append("at %s" % datetime.fromtimestamp(ts))
+            self.out.write("%s: %s\n" % ("done" if final else "progress", ", ".join(parts)))
+        self.out.flush()
+
+
+class Checkpoint(object):
+    '''
+    Snapshots of a running analysis (--checkpoint) to continue it after a
+    crash or preemption (--resume)
+    A snapshot holds the state of the connections in memory (Info), the
+    number of packets read and the position in the trace. It is written every
+    <interval> seconds, checked every Progress.every packets, and replaced
+    atomically. What only grows is appended to <path>.journal instead: the
+    events of the Series of the connections (the snapshot refers to them by
+    key, see persist), the results collected by the Analyzer and the cache
+    records. So a snapshot takes time in proportion to the live state and
+    what was added since the previous one, not to all of the trace so far.
+    The number of connections output is kept in <path>.out after each, a
+    resumed analysis does not output them again (see Analyzer.skip).
+    path: file of the snapshot
+    options: the options of the analysis, a snapshot is only resumed with the same
+    records: list of cache records to keep (Cache.records), None without cache
+    '''
+    version = 3             # of the snapshots
+
+    def __init__(self, path, interval, options, records=None):
+        self.path = path
+        self.interval = interval
+        self.options = (Checkpoint.version, Info.coninterrtime, options)
+        self.records = records
+        self.start = self.last = time.time() # start: of the analysis, earlier if resumed
+        self.journal = None     # file, opened by the first snapshot or restore
+        self.series = {}        # id(series) -> [series, key, events in the journal]
+        self.seen = set()       # ids of the series in the current snapshot
+        self.keys = 0           # series keys used so far
+        self.results = 0        # results in the journal
+        self.recorded = 0       # cache records in the journal
+        self.out = None         # descriptor of <path>.out
+
+    def update(self, analyzer, packets, count):
+        # save a snapshot if the last one is older than interval
+        if time.time() - self.last >= self.interval:
+            self.save(analyzer, packets, count)
+            self.last = time.time()
+
+    def write(self, entry):
+        pickle.dump(entry, self.journal, pickle.HIGHEST_PROTOCOL)
+
+    def persist(self, obj):
+        # inst_persistent_id of the snapshot: the events of a series added or
+        # changed since the last snapshot go to the journal, the snapshot keeps its key
+        if type(obj) != Series:
+            return None
+        entry = self.series.get(id(obj))
+        if entry == None:
+            entry = self.series[id(obj)] = [obj, self.keys, 0]
+            self.keys += 1
+        written = entry[2]
+        if obj.changed != None:
+            written = min(written, obj.changed)
+            obj.changed = None
+        if len(obj) > written:
+            self.write(('series', entry[1], written, obj.typecodes(), [c[written:].tostring() for c in obj.columns]))
+            entry[2] = len(obj)
+        self.seen.add(id(obj))
+        return "%s %s" %(entry[1], obj.typecodes())
+
+    def save(self, analyzer, packets, count):
         '''
-        Go through all packets and get stats with Info
-        nice: print nice output, otherwise dict
-        filename: name of pcap file to analyze
+        Write the state of analyzer after count packets of packets (reader, see openTrace)
         '''
-        info = Info(timelimit=timelimit)
+        if analyzer.stats != None:
+            analyzer.stats.elapsed = time.time() - self.start
+        try:
+            if self.journal == None:
+                self.journal = open(self.path + '.journal', 'wb')
+            if len(analyzer.results) > self.results:
+                self.write(('results', analyzer.results[self.results:]))
+                self.results = len(analyzer.results)
+            if self.records != None and len(self.records) > self.recorded:
+                self.write(('records', self.records[self.recorded:]))
+                self.recorded = len(self.records)
+
+            state = {'info': analyzer.info, 'nextsweep': analyzer.nextsweep,
+                     'finalized': analyzer.finalized, 'sample': analyzer.sample}
+            data = cStringIO.StringIO()
+            pickler = pickle.Pickler(data, pickle.HIGHEST_PROTOCOL)
+            pickler.inst_persistent_id = self.persist
+            self.seen = set()
+            pickler.dump(state)
+            # forget the series of connections no longer in memory
+            self.series = dict([(i, e) for i, e in self.series.items() if i in self.seen])
+            self.journal.flush()
+
+            header = {'options': self.options, 'count': count, 'offset': packets.position(),
+                      'journal': self.journal.tell(), 'keys': self.keys}
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                f.write(data.getvalue())
+            os.rename(tmp, self.path)
+        except EnvironmentError as e:
+            logging.warn("could not save checkpoint %s (%s)", self.path, e)
+
+    def restore(self, analyzer, packets):
+        '''
+        Load the snapshot into analyzer and skip the packets it covers: readers
+        with seek() continue at the saved offset, the others skip the packets
+        The journal is cut back to the snapshot, connections output after it
+        are not output again.
+        returns iterator over the remaining packets and the number of packets
+        before, None if there is no snapshot
+        raises ValueError if the snapshot is of another analysis
+        '''
+        try:
+            f = open(self.path, 'rb')
+        except EnvironmentError:
+            return None
+        with f:
+            try:
+                header = pickle.load(f)
+            except Exception as e:
+                raise ValueError("invalid checkpoint %s (%s)" % (self.path, e))
+            if not isinstance(header, dict) or header.get('options') != self.options:
+                raise ValueError("checkpoint %s is of another analysis (files or options)" % self.path)
+
+            events = {}         # key -> series
+            results = []
+            records = []
+            try:
+                self.journal = open(self.path + '.journal', 'r+b')
+                while self.journal.tell() < header['journal']:
+                    entry = pickle.load(self.journal)
+                    if entry[0] == 'series':
+                        key, first, typecodes, data = entry[1:]
+                        series = events.setdefault(key, Series(typecodes))
+                        for column, d in zip(series.columns, data):
+                            del column[first:]
+                            column.fromstring(d)
+                    elif entry[0] == 'results':
+                        results.extend(entry[1])
+                    else:
+                        records.extend(entry[1])
+                self.journal.truncate(header['journal'])
+                self.journal.seek(0, os.SEEK_END)
+            except Exception as e:
+                raise ValueError("invalid checkpoint journal %s.journal (%s)" % (self.path, e))
+
+            def load(pid):
+                key, typecodes = pid.split(' ')
+                key = int(key)
+                series = events.get(key) or Series(typecodes)
+                self.series[id(series)] = [series, key, len(series)]
+                return series
+            unpickler = pickle.Unpickler(f)
+            unpickler.persistent_load = load
+            try:
+                state = unpickler.load()
+            except Exception as e:
+                raise ValueError("invalid checkpoint %s (%s)" % (self.path, e))
+
+        self.keys = header['keys']
+        analyzer.info = state['info']
+        analyzer.stats = analyzer.info.stats
+        if analyzer.stats != None:
+            self.start -= analyzer.stats.elapsed
+        analyzer.nextsweep = state['nextsweep']
+        analyzer.results.extend(results)
+        self.results = len(results)
+        if self.records != None:
+            self.records.extend(records)
+            self.recorded = len(records)
+        analyzer.sample = state['sample']
+        analyzer.finalized = state['finalized']
+        try:
+            with open(self.path + '.out', 'rb') as f:
+                analyzer.skip = max(0, struct.unpack('!Q', f.read(8))[0] - analyzer.finalized)
+        except (EnvironmentError, struct.error):
+            pass
 
-        failed = 1
-        if filename != None and os.path.isfile(filename):
+        count = header['count']
+        if hasattr(packets, 'seek'):
+            packets.seek(header['offset'])
+            return iter(packets), count
+        remaining = iter(packets)
+        next(itertools.islice(remaining, count, count), None)
+        return remaining, count
+
+    def printed(self, count):
+        # count connections output so far, for Analyzer(printed=...)
+        if self.out == None:
+            self.out = os.open(self.path + '.out', os.O_WRONLY | os.O_CREAT, 0o644)
+        os.lseek(self.out, 0, os.SEEK_SET)
+        os.write(self.out, struct.pack('!Q', count))
+
+    def remove(self):
+        # the snapshot and its files, when the analysis is complete (or starts over)
+        if self.journal != None:
+            self.journal.close()
+        if self.out != None:
+            os.close(self.out)
+        self.journal = self.out = None
+        for path in (self.path, self.path + '.journal', self.path + '.out'):
             try:
-                self.packets = dpkt.pcap.Reader(open(filename,'rb'))
-                failed = 0
-            except:
+                os.remove(path)
+            except EnvironmentError:
                 pass
-        if failed:
-            msg = "No pcap file to process."
+
+
+class Cache(object):
+    '''
+    On-disk cache of the analysed connections of traces (--cache)
+    Reporting a trace again (nice or JSON, netradar, --min-interruption) reads
+    the connections from the cache instead of analysing every packet. Only the
+    fields used by Analyzer.output are kept, one zlib compressed pickle per
+    entry. Entries are keyed by the identity of the files (size, mtime and a
+    hash of the first and last MB) and the options that change the analysis,
+    the least recently used ones are removed above <limit> bytes.
+    directory: where the entries are kept, created if needed
+    '''
+    version = 1             # of the entries, change with fields
+    sample = 1 << 20        # bytes hashed at the begin and end of each file
+    fields = ('src', 'dst', 'sport', 'dport', 'con_start', 'sack', 'dsack', 'ts_opt', 'gaps',
+              'reorder', 'reorder_rexmit', 'dreorder', 'interruptions', 'disorder_phases',
+              'reor_extents', 'dreor_extents')
+    halffields = ('all', 'bytes', 'con_start', 'last_ts', 'mss') # of the other half
+
+    def __init__(self, directory, limit=1 << 30):
+        self.directory = directory
+        self.limit = limit
+        self.records = []       # connections added, see add
+
+    def key(self, filenames, options):
+        '''
+        Key of the results of analysing filenames with options (tuple of all
+        options that change them), None if they can not be cached (stdin, a
+        file can not be read)
+        '''
+        h = hashlib.sha1(repr((Cache.version, Info.coninterrtime, options)))
+        for name in filenames:
+            if name == '-':
+                return None
             try:
-                Log.e(msg)
-            except:
-                logging.error(msg)
-            return
+                st = os.stat(name)
+                h.update(repr((st.st_size, st.st_mtime)))
+                with open(name, 'rb') as f:
+                    h.update(f.read(Cache.sample))
+                    if st.st_size > Cache.sample:
+                        f.seek(max(Cache.sample, st.st_size - Cache.sample))
+                        h.update(f.read(Cache.sample))
+            except EnvironmentError as e:
+                logging.warn("not caching the results of %s (%s)", name, e)
+                return None
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.cache')
+
+    def add(self, cons):
+        # keep the results of finalized connections, for Analyzer(record=...)
+        for c in cons:
+            half = None
+            if c.half:
+                half = tuple([getattr(c.half, f) for f in Cache.halffields])
+            self.records.append((tuple([getattr(c, f) for f in Cache.fields]), half))
+
+    def load(self, key):
+        '''
+        Connections of the entry key, only with the fields needed for the output
+        returns None if there is no (valid) entry
+        '''
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                records = pickle.loads(zlib.decompress(f.read()))
+            os.utime(path, None) # recently used
+        except EnvironmentError:
+            return None
+        except Exception as e:
+            logging.warn("invalid cache entry %s (%s)", path, e)
+            return None
+
+        cons = []
+        for values, half in records:
+            c = Connection(*values[:4])
+            for f, v in zip(Cache.fields[4:], values[4:]):
+                setattr(c, f, v)
+            if half:
+                c.half = Connection(c.dst, c.src, c.dport, c.sport)
+                for f, v in zip(Cache.halffields, half):
+                    setattr(c.half, f, v)
+            cons.append(c)
+        return cons
+
+    def save(self, key):
+        # write the connections added as entry key, then remove old entries
+        path = self.path(key)
+        tmp = "%s.%d" % (path, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(tmp, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps(self.records, pickle.HIGHEST_PROTOCOL)))
+            os.rename(tmp, path)
+            self.evict()
+        except EnvironmentError as e:
+            logging.warn("could not save cache entry %s (%s)", path, e)
+
+    def evict(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.cache')):
+            st = os.stat(path)
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        total = sum([size for mtime, size, path in entries])
+        while total > self.limit and len(entries) > 1: # keep the newest one
+            mtime, size, path = entries.pop(0)
+            os.remove(path)
+            total -= size
+
+
+class CsvWriter(object):
+    '''
+    Results as flat tables (--csv) for analytics tools, one CSV file per table
+    in directory: connections.csv with one row per connection, and
+    interruptions.csv, phases.csv (fast recovery and disorder phases) and
+    reorder.csv (extents, the reason is dsack for DSACK+TS) with one row per
+    event, linked to the connection by its id. write() takes the result dict
+    of each connection as it is finalized (Analyzer emit), the rows go through
+    large file buffers. With --sample-flows estimates.csv holds the estimates.
+    append: add to the tables in directory (resumed checkpoint), ids continue
+    '''
+    buffering = 1 << 20     # bytes buffered per file
+    tables = {'connections': ('id', 'srcIp', 'srcPort', 'dstIp', 'dstPort', 'start', 'duration',
+                              'goodput', 'goodputInterr', 'sack', 'dsack', 'ts',
+                              'interruptionTime', 'interruptions', 'interruptionsWithRto',
+                              'interruptionsSpurious', 'recoveryTime', 'recoveryPhases',
+                              'recoverySpurious', 'recoveryWithRto', 'totalFrets', 'reorderWoRexmit',
+                              'reorderSackHoles', 'reorderRexmit', 'reorderDsackts'),
+              'interruptions': ('id', 'start', 'duration', 'rtos', 'spurious'),
+              'phases': ('id', 'kind', 'start', 'duration', 'rexmits', 'rtos', 'spurious'),
+              'reorder': ('id', 'reason', 'ts', 'extentAbs', 'extentRel', 'reorDelay', 'holeTs')}
+
+    def __init__(self, directory, append=False):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.files = []
+        self.writers = {}
+        self.id = 0
+        for name, columns in CsvWriter.tables.items():
+            path = os.path.join(directory, name + '.csv')
+            exists = append and os.path.exists(path)
+            if exists and name == 'connections':
+                with open(path, 'rb') as f:
+                    self.id = max(0, sum(1 for line in f) - 1)
+            f = open(path, 'ab' if exists else 'wb', CsvWriter.buffering)
+            self.files.append(f)
+            self.writers[name] = csv.writer(f)
+            if not exists:
+                self.writers[name].writerow(columns)
+
+    def write(self, dumpdata):
+        self.id += 1
+        i = self.id
+        interr = dumpdata['interruptions']
+        recovery = dumpdata['fastRecovery']
+        reorder = dumpdata['reorder']
+        options = dumpdata['options']
+        self.writers['connections'].writerow((i, dumpdata['srcIp'], dumpdata['srcPort'],
+            dumpdata['dstIp'], dumpdata['dstPort'], dumpdata['start'], dumpdata['duration'],
+            dumpdata['goodput'], dumpdata['goodputInterr'], options['sack'], options['dsack'], options['ts'],
+            interr['time'], interr['number'], interr['withRto'], interr['spurious'],
+            recovery['time'], recovery['number'], recovery['spurious'], recovery['withRto'],
+            recovery['totalFrets'], reorder['woRexmit'], reorder['sackHoles'], reorder['rexmit'],
+            reorder['dsackts']))
+        self.writers['interruptions'].writerows([(i, e['start'], e['duration'], e['rtos'], e['spurious'])
+                                                 for e in interr['infos']])
+        phases = self.writers['phases']
+        phases.writerows([(i, 'recovery', e['start'], e['duration'], e['rexmits'], e['rtos'], e['spurious'])
+                          for e in recovery['infos']])
+        phases.writerows([(i, 'disorder', e['start'], e['duration'], 0, 0, 0)
+                          for e in reorder['disorder']])
+        extents = self.writers['reorder']
+        extents.writerows([(i, e['reason'], e['ts'], e['extentAbs'], e['extentRel'], e['reorDelay'], e['holeTs'])
+                           for e in reorder['extents']])
+        extents.writerows([(i, 'dsack', e['ts'], e['extentAbs'], e['extentRel'], e['reorDelay'], e['holeTs'])
+                           for e in reorder['dextents']])
+
+    def estimates(self, estimates):
+        # FlowSample.estimates, one row per total
+        with open(os.path.join(self.directory, 'estimates.csv'), 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(('name', 'estimate', 'lower', 'upper', 'rate', 'sampled'))
+            for name in FlowSample.totals + ('goodput',):
+                e = estimates[name] or {'estimate': None, 'lower': None, 'upper': None}
+                writer.writerow((name, e['estimate'], e['lower'], e['upper'], estimates['rate'], estimates['sampled']))
+
+    def flush(self):
+        for f in self.files:
+            f.flush()
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+
+class WorkerError(object):
+    '''
+    Sent by a worker process of a parallel run instead of its results when it failed
+    text: the traceback of the exception
+    '''
+    def __init__(self, text):
+        self.text = text
 
-        for ts, buf in self.packets:
-            eth = dpkt.ethernet.Ethernet(buf) #sll.SLL(buf)
-            info.addConnection(ts, eth.data)
 
-        # ---- output ----
-        KILO = 1024
-        condata = []
-        #print len(info.connections)
-        for con in info.connections:
-            if not con.has_key('half') or not con['half']:
-                logging.warn("no two way connection (%s:%s - %s:%s)\n", con['src'], con['sport'], con['dst'], con['dport'])
+class PcapInfo(): 
+    batch = 1000            # packets per transfer to a worker process
+    poll = 1                # seconds between checks for dead worker processes while waiting on them
+
+    def printJson(self, dumpdata):
+        print (json.dumps(dumpdata, indent=4))
+
+    def printJsonLine(self, dumpdata):
+        print (json.dumps(dumpdata))
+
+    def timeWindow(self, packets, info, begin, end):
+        '''
+        The packets from begin (the lead-in before info.window) up to end (None: no end)
+        Starts the window in info with the first packet in it, see Info.startWindow
+        '''
+        for packet in packets:
+            ts = packet[0]
+            if begin != None and ts < begin:
                 continue
+            if end != None and ts > end:
+                break
+            if info.leadin and ts >= info.window:
+                info.startWindow()
+            yield packet
 
-            # netradar is not used rely on data transmitted, netradar setup -> use server port numbers
-            if ((not netradar) and (con['half']) and (con['half']['all'] > 0)) \
-                or ((netradar) and (con['dport'] in [6007,6078])):
+    def work(self, packets, results, stopping, timelimit, idletimeout, fast, gaps, trace, stats):
+        '''
+        Worker process of a parallel run, analyses the packets of one shard
+        packets: queue of packet batches [(n, ts, buf, linktype), ...], None to stop
+        results: queue for lists [(n, con), ...] of finished connections, where
+                 n is the number of the packet that created con; the Stats of
+                 the worker if stats is set; None when done, a WorkerError
+                 if the analysis raised an exception
+        stopping: Event set by the parent after a failure, the remaining
+                  batches are skipped and no results sent
+        idletimeout: evict finished connections (stream mode), 0 to keep all
+        '''
+        try:
+            self.analyse(packets, results, stopping, timelimit, idletimeout, fast, gaps, trace, stats)
+        except:
+            results.put(WorkerError(traceback.format_exc()))
+            while packets.get() != None: # keep the parent from blocking on a full queue
+                pass
 
-                # goodput
-                gtime = 0
-                if Info.timespan > 0:
-                    gtime = Info.timespan # length of connection
-                else:
-                    gtime = con['half']['last_ts'] - con['half']['con_start']
+    def analyse(self, packets, results, stopping, timelimit, idletimeout, fast, gaps, trace, stats):
+        if stats:
+            stats = Stats()
+        info = Info(timelimit=timelimit, gaps=gaps, trace=trace, stats=stats or None)
+        first = dict() # id(con) -> n
+        nextsweep = 0
+        while True:
+            batch = packets.get()
+            if batch == None:
+                break
+            if stopping.is_set():
+                continue
+            for n, ts, buf, linktype in batch:
+                count = len(info.connections)
+                info.addFrame(ts, buf, fast, linktype)
+                if len(info.connections) > count:
+                    first[id(info.connections[-1])] = n
+
+                if idletimeout and ts >= nextsweep:
+                    nextsweep = ts + Analyzer.sweep
+                    finished = info.evict(ts, idletimeout)
+                    if finished:
+                        results.put([(first.pop(id(c)), c) for c in finished])
+
+        if stopping.is_set():
+            return
+        results.put([(first[id(c)], c) for c in info.connections])
+        if stats:
+            results.put(stats)
+        results.put(None)
 
-                if gtime <= 0:
-                    logging.warn("no duration (%s:%s - %s:%s)\n", con['src'], con['sport'], con['dst'], con['dport'])
-                    continue
+    def send(self, queue, item, workers):
+        '''
+        Put item on the packet queue of a worker, raises RuntimeError if a worker died
+        '''
+        while True:
+            try:
+                queue.put(item, timeout=PcapInfo.poll)
+                return
+            except Queue.Full:
+                self.check(workers)
 
-                goodput = float(con['half']['bytes']*8)/(gtime*KILO) # in kbit/s
-
-                # interruptions
-                totalconinterrtime = 0
-                totalconinterrno = 0
-                withrto = 0
-                rtospurious = 0
-                interrinfos = []
-                for entry in con['interruptions']:
-                    duration = entry[1] - entry[0]
-                    rtos = entry[2]
-                    spurious = entry[3]
-                    if duration > Info.coninterrtime:
-                        interrinfos.append({'start': entry[0], 'duration': duration, 'rtos': rtos, 'spurious': spurious})
-                        totalconinterrtime += duration
-                        totalconinterrno += 1
-                        if rtos:
-                            withrto += 1
-                        if spurious:
-                            rtospurious += 1
-                goodputwointerr = (goodput*gtime)/(gtime-totalconinterrtime)
-
-                # fast recovery
-                totalfastrectime = 0
-                totalfastrecno = 0
-                totalfastrecrexmit = 0
-                totalfastrecrto = 0
-                totalspurious = 0
-                reorderworexmit = 0
-                phases = []
-                dphases = []
-                for entry in con['disorder_phases']:
-                    #print entry
-                    duration = entry[1] - entry[0]
-                    rexmits = entry[2]
-                    rtos = entry[3]
-                    spurious = entry[4]
-                    if rexmits:
-                        totalfastrectime += duration
-                        totalfastrecrexmit += rexmits
-                        if rtos:
-                            totalfastrecrto += 1
-                        if spurious:
-                            totalspurious += 1
-                        totalfastrecno += 1
-                        phases.append({'start': entry[0], 'duration': duration, 'rexmits': rexmits, 'rtos': rtos, 'spurious': spurious})
+    def receive(self, results, workers):
+        '''
+        Next item from the results queue of the workers
+        raises RuntimeError if a worker failed (WorkerError) or died
+        '''
+        while True:
+            try:
+                item = results.get(timeout=PcapInfo.poll)
+            except Queue.Empty:
+                self.check(workers)
+                continue
+            if isinstance(item, WorkerError):
+                raise RuntimeError("worker process failed:\n%s" % item.text)
+            return item
+
+    def check(self, workers):
+        for w in workers:
+            if w.exitcode != None and w.exitcode != 0:
+                raise RuntimeError("worker process %s exited with code %s" % (w.pid, w.exitcode))
+
+    def parallel(self, jobs, analyzer, progress=None):
+        '''
+        Distribute the packets to <jobs> worker processes by connection
+        Connections finished early (stream mode) are finalized by analyzer as
+        they come in, the remaining ones are returned in order of appearance
+        progress: Progress to update while reading
+        Raises RuntimeError if a worker fails or dies, the others are stopped first
+        '''
+        timelimit = analyzer.info.timespan
+        idletimeout = analyzer.idletimeout if analyzer.stream else 0
+        fast = analyzer.fast
+        gaps = analyzer.info.gaps
+        trace = analyzer.info.trace
+        stats = analyzer.stats
+        queues = [multiprocessing.Queue(16) for i in range(jobs)]
+        results = multiprocessing.Queue()
+        stopping = multiprocessing.Event()
+        workers = [multiprocessing.Process(target=self.work, args=(q, results, stopping, timelimit, idletimeout, fast, gaps, trace, stats != None)) for q in queues]
+        for w in workers:
+            w.start()
+        ended = [False] * jobs # None sent to the worker
+        try:
+            return self.distribute(jobs, analyzer, progress, queues, results, workers, ended)
+        except:
+            self.stop(workers, queues, results, stopping, ended)
+            raise
+
+    def stop(self, workers, queues, results, stopping, ended):
+        '''
+        Let the workers still running skip their remaining batches and end
+        after a failure, see work
+        '''
+        stopping.set()
+        for w, q, e in zip(workers, queues, ended):
+            while not e and w.exitcode == None:
+                try:
+                    q.put(None, timeout=PcapInfo.poll)
+                    break
+                except Queue.Full:
+                    pass
+        while [w for w in workers if w.exitcode == None]:
+            try:
+                results.get(timeout=PcapInfo.poll) # they end only when their results are sent
+            except Queue.Empty:
+                pass
+        for w, q in zip(workers, queues):
+            w.join()
+            if w.exitcode != 0: # died, read the batches left for it
+                q.cancel_join_thread()
+                try:
+                    while True:
+                        q.get(timeout=0.1)
+                except Queue.Empty:
+                    pass
+
+    def distribute(self, jobs, analyzer, progress, queues, results, workers, ended):
+        '''
+        Send the packets to the workers and collect their results, see parallel
+        ended: set to True for each worker once it was sent None
+        '''
+        stats = analyzer.stats
+        batches = [[] for i in range(jobs)]
+        n = 0
+        count = 0
+        ts = None
+        for ts, buf, linktype in self.packets:
+            if progress != None:
+                count += 1
+                if not count % Progress.every:
+                    progress.update(count, ts)
+            if not analyzer.filter.accept(buf, linktype):
+                if stats != None:
+                    stats.skipped += 1
+                continue
+            key = flowKey(buf, linktype)
+            shard = 0 # anything not TCP/IP goes to the first worker
+            if key:
+                shard = (zlib.crc32(key) & 0xffffffff) % jobs
+            batches[shard].append((n, ts, str(buf), linktype)) # buffers of an mmap can not be pickled
+            if len(batches[shard]) >= PcapInfo.batch:
+                self.send(queues[shard], batches[shard], workers)
+                batches[shard] = []
+
+                # stream mode: report connections the workers finished so far
+                while not results.empty():
+                    cons = sorted(self.receive(results, workers), key=lambda x: x[0])
+                    analyzer.finalize([c for i, c in cons])
+            n += 1
+
+        for shard in range(jobs):
+            self.send(queues[shard], batches[shard], workers)
+            self.send(queues[shard], None, workers)
+            ended[shard] = True
+        if progress != None:
+            progress.update(count, ts, True)
+
+        remaining = []
+        running = jobs
+        while running > 0:
+            cons = self.receive(results, workers)
+            if cons == None:
+                running -= 1
+            elif isinstance(cons, Stats):
+                stats.merge(cons)
+            else:
+                remaining.extend(cons)
+        for w in workers:
+            w.join()
+
+        remaining.sort(key=lambda x: x[0])
+        return [c for n, c in remaining]
+
+    def run(self, nice=False, filename=None, timelimit=10, netradar=True, standalone=False,
+            stream=False, idletimeout=120, emit=None, jobs=1, fast=False, ports=None, hosts=None,
+            gaps=False, trace=None, stats=False, progress=0, progress_json=False,
+            interruption=None, cache=None, cachesize=1 << 30, checkpoint=None, interval=300, resume=False,
+            jsonl=False, csvdir=None, start=None, end=None, leadin=10, sample=None):
+        '''
+        Go through all packets and get stats with Info
+        nice: print nice output, otherwise dict
+        filename: name of pcap/pcapng file to analyze (may be compressed), - for stdin,
+                  or a list of names, see TraceSet
+        stream: finalize connections as soon as they are closed or idle for
+                <idletimeout> seconds, emit their results and free them
+        emit: called with the dict of each finalized connection
+              (standalone default: print it, as a JSON line in stream mode)
+        jobs: number of worker processes, connections are distributed by their 4-tuple
+        fast: decode TCP/IP headers without dpkt, the results are the same
+        ports, hosts: lists of ports and IPv4/IPv6 addresses, analyse only packets from/to these
+        gaps: add a histogram of the ACK inter arrival times to the results
+        trace: endpoints of connections to log debug messages for, see Analyzer
+        stats: keep counters of the analysis in self.stats (see Stats), standalone: print them to stderr
+        progress: write the progress to stderr every <progress> seconds, see Progress
+        progress_json: write the progress as JSON lines
+        interruption: report only interruptions longer than this, see Analyzer
+        cache: directory to cache the analysed connections in, see Cache
+               (not used for stdin and while tracing connections)
+        cachesize: maximum size of the cache in bytes
+        checkpoint: file to save the state to every <interval> seconds, removed
+                    when the analysis is complete, see Checkpoint (not with jobs)
+        resume: continue from the checkpoint file if it exists
+        jsonl: standalone: print JSON Lines (one compact dict per connection, default in stream mode)
+        csvdir: write the results as CSV tables to this directory instead, see CsvWriter
+        start, end: analyse only the packets in this time window (absolute
+                    timestamps), uncompressed pcap files are read from the
+                    window on with a TraceIndex (not with jobs and checkpoint)
+        leadin: seconds before start to build the state of the connections in,
+                see Info.startWindow
+        sample: analyse only this share of the connections (0 < sample <= 1),
+                the estimates for all are kept in self.sample (see FlowSample),
+                standalone: printed after the connections (JSON: as the last dict
+                with key sampleEstimates, CSV: estimates.csv)
+        '''
+        failed = "no file name"
+        if filename != None:
+            try:
+                if isinstance(filename, list):
+                    if len(filename) > 1:
+                        self.packets = TraceSet(filename)
                     else:
-                        reorderworexmit += 1
-                        logging.debug("reor 4 %s %s", datetime.fromtimestamp(entry[0]), datetime.fromtimestamp(entry[1]))
-                        dphases.append({'start': entry[0], 'duration': duration})
-
-                reorentry = []
-                for reor in con['reor_extents']:
-                    reorentry.append({'ts': reor[0], 'extentAbs': reor[1], 'extentRel': reor[2], 'reason': reor[3], 'reorDelay': reor[4], 'holeTs': reor[5]})
-                dreorentry = []
-                for d in con['dreor_extents']:
-                    dreorentry.append({'ts': d[0], 'extentAbs': d[1], 'extentRel': d[2], 'reorDelay': d[3], 'holeTs': d[4]})
-
-                if nice == True:
-                    # nice output
-                    print ("%s:%s - %s:%s --> %s pkts in %0.2f s, MSS = %s, %0.2f kbit/s" \
-                            %(con['src'],con['sport'],con['dst'],con['dport'],con['half']['all'],
-                              gtime, con['half']['mss'], goodput))
-                    print ("Options: SACK = %s, DSACK = %s, TS = %s" \
-                            %('1' if con['sack'] > 0 else '0', \
-                              '1' if con['dsack'] > 0 else '0', \
-                              con['ts_opt']))
-                    print ("Connection Interruption time: %0.2f s ( %s interruptions, %s with RTOs, %s spurious ) --> %0.2f kbit/s" \
-                            %(totalconinterrtime, totalconinterrno, withrto, rtospurious, goodputwointerr))
-                    print ("Fast Recovery time: %0.2f s ( %s phases, %s spurious, %s with RTOs, %s total frets )" \
-                            %(totalfastrectime, totalfastrecno, totalspurious, totalfastrecrto, totalfastrecrexmit))
-                    print ("Reorder: W/o retransmit = %s , Closed SACK holes = %s , Rexmits (TSval tested) = %s , DSACK+TS = %s" \
-                            %(reorderworexmit, con['reorder'], con['reorder_rexmit'], con['dreorder']))
-                    print ("")
+                        self.packets = openTrace(filename[0])
                 else:
-                    # return json
-                    dumpdata = {}
-
-                    dumpdata['srcIp']           = con['src']
-                    dumpdata['dstIp']           = con['dst']
-                    dumpdata['srcPort']         = con['sport']
-                    dumpdata['dstPort']         = con['dport']
-
-                    dumpdata['start']           = con['con_start']
-                    dumpdata['duration']        = gtime
-                    dumpdata['goodput']         = goodput
-                    dumpdata['goodputInterr']   = goodputwointerr
-                    dumpdata['options']         = {'sack': 1 if con['sack'] > 0 else 0,
-                                                   'dsack': 1 if con['dsack'] > 0 else 0,
-                                                   'ts': con['ts_opt']}
-                    dumpdata['interruptions']   = {'minInterruption': Info.coninterrtime,
-                                                   'time': totalconinterrtime,
-                                                   'number': totalconinterrno,
-                                                   'withRto': withrto,
-                                                   'spurious': rtospurious,
-                                                   'infos': interrinfos}
-                    dumpdata['fastRecovery']    = {'time': totalfastrectime,
-                                                   'number': totalfastrecno,
-                                                   'spurious': totalspurious,
-                                                   'withRto': totalfastrecrto,
-                                                   'totalFrets': totalfastrecrexmit,
-                                                   'infos': phases}
-                    dumpdata['reorder']         = {'woRexmit': reorderworexmit,
-                                                   'sackHoles': con['reorder'],
-                                                   'rexmit': con['reorder_rexmit'],
-                                                   'extents': reorentry,
-                                                   'dsackts': con['dreorder'],
-                                                   'dextents': dreorentry,
-                                                   'disorder': dphases}
-                    #print dumpdata
-                    condata.append( dumpdata )
-        if not nice:
-            if standalone:
-                for conresult in condata:
-                    print (json.dumps(conresult, indent=4))
+                    self.packets = openTrace(filename)
+                failed = None
+            except (ValueError, EnvironmentError) as e:
+                failed = e
+        if failed:
+            msg = "No pcap file to process (%s)." % failed
+            try:
+                Log.e(msg)
+            except:
+                logging.error(msg)
+            return
+
+        if csvdir != None and not nice:
+            emit = None # CsvWriter, opened below
+        elif emit == None and standalone and not nice:
+            if stream or jsonl:
+                emit = self.printJsonLine
+            else:
+                emit = self.printJson
+
+        analyzer = Analyzer(timelimit=timelimit, nice=nice, netradar=netradar,
+                            stream=stream, idletimeout=idletimeout, emit=emit, fast=fast,
+                            ports=ports, hosts=hosts, gaps=gaps, trace=trace, stats=stats,
+                            interruption=interruption, sample=sample)
+        self.stats = analyzer.stats
+        began = time.time()
+
+        names = filename if isinstance(filename, list) else [filename]
+        windowed = start != None or end != None
+        if windowed:
+            jobs = 1
+            checkpoint = None
+
+        store = None
+        cached = None
+        if cache != None and not analyzer.info.trace: # debug messages need the analysis
+            store = Cache(cache, cachesize)
+            opened = names
+            if isinstance(self.packets, TraceSet): # without the files skipped
+                opened = [name for first, i, name, size in sorted(self.packets.files, key=lambda f: f[1])]
+            key = store.key(opened, (timelimit, stream, idletimeout, sorted(ports or []),
+                                    sorted(hosts or []), bool(gaps), start, end, leadin, sample))
+            if key == None:
+                store = None
+            else:
+                cached = store.load(key)
+                if cached == None:
+                    analyzer.record = store.add
+
+        packets = self.packets
+        n = 0
+        saver = None
+        restored = None
+        if checkpoint != None and cached == None and jobs <= 1:
+            saver = Checkpoint(checkpoint, interval, (names, timelimit, stream, idletimeout,
+                                                      ports, hosts, gaps, bool(stats), sample),
+                               store.records if store != None else None)
+            if resume:
+                try:
+                    restored = saver.restore(analyzer, self.packets)
+                except ValueError as e:
+                    logging.error("%s", e)
+                    return
+            if restored != None:
+                packets, n = restored
+                self.stats = analyzer.stats
+                began = saver.start
+                logging.info("resuming after %s packets (%s)", n, checkpoint)
             else:
-                return condata
+                saver.remove() # of an earlier run
+            if nice or emit != None: # results collected in memory are lost with a crash
+                analyzer.printed = saver.printed
+
+        writer = None
+        if csvdir != None and not nice:
+            writer = CsvWriter(csvdir, append=restored != None)
+            analyzer.emit = writer.write
+            if saver != None:
+                analyzer.printed = lambda count: (writer.flush(), saver.printed(count))
+
+        if windowed and cached == None:
+            begin = None
+            if start != None:
+                begin = start - leadin
+                analyzer.info.window = start
+                analyzer.info.leadin = True
+                if len(names) == 1 and isinstance(self.packets, MmapReader):
+                    offset = TraceIndex(names[0], self.packets).find(begin)
+                    if offset != None:
+                        self.packets.seek(offset)
+            packets = self.timeWindow(packets, analyzer.info, begin, end)
+
+        tracker = None
+        if cached != None:
+            logging.info("results from the cache (%s)", store.path(key))
+        elif progress > 0:
+            connections = None
+            if jobs <= 1:
+                connections = lambda: len(analyzer.info.connections)
+            tracker = Progress(self.packets, progress, connections, jsonlines=progress_json)
+            tracker.count = n
+        if cached != None:
+            analyzer.finalize(cached)
+        elif jobs > 1:
+            analyzer.finalize(self.parallel(jobs, analyzer, tracker))
+        elif tracker != None or saver != None:
+            ts = None
+            for ts, buf, linktype in packets:
+                analyzer.feed(ts, buf, linktype)
+                n += 1
+                if not n % Progress.every:
+                    if tracker != None:
+                        tracker.update(n, ts)
+                    if saver != None:
+                        saver.update(analyzer, self.packets, n)
+            if tracker != None:
+                tracker.update(n, ts, True)
+        else:
+            for ts, buf, linktype in packets:
+                analyzer.feed(ts, buf, linktype)
+        condata = analyzer.finish()
+        self.sample = analyzer.sample
+        if self.sample != None and standalone:
+            if nice:
+                print (self.sample.report())
+            elif writer != None:
+                writer.estimates(self.sample.estimates())
+            else:
+                emit({'sampleEstimates': self.sample.estimates()})
+        if writer != None:
+            writer.close()
+        if store != None and cached == None:
+            store.save(key)
+        if saver != None:
+            saver.remove()
+        if self.stats != None:
+            self.stats.elapsed = time.time() - began
+            if standalone:
+                sys.stderr.write(self.stats.report() + "\n")
+
+        if not nice and not standalone:
+            return condata
 
 
 if __name__ == "__main__":
@@ -859,14 +3433,63 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=
                 "Parses PCAP files and extracts information from TCP connections \
                  about connection interruptions, recovery phases and reordering.")
-    parser.add_argument("pcapfile", type=str,
-            help="pcap file to analyse")
+    parser.add_argument("pcapfile", type=str, nargs="+",
+            help="pcap or pcapng file to analyse, can be compressed with gzip, xz or zstd, - to read from stdin. \
+                  Several files, directories or glob patterns are analysed as one trace in timestamp order")
     parser.add_argument("-j", "--json", action="store_true",
             help="output in JSON format")
+    parser.add_argument("--jsonl", action="store_true",
+            help="output in JSON Lines format, one line per connection as it is finished (implies -j)")
+    parser.add_argument("--csv", type=str, metavar="DIR",
+            help="write the results as CSV tables to DIR: connections, interruptions, phases and reorder extents")
     parser.add_argument("-t", "--timelimit", type=float, default=0,
             help="analyse only the first <TIMELIMIT> seconds of the connection [default: %(default)s = analyse all]")
     parser.add_argument("-n", "--netradar", action="store_true",
             help="use Netradar ports to distinguish connections")
+    parser.add_argument("-s", "--stream", action="store_true",
+            help="output connections as soon as they are closed or idle, JSON output is one line per connection")
+    parser.add_argument("-i", "--idletimeout", type=float, default=120,
+            help="in stream mode, finalize connections without packets for <IDLETIMEOUT> seconds [default: %(default)s]")
+    parser.add_argument("-f", "--fast", action="store_true",
+            help="decode TCP/IP headers with the built-in decoder instead of dpkt (same results, faster)")
+    parser.add_argument("--jobs", type=int, default=1,
+            help="number of processes to analyse connections in parallel [default: %(default)s]")
+    parser.add_argument("--port", type=str,
+            help="analyse only packets from/to these ports (comma separated)")
+    parser.add_argument("--host", type=str,
+            help="analyse only packets from/to these IPv4/IPv6 addresses (comma separated)")
+    parser.add_argument("--gaps", action="store_true",
+            help="add a histogram of the ACK inter arrival times of each connection")
+    parser.add_argument("--trace-conn", type=str, action="append", metavar="IP[:PORT]",
+            help="log debug messages of the connections from/to this endpoint only ([IPv6]:PORT), can be repeated")
+    parser.add_argument("--stats", action="store_true",
+            help="print counters of the analysis to stderr (packets, time per stage, largest structures, connections in memory)")
+    parser.add_argument("--progress", type=float, nargs="?", const=10, default=0, metavar="SECONDS",
+            help="print the progress to stderr every SECONDS (default 10): packets, bytes, percent, packets/s, ETA, connections")
+    parser.add_argument("--progress-json", action="store_true",
+            help="print the progress as JSON lines (implies --progress)")
+    parser.add_argument("--min-interruption", type=float, metavar="SECONDS",
+            help="report only connection interruptions longer than SECONDS (at least %s)" % Info.coninterrtime)
+    parser.add_argument("--cache", type=str, metavar="DIR",
+            help="keep the analysed connections in DIR, to report the same trace again without reading it")
+    parser.add_argument("--cache-size", type=float, default=1024, metavar="MB",
+            help="remove the least recently used entries from the cache above this size (default 1024)")
+    parser.add_argument("--checkpoint", type=str, metavar="FILE",
+            help="save the state of the analysis to FILE regularly, to continue it with --resume after a crash")
+    parser.add_argument("--checkpoint-interval", type=float, default=300, metavar="SECONDS",
+            help="seconds between checkpoints (default 300)")
+    parser.add_argument("--resume", action="store_true",
+            help="continue the analysis from the --checkpoint FILE if it exists")
+    parser.add_argument("--from", type=str, dest="start", metavar="TIME",
+            help="analyse only packets from TIME on (seconds since the epoch or local 'YYYY-MM-DD HH:MM[:SS]'), \
+                  pcap files are indexed in FILE.idx to start reading there")
+    parser.add_argument("--to", type=str, dest="end", metavar="TIME",
+            help="analyse only packets up to TIME")
+    parser.add_argument("--lead-in", type=float, default=10, metavar="SECONDS",
+            help="seconds before --from to pick up the state of the connections in (default 10)")
+    parser.add_argument("--sample-flows", type=float, metavar="RATE",
+            help="analyse only this share of the connections (0 < RATE <= 1, chosen by a hash of the "
+                 "addresses and ports) and print estimates for all of them")
     parser.add_argument("-q", "--quiet", action="store_true",
             help="decrease output verbosity")
     parser.add_argument("-d", "--debug", action="store_true",
@@ -880,5 +3503,58 @@ if __name__ == "__main__":
     else:
         logging.basicConfig(level=logging.INFO)
 
-    PcapInfo().run(nice=(not args.json), filename=args.pcapfile, timelimit=args.timelimit, netradar=args.netradar, standalone=True)
+    files = traceFiles(args.pcapfile)
+    if '-' in files and len(files) > 1:
+        parser.error("stdin can not be combined with other files")
+
+    ports = None
+    if args.port:
+        try:
+            ports = [int(p) for p in args.port.split(',')]
+        except ValueError:
+            parser.error("invalid port list: %s" % args.port)
+    hosts = None
+    if args.host:
+        hosts = args.host.split(',')
+        try:
+            [ipPacked(h) for h in hosts]
+        except socket.error:
+            parser.error("invalid host list: %s" % args.host)
+    traced = None
+    if args.trace_conn:
+        try:
+            traced = [endpoint(e) for e in args.trace_conn]
+        except (ValueError, socket.error):
+            parser.error("invalid endpoint: %s" % " ".join(args.trace_conn))
+        logging.getLogger('pcapstats.trace').setLevel(logging.DEBUG)
+    progress = args.progress
+    start = end = None
+    try:
+        if args.start:
+            start = timestamp(args.start)
+        if args.end:
+            end = timestamp(args.end)
+    except ValueError as e:
+        parser.error(str(e))
+    if (start != None or end != None) and (args.jobs > 1 or args.checkpoint):
+        parser.error("--from/--to can not be used with --jobs or --checkpoint")
+    if args.resume and not args.checkpoint:
+        parser.error("--resume needs --checkpoint FILE")
+    if args.checkpoint and args.jobs > 1:
+        parser.error("--checkpoint can not be used with --jobs")
+    if args.min_interruption != None and args.min_interruption < Info.coninterrtime:
+        parser.error("--min-interruption must be at least %s" % Info.coninterrtime)
+    if args.sample_flows != None and not 0 < args.sample_flows <= 1:
+        parser.error("--sample-flows must be greater than 0 and at most 1")
+    if args.progress_json and not progress:
+        progress = 10
+
+    PcapInfo().run(nice=not (args.json or args.jsonl or args.csv), filename=files, timelimit=args.timelimit, netradar=args.netradar, standalone=True,
+                     stream=args.stream, idletimeout=args.idletimeout, jobs=args.jobs, fast=args.fast,
+                     ports=ports, hosts=hosts, gaps=args.gaps, trace=traced, stats=args.stats,
+                     progress=progress, progress_json=args.progress_json,
+                     interruption=args.min_interruption, cache=args.cache, cachesize=int(args.cache_size * 1E6),
+                     checkpoint=args.checkpoint, interval=args.checkpoint_interval, resume=args.resume,
+                     jsonl=args.jsonl, csvdir=args.csv, start=start, end=end, leadin=args.lead_in,
+                     sample=args.sample_flows)
 
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+'''
+fastDecode against Info.decode on the dpkt objects, with synthetic TCP/IPv4
+and TCP/IPv6 frames and mutated or truncated copies of them
+Run: python -m unittest discover -s tests
+'''
+import logging
+import os
+import random
+import struct
+import sys
+import unittest
+
+import dpkt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pcapstats
+
+FRAMES = 20000              # mutated frames per test
+
+
+def options(rng):
+    # a random mix of the TCP options the analysis looks at, padded with NOPs
+    opts = b''
+    for i in range(rng.randint(0, 4)):
+        kind = rng.choice(('mss', 'wscale', 'sackok', 'ts', 'sack', 'nop', 'other'))
+        if kind == 'mss':
+            opts += struct.pack('!BBH', 2, 4, rng.randint(500, 1460))
+        elif kind == 'wscale':
+            opts += struct.pack('!BBB', 3, 3, rng.randint(0, 14))
+        elif kind == 'sackok':
+            opts += b'\x04\x02'
+        elif kind == 'ts':
+            opts += struct.pack('!BBII', 8, 10, rng.randint(0, 2**32 - 1), rng.randint(0, 2**32 - 1))
+        elif kind == 'sack':
+            n = rng.randint(1, 3)
+            opts += struct.pack('!BB', 5, 2 + 8 * n)
+            for b in range(n):
+                start = rng.randint(0, 2**32 - 1)
+                opts += struct.pack('!II', start, (start + rng.randint(1, 9000)) & 0xffffffff)
+        elif kind == 'nop':
+            opts += b'\x01'
+        else:
+            opts += struct.pack('!BB', 30, 4) + b'\x00\x00'
+    opts = opts[:40]
+    while len(opts) % 4:
+        opts += b'\x01'
+    return opts
+
+
+def address(rng, n):
+    return bytes(bytearray([rng.randint(0, 255) for i in range(n)]))
+
+
+def ipv4(src, dst, tcp):
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp), 0, 0x4000, 64, 6, 0, src, dst)
+    return b'\x00\x01\x02\x03\x04\x05\x00\x01\x02\x03\x04\x06\x08\x00' + ip + tcp
+
+
+def segment(sport, dport, seq, ack, flags, win, opts=b'', payload=b''):
+    return struct.pack('!HHIIBBHHH', sport, dport, seq, ack, (20 + len(opts)) // 4 << 4, flags,
+                       win, 0, 0) + opts + payload
+
+
+def frame(rng):
+    # Ethernet frame with a TCP segment over IPv4 or IPv6
+    opts = options(rng)
+    payload = b'\x00' * rng.choice((0, 0, 1, 100, 1000))
+    tcp = segment(rng.randint(1, 65535), rng.choice((80, 6007, 40000)),
+                  rng.randint(0, 2**32 - 1), rng.randint(0, 2**32 - 1),
+                  rng.choice((0x02, 0x10, 0x12, 0x18, 0x11, 0x04)), rng.randint(0, 65535), opts, payload)
+    if rng.random() < 0.7:
+        return ipv4(address(rng, 4), address(rng, 4), tcp)
+    ip = struct.pack('!IHBB16s16s', 0x60000000, len(tcp), 6, 64, address(rng, 16), address(rng, 16))
+    return b'\x00\x01\x02\x03\x04\x05\x00\x01\x02\x03\x04\x06\x86\xdd' + ip + tcp
+
+
+class FastDecodeTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL) # decode warns about broken headers
+        self.info = pcapstats.Info(0)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def reference(self, buf):
+        try:
+            return ('ok', self.info.decode(dpkt.ethernet.Ethernet(buf).data))
+        except Exception as e:
+            return ('exception', type(e).__name__)
+
+    def test_same_as_dpkt(self):
+        rng = random.Random(5)
+        decoded = 0
+        for n in range(FRAMES):
+            buf = bytearray(frame(rng))
+            for m in range(rng.randint(0, 3)):
+                pos = rng.randint(12, len(buf) - 1)
+                buf[pos] = rng.randint(0, 255)
+            if rng.random() < 0.1:
+                buf = buf[:rng.randint(0, len(buf))]
+            buf = bytes(buf)
+            o, t = pcapstats.network(buf)
+            result = pcapstats.fastDecode(buf, o, t)
+            if result == None:
+                continue # left to dpkt
+            decoded += 1
+            self.assertEqual(('ok', result), self.reference(buf), repr(buf))
+        self.assertTrue(decoded > FRAMES / 4, decoded)
+
+    def test_large_wscale(self):
+        # shifts above 14 are clamped, the window must still fit the rcv_win column
+        a, b = b'\x0a\x00\x00\x01', b'\x0a\x00\x00\x02'
+        syn = ipv4(a, b, segment(40000, 80, 1000, 0, 0x02, 65535, struct.pack('!BBBB', 3, 3, 64, 1)))
+        o, t = pcapstats.network(syn)
+        self.assertEqual(pcapstats.MAX_WSCALE, pcapstats.fastDecode(syn, o, t)[10])
+        self.assertEqual(pcapstats.fastDecode(syn, o, t), self.reference(syn)[1])
+        for fast in (False, True):
+            analyzer = pcapstats.Analyzer(fast=fast, emit=lambda d: None)
+            analyzer.feed(1.0, syn)
+            analyzer.feed(1.1, ipv4(b, a, segment(80, 40000, 5000, 1001, 0x12, 65535)))
+            for i in range(10):
+                analyzer.feed(1.2 + i * 0.1, ipv4(a, b, segment(40000, 80, 1001, 5001 + i, 0x10, 65535 - i)))
+            analyzer.finish()
+
+
+if __name__ == '__main__':
+    unittest.main()
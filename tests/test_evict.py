@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+'''
+Info.evict against the scan of the whole connection table it replaced
+(random connections opened, closed with FIN or RST and left idle)
+Run: python -m unittest discover -s tests
+'''
+import logging
+import os
+import random
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pcapstats
+from test_decode import ipv4, segment
+
+RUNS = 10                   # random traces per test
+PACKETS = 3000              # packets per trace
+TIMEOUT = 5                 # idle timeout (sec)
+
+
+def refEvict(info, ts, timeout, linger=1):
+    # the connections the original Info.evict returned, the table is not changed
+    gone = set()
+    for key, halves in info.contable.items():
+        last = max([h.last_seen for h in halves if h])
+        closed = halves[0] and halves[1] \
+                 and (halves[0].fin or halves[0].rst) \
+                 and (halves[1].fin or halves[1].rst)
+        if ts - last > timeout or (closed and ts - last > linger):
+            gone.add(key)
+    return [c for c in info.connections if info.key(c)[0] in gone]
+
+
+class EvictTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_same_as_scan(self):
+        rng = random.Random(3)
+        for run in range(RUNS):
+            info = pcapstats.Info(0)
+            ts = 1000.0
+            sweep = 0
+            for n in range(PACKETS):
+                ts += rng.expovariate(100)
+                client = struct.pack('!I', 0x0a010000 + rng.randint(0, 60))
+                server = b'\x0a\x00\x00\x01'
+                port = 40000 + rng.randint(0, 3)
+                flags = rng.choice((0x02, 0x10, 0x10, 0x10, 0x18, 0x11, 0x04))
+                if rng.random() < 0.5:
+                    frame = ipv4(client, server, segment(port, 6007, 1000 + n, 5000, flags, 65535))
+                else:
+                    frame = ipv4(server, client, segment(6007, port, 5000 + n, 1000, flags, 65535, payload=b'\x00' * 100))
+                info.addFrame(ts, frame)
+                if rng.random() < 0.01:
+                    ts += rng.uniform(0, 2 * TIMEOUT) # quiet period
+                if ts >= sweep:
+                    sweep = ts + rng.choice((0.5, 1, 3))
+                    expected = refEvict(info, ts, TIMEOUT)
+                    count = len(info.connections)
+                    finished = info.evict(ts, TIMEOUT)
+                    self.assertEqual([id(c) for c in expected], [id(c) for c in finished], (run, n))
+                    self.assertEqual(count - len(finished), len(info.connections))
+                    self.assertEqual(0, len([c for c in finished if info.check(c) is c]))
+
+
+if __name__ == '__main__':
+    unittest.main()
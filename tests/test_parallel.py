@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+'''
+Parallel runs (jobs) against a single process, and with a worker that
+fails or dies: the run has to raise instead of waiting for it forever
+Run: python -m unittest discover -s tests
+'''
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import dpkt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pcapstats
+from test_decode import ipv4, segment
+
+CONNECTIONS = 200           # connections in the trace
+SEGMENTS = 25               # data segments per connection
+FAILURE = 3000              # packet of a worker to fail at
+
+
+def trace(path):
+    # CONNECTIONS interleaved transfers from port 6007, each segment ACKed
+    with open(path, 'wb') as f:
+        writer = dpkt.pcap.Writer(f)
+        ts = [1.0]
+        def write(src, dst, tcp):
+            writer.writepkt(ipv4(src, dst, tcp), ts[0])
+            ts[0] += 0.001
+        clients = [b'\x0a\x01' + bytes(bytearray([c >> 8, c & 0xff])) for c in range(CONNECTIONS)]
+        server = b'\x0a\x00\x00\x01'
+        for c in clients:
+            write(c, server, segment(40000, 6007, 1000, 0, 0x02, 65535))
+        for c in clients:
+            write(server, c, segment(6007, 40000, 5000, 1001, 0x12, 65535))
+        for i in range(SEGMENTS):
+            for c in clients:
+                write(server, c, segment(6007, 40000, 5001 + 1000 * i, 1001, 0x10, 65535, payload=b'\x00' * 1000))
+                write(c, server, segment(40000, 6007, 1001, 6001 + 1000 * i, 0x10, 65535))
+
+
+class ParallelTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'trace.pcap')
+        trace(self.path)
+        self.addFrame = pcapstats.Info.addFrame
+
+    def tearDown(self):
+        pcapstats.Info.addFrame = self.addFrame
+        shutil.rmtree(self.directory)
+        logging.disable(logging.NOTSET)
+
+    def failWith(self, failure):
+        # Info.addFrame of the (forked) workers calls failure at packet FAILURE
+        addFrame = self.addFrame
+        count = [0]
+        def failing(info, *args, **kwargs):
+            count[0] += 1
+            if count[0] == FAILURE:
+                failure()
+            return addFrame(info, *args, **kwargs)
+        pcapstats.Info.addFrame = failing
+
+    def analyse(self, stream):
+        return pcapstats.PcapInfo().run(filename=self.path, jobs=2, stream=stream, emit=lambda d: None)
+
+    def test_same_as_serial(self):
+        expected = pcapstats.PcapInfo().run(filename=self.path)
+        self.assertEqual(CONNECTIONS, len(expected))
+        self.assertEqual(expected, pcapstats.PcapInfo().run(filename=self.path, jobs=2))
+
+    def test_exception(self):
+        def failure():
+            raise KeyError('failure')
+        self.failWith(failure)
+        for stream in (False, True):
+            with self.assertRaises(RuntimeError) as e:
+                self.analyse(stream)
+            self.assertTrue('KeyError' in str(e.exception), str(e.exception))
+
+    def test_exit(self):
+        self.failWith(lambda: os._exit(3))
+        for stream in (False, True):
+            with self.assertRaises(RuntimeError) as e:
+                self.analyse(stream)
+            self.assertTrue('code 3' in str(e.exception), str(e.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+'''
+Scoreboard and SackHoles against the list algorithms they replaced
+(randomised SACK sequences, including malformed blocks)
+Run: python -m unittest discover -s tests
+'''
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pcapstats
+
+SEQUENCES = 1000            # random connections per test
+STEPS = 30                  # ACKs per connection
+
+
+def refScoreboard(sblocks, sack_blocks, ack, acked):
+    '''
+    One ACK on the scoreboard as in the original Info.addPacket
+    returns [(save_hole, newly_acked), ...] as passed to reorderSACK/sackRetrans
+    '''
+    events = []
+    done = 0
+    while done == 0:
+        done = 1
+        for block in sblocks:
+            if block[1] <= ack:
+                sblocks.remove(block)
+                done = 0
+                break
+
+    if len(sblocks) > 0:
+        for block in range(0, len(sack_blocks), 2):
+            done = 0
+            for i in range(len(sblocks)):
+                if sack_blocks[block+1] <= ack: #DSACK
+                    done = 1
+                    break
+                if sack_blocks[block] >= sblocks[i][0] and sack_blocks[block+1] <= sblocks[i][1]:
+                    done = 1
+                    break
+                save_hole = 0
+                newly_acked = []
+                if sack_blocks[block] == sblocks[i][0] and sack_blocks[block+1] > sblocks[i][1]:
+                    if i < len(sblocks)-1:
+                        save_hole = sblocks[i][1]
+                    newly_acked = [sblocks[i][1]]
+                    sblocks[i][1] = sack_blocks[block+1]
+                    done = 1
+                if sack_blocks[block] < sblocks[i][0] and sack_blocks[block+1] == sblocks[i][1] and done == 0:
+                    save_hole = sack_blocks[block]
+                    newly_acked = [save_hole]
+                    sblocks[i][0] = sack_blocks[block]
+                    done = 1
+                if sack_blocks[block] < sblocks[i][0] and sack_blocks[block+1] > sblocks[i][1] and done == 0:
+                    newly_acked = [sack_blocks[block], sblocks[i][1]]
+                    sblocks[i][0] = sack_blocks[block]
+                    sblocks[i][1] = sack_blocks[block+1]
+                    done = 1
+                events.append((save_hole, newly_acked))
+
+            if not done and len(sblocks) > 0:
+                for j in range(len(sblocks)):
+                    if sblocks[j][0] >= sack_blocks[block+1]:
+                        sblocks.insert(j, [sack_blocks[block], sack_blocks[block+1]])
+                        events.append((sack_blocks[block], [sack_blocks[block]]))
+                        done = 1
+                        break
+                if not done and sblocks[-1][1] < sack_blocks[block]:
+                    sblocks.append([sack_blocks[block], sack_blocks[block+1]])
+    else:
+        for block in range(0, len(sack_blocks), 2):
+            if sack_blocks[block] <= max(ack, acked):
+                continue
+            sblocks.insert(0, [sack_blocks[block], sack_blocks[block+1]])
+
+    done = 0
+    while done == 0:
+        done = 1
+        for i in range(len(sblocks)):
+            if len(sblocks) > i+1:
+                if sblocks[i][0] <= sblocks[i+1][0] and sblocks[i][1] >= sblocks[i+1][1]:
+                    sblocks.remove(sblocks[i+1])
+                    done = 0
+                    break
+                if sblocks[i][0] >= sblocks[i+1][0] and sblocks[i][1] <= sblocks[i+1][1]:
+                    sblocks.remove(sblocks[i])
+                    done = 0
+                    break
+                if sblocks[i][1] >= sblocks[i+1][0]:
+                    sblocks[i][1] = sblocks[i+1][1]
+                    sblocks.remove(sblocks[i+1])
+                    done = 0
+                    break
+    return events
+
+
+def scoreboard(sblocks, sack_blocks, ack, acked):
+    # the same ACK with Scoreboard, as Info.addPacket does it
+    events = []
+    sblocks.prune(ack)
+    if len(sblocks) > 0:
+        events = sblocks.merge(sack_blocks, ack)
+    else:
+        sblocks.fill(sack_blocks, max(ack, acked))
+    sblocks.combine()
+    return events
+
+
+def effective(events):
+    # (0, []) changes nothing in reorderSACK and sackRetrans
+    return [e for e in events if e != (0, [])]
+
+
+def sackBlocks(rng, ack):
+    # 1-4 SACK blocks above (or, as DSACK, below) ack, some degenerate
+    blocks = []
+    for b in range(rng.randint(1, 4)):
+        start = ack + rng.randint(-5, 40) * 100
+        end = start + rng.randint(-1, 8) * 100
+        if rng.random() < 0.05:
+            start, end = end, start
+        blocks += [start, end]
+    return blocks
+
+
+class ScoreboardTest(unittest.TestCase):
+    def test_same_as_lists(self):
+        rng = random.Random(7)
+        for n in range(SEQUENCES):
+            ack = acked = 1000
+            first = sackBlocks(rng, ack)
+            ref = [[first[b], first[b+1]] for b in range(0, len(first), 2)]
+            new = pcapstats.Scoreboard([[first[b], first[b+1]] for b in range(0, len(first), 2)])
+            for step in range(STEPS):
+                if rng.random() < 0.3:
+                    ack += rng.randint(0, 10) * 100
+                blocks = sackBlocks(rng, ack)
+                expected = refScoreboard(ref, blocks, ack, acked)
+                result = scoreboard(new, blocks, ack, acked)
+                self.assertEqual(effective(expected), effective(result), (n, step, blocks, ack))
+                self.assertEqual(ref, list(new), (n, step, blocks, ack))
+                acked = max(acked, ack)
+
+
+class SackHolesTest(unittest.TestCase):
+    def test_same_as_lists(self):
+        rng = random.Random(11)
+        for n in range(SEQUENCES):
+            ref = []
+            new = pcapstats.SackHoles()
+            ack = 1000
+            for step in range(STEPS):
+                if rng.random() < 0.3:
+                    ack += rng.randint(0, 10) * 100
+                    ref = [h for h in ref if h[1] > ack]
+                    new.prune(ack)
+                begin = ack + rng.randint(-2, 30) * 100
+                end = begin + rng.randint(-1, 6) * 100
+                if not [h for h in ref if begin >= h[0] and end <= h[1]]:
+                    ref.append([begin, end, step])
+                new.add(begin, end, step)
+
+                self.assertEqual(sorted(ref), sorted(new.holes + new.empty), (n, step))
+                for seqnr in range(ack - 200, ack + 4000, 50):
+                    expected = -1
+                    for h in ref:
+                        if seqnr >= h[0] and seqnr < h[1]:
+                            expected = h[2]
+                            break
+                    self.assertEqual(expected, new.find(seqnr), (n, step, seqnr))
+
+
+if __name__ == '__main__':
+    unittest.main()